@@ -0,0 +1,75 @@
+"""
+Approximate Search Benchmark
+Measures recall and latency of the IVF index against exact brute-force search
+
+Usage:
+    python benchmarks/bench_ann.py [--size 200000] [--nprobe 1 4 16 64]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+from embedding_index import BruteForceIndex, IVFFlatIndex
+
+
+def make_gallery(size: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Clustered synthetic embeddings; real galleries are far from uniform noise"""
+    centers = rng.standard_normal((max(1, size // 50), dim)).astype(np.float32) * 3.0
+    labels = rng.integers(0, centers.shape[0], size)
+    return centers[labels] + rng.standard_normal((size, dim)).astype(np.float32)
+
+
+def run_queries(index, queries, k):
+    start = time.perf_counter()
+    results = [[item_id for item_id, _ in index.search(query, k)] for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=0)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = make_gallery(args.size, args.dim, rng)
+    ids = [str(i) for i in range(args.size)]
+    picks = rng.integers(0, args.size, args.queries)
+    queries = embeddings[picks] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    exact = BruteForceIndex()
+    exact.add_batch(ids, embeddings)
+    truth, exact_ms = run_queries(exact, queries, args.k)
+
+    ivf = IVFFlatIndex(nlist=args.nlist, min_train_size=0)
+    ivf.add_batch(ids, embeddings)
+    start = time.perf_counter()
+    ivf.train()
+    train_s = time.perf_counter() - start
+
+    print(f"gallery={args.size} dim={args.dim} k={args.k} train={train_s:.1f}s")
+    print(f"{'index':>12} {'recall@1':>9} {'recall@k':>9} {'ms/query':>9}")
+    print(f"{'exact':>12} {1.0:>9.3f} {1.0:>9.3f} {exact_ms:>9.3f}")
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        found, ivf_ms = run_queries(ivf, queries, args.k)
+        recall_1 = np.mean([f[:1] == t[:1] for f, t in zip(found, truth)])
+        recall_k = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+        print(f"{'nprobe=' + str(nprobe):>12} {recall_1:>9.3f} {recall_k:>9.3f} {ivf_ms:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Batched Embedding Throughput Benchmark
+Measures faces per second of FaceRecognitionModule.get_face_embeddings at
+several batch sizes, against one get_face_embedding call per face
+
+Requires DeepFace and TensorFlow (webapp/requirements_web.txt).
+
+Usage:
+    python benchmarks/bench_batch_embedding.py [--batch-sizes 1 4 16 64] [--faces 128]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+from face_recognition_module import FaceRecognitionModule
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--faces', type=int, default=128)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    region = {'facial_area': {'x': 200, 'y': 120, 'w': 160, 'h': 160}}
+    faces = [(frame, region)] * args.faces
+
+    face_module = FaceRecognitionModule()
+    face_module.get_face_embeddings(faces[:1])  # Build the model outside the timings
+
+    print(f"{'mode':>14} {'faces/s':>9} {'ms/face':>9}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        face_module.get_face_embedding(frame, region)
+        start = time.perf_counter()
+        for face_frame, face_region in faces[:16]:
+            face_module.get_face_embedding(face_frame, face_region)
+        single_s = (time.perf_counter() - start) / 16
+    print(f"{'per-call':>14} {1 / single_s:>9.1f} {single_s * 1000:>9.2f}")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        for offset in range(0, len(faces), batch_size):
+            face_module.get_face_embeddings(faces[offset:offset + batch_size])
+        per_face = (time.perf_counter() - start) / len(faces)
+        print(f"{'batch=' + str(batch_size):>14} {1 / per_face:>9.1f} {per_face * 1000:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
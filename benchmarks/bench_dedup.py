@@ -0,0 +1,62 @@
+"""
+Gallery Deduplication Benchmark
+Time, recall and peak memory of the exact and IVF duplicate searches on a
+synthetic gallery with planted duplicate registrations
+
+Usage:
+    python benchmarks/bench_dedup.py [--users 100000] [--duplicates 1000] [--block-rows 4096]
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+from embedding_index import create_index
+from deduplicate import find_clusters
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far (Linux reports KiB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--duplicates', type=int, default=1000)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--block-rows', type=int, default=4096)
+    parser.add_argument('--probe', type=int, default=4)
+    parser.add_argument('--methods', nargs='+', default=['ivf', 'exact'])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((args.users, args.dim)).astype(np.float32)
+    originals = rng.choice(args.users, args.duplicates, replace=False)
+    copies = centres[originals] + 0.05 * rng.standard_normal((args.duplicates, args.dim)).astype(np.float32)
+
+    index = create_index('brute')
+    index.add_batch([str(i) for i in range(args.users + args.duplicates)], np.vstack([centres, copies]))
+    expected = {(int(original), args.users + n) for n, original in enumerate(originals)}
+    print(f"{args.users} users + {args.duplicates} duplicates, {args.dim}-d, "
+          f"{index.nbytes() / 2**20:.0f} MB of embeddings, baseline RSS {peak_rss_mb():.0f} MB")
+
+    for method in args.methods:
+        start = time.perf_counter()
+        clusters = find_clusters(index, 0.7, method, args.block_rows, args.probe)
+        elapsed = time.perf_counter() - start
+        found = {(int(rows[0]), int(rows[1])) for rows in clusters if len(rows) == 2}
+        print(f"{method:>6}: {elapsed:8.1f}s, recall {len(found & expected) / len(expected):.3f}, "
+              f"{len(clusters)} clusters, peak RSS {peak_rss_mb():.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Detection Scale Benchmark
+Measures JPEG decode time at each reduction factor (IMREAD_REDUCED_COLOR_*)
+and, given a photo with a face, what detecting on the reduced frame changes:
+detector time, box agreement once mapped back to full resolution, and the
+embedding distance between the full-resolution crops of both boxes
+
+The decode part needs only OpenCV. The detection part (--image) requires
+DeepFace and TensorFlow (webapp/requirements_web.txt).
+
+Usage:
+    python benchmarks/bench_detection_scale.py [--sizes 640x480 1280x720] [--image portrait.jpg]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+from detection_scale import IMREAD_FLAGS, DetectionScale, ScaledFrame, decode, scale_faces
+
+
+def make_jpeg(width: int, height: int, quality: int = 80) -> bytes:
+    """A synthetic camera-like frame: gradients plus a few shapes, JPEG encoded"""
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.dstack([(x * 255 // width), (y * 255 // height), ((x + y) * 127 // (width + height))]).astype(np.uint8)
+    cv2.circle(frame, (width // 2, height // 2), height // 4, (190, 170, 150), -1)
+    cv2.rectangle(frame, (width // 8, height // 8), (width // 4, height // 3), (40, 80, 200), -1)
+    noise = np.random.default_rng(0).integers(0, 20, frame.shape, dtype=np.uint8)
+    _, encoded = cv2.imencode('.jpg', cv2.add(frame, noise), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def time_ms(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def iou(a: dict, b: dict) -> float:
+    """Intersection over union of two {x, y, w, h} boxes"""
+    left, top = max(a['x'], b['x']), max(a['y'], b['y'])
+    right, bottom = min(a['x'] + a['w'], b['x'] + b['w']), min(a['y'] + a['h'], b['y'] + b['h'])
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = a['w'] * a['h'] + b['w'] * b['h'] - inter
+    return inter / union if union else 0.0
+
+
+def bench_decode(sizes, repeat: int):
+    print(f"{'frame':>10} {'factor':>6} {'decoded':>10} {'decode ms':>10} {'speedup':>8}")
+    for width, height in sizes:
+        jpeg = make_jpeg(width, height)
+        full_ms = None
+        for factor in IMREAD_FLAGS:
+            img = decode(jpeg, factor)
+            ms = time_ms(lambda: decode(jpeg, factor), repeat)
+            full_ms = full_ms or ms
+            print(f"{width}x{height:<5} {factor:>6} {img.shape[1]:>5}x{img.shape[0]:<4} {ms:>10.2f} "
+                  f"{full_ms / ms:>7.1f}x")
+        # The factor a client streaming this size gets while no face is in view
+        scale = DetectionScale()
+        scale.update(ScaledFrame(jpeg), [])
+        print(f"{'':>10} chosen factor with no face in view: {scale.factor}")
+
+
+def bench_detection(path: str, repeat: int):
+    from face_recognition_module import FaceRecognitionModule
+
+    with open(path, 'rb') as f:
+        img_bytes = f.read()
+    face_module = FaceRecognitionModule(preload=False)
+    full = ScaledFrame(img_bytes)
+    reference = face_module.detect_aligned_faces(full.image)
+    if not reference:
+        sys.exit(f"No face found in {path} at full resolution")
+    reference_box = max(reference, key=lambda f: f['facial_area']['w'])
+    reference_embedding = face_module.get_face_embedding(full.full, reference_box)
+
+    scale = DetectionScale()
+    scale.update(full, reference)
+    print(f"\n{path}: {full.image.shape[1]}x{full.image.shape[0]}, face {reference_box['facial_area']['w']}px wide, "
+          f"adaptive factor {scale.factor}")
+    print(f"{'factor':>6} {'decode+detect ms':>17} {'box IoU':>8} {'embedding distance':>19}")
+    for factor in IMREAD_FLAGS:
+        frame = ScaledFrame(img_bytes, factor)
+        ms = time_ms(lambda: face_module.detect_aligned_faces(ScaledFrame(img_bytes, factor).image), repeat)
+        faces = scale_faces(face_module.detect_aligned_faces(frame.image), factor)
+        if not faces:
+            print(f"{factor:>6} {ms:>17.1f} {'missed':>8}")
+            continue
+        face = max(faces, key=lambda f: f['facial_area']['w'])
+        embedding = face_module.get_face_embedding(frame.full, face)
+        distance = float(np.linalg.norm(embedding - reference_embedding))
+        print(f"{factor:>6} {ms:>17.1f} {iou(face['facial_area'], reference_box['facial_area']):>8.3f} "
+              f"{distance:>19.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1280x720', '1920x1080'])
+    parser.add_argument('--image', help='Photo with a face for the detection comparison')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    bench_decode([tuple(int(v) for v in size.split('x')) for size in args.sizes], args.repeat)
+    if args.image:
+        bench_detection(args.image, max(1, args.repeat // 10))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Frame Gate Benchmark
+Plays a simulated camera session through the frame gate and reports how many
+detector calls it saves, what the gate itself costs, and how often it gets
+a frame wrong
+
+The session is an empty room with sensor noise, a person walking in, standing
+still, walking out, and a lighting change. The detector is simulated, so no
+models are needed: after --detector-ms it returns what DeepFace.extract_faces
+would (the true face box, or the whole-frame placeholder with confidence 0
+when there is none), filtered the way detect_aligned_faces filters it.
+The Haar pre-filter needs a real face: pass a portrait photo with --face,
+otherwise only motion gating is measured.
+
+Usage:
+    python benchmarks/bench_frame_gate.py --face portrait.jpg [--frames 300] [--detector-ms 40]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from face_recognition_module import confident_faces
+from frame_gate import DETECTED, NO_FACE, UNCHANGED, FrameGate
+
+
+def make_room(width: int, height: int) -> np.ndarray:
+    """Static background with some texture and furniture"""
+    rng = np.random.default_rng(0)
+    room = cv2.GaussianBlur(rng.integers(60, 140, (height, width, 3)).astype(np.uint8), (0, 0), 8)
+    cv2.rectangle(room, (width // 32, height // 24), (width // 4, height * 5 // 6), (200, 200, 200), -1)
+    cv2.line(room, (0, height - 10), (width, height * 5 // 8), (30, 30, 30), 3)
+    cv2.circle(room, (width * 13 // 16, height // 4), height // 8, (20, 80, 160), -1)
+    return room
+
+
+def session(room: np.ndarray, face: np.ndarray, frames: int):
+    """
+    Yield (frame, true face box or None) for one simulated session
+
+    Phases, each a fifth of the frames: empty, walking in, standing still,
+    walking out, empty with the lights dimmed.
+    """
+    rng = np.random.default_rng(1)
+    height, width = room.shape[:2]
+    face_h, face_w = face.shape[:2]
+    phase_length = max(1, frames // 5)
+    for index in range(frames):
+        phase, step = divmod(index, phase_length)
+        frame = room.copy()
+        box = None
+        if phase in (1, 2, 3):
+            progress = step / phase_length
+            if phase == 1:
+                x = int(-face_w + progress * (width // 2))
+            elif phase == 2:
+                x = width // 2 - face_w + int(2 * np.sin(step / 3))  # Small sway
+            else:
+                x = int(width // 2 - face_w + progress * width)
+            y = height // 8
+            left, right = max(x, 0), min(x + face_w, width)
+            # Count the face once nearly all of it is in view; the detector misses half faces too
+            if right - left >= face_w * 9 // 10:
+                frame[y:y + face_h, left:right] = face[:, left - x:right - x]
+                box = {'x': left, 'y': y, 'w': right - left, 'h': face_h}
+        elif phase >= 4:
+            frame = (frame * 0.6).astype(np.uint8)
+        noise = rng.normal(0, 3, frame.shape)
+        yield np.clip(frame + noise, 0, 255).astype(np.uint8), box
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--face', help='Portrait photo placed in the scene (enables the Haar pre-filter)')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--width', type=int, default=config.CAMERA_WIDTH)
+    parser.add_argument('--height', type=int, default=config.CAMERA_HEIGHT)
+    parser.add_argument('--detector-ms', type=float, default=40, help='Simulated detector latency')
+    args = parser.parse_args()
+
+    room = make_room(args.width, args.height)
+    if args.face:
+        face = cv2.imread(args.face, cv2.IMREAD_COLOR)
+        if face is None:
+            sys.exit(f"Cannot read {args.face}")
+        scale = args.height * 0.6 / face.shape[0]
+        face = cv2.resize(face, (int(face.shape[1] * scale), int(face.shape[0] * scale)))
+    else:
+        # A flat oval: moves like a face, but the pre-filter would not see one
+        face = np.full((args.height * 6 // 10, args.height * 4 // 10, 3), 90, dtype=np.uint8)
+        cv2.ellipse(face, (face.shape[1] // 2, face.shape[0] // 2), (face.shape[1] // 2 - 2, face.shape[0] // 2 - 2),
+                    0, 0, 360, (150, 170, 200), -1)
+        print("No --face photo given: measuring motion gating only")
+
+    truth = {}
+
+    def detect(frame):
+        time.sleep(args.detector_ms / 1000.0)
+        if truth['box']:
+            faces = [{'facial_area': truth['box'], 'confidence': 0.98}]
+        else:
+            faces = [{'facial_area': {'x': 0, 'y': 0, 'w': frame.shape[1], 'h': frame.shape[0]}, 'confidence': 0}]
+        return confident_faces(faces)
+
+    for label, prefilter in (('motion only', False), ('motion + pre-filter', True)):
+        if prefilter and not args.face:
+            continue
+        gate = FrameGate(prefilter=prefilter)
+        decisions = {DETECTED: 0, UNCHANGED: 0, NO_FACE: 0}
+        missed = stale = 0
+        gate_seconds = 0.0
+        total = 0.0
+        for frame, box in session(room, face, args.frames):
+            truth['box'] = box
+            start = time.perf_counter()
+            faces, decision = gate.run(frame, detect)
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            gate_seconds += elapsed - (args.detector_ms / 1000.0 if decision == DETECTED else 0)
+            decisions[decision] += 1
+            if box and not faces:
+                missed += 1
+            elif box and faces and abs(faces[0]['facial_area']['x'] - box['x']) > box['w'] // 4:
+                stale += 1
+
+        saved = args.frames - decisions[DETECTED]
+        print(f"{label}: {decisions[DETECTED]} detector calls for {args.frames} frames "
+              f"({saved} saved, skip rate {saved / args.frames:.1%}: "
+              f"{decisions[UNCHANGED]} unchanged, {decisions[NO_FACE]} no face)")
+        print(f"  gate overhead {gate_seconds / args.frames * 1000:.2f} ms/frame, "
+              f"gate + detector {total:.2f}s vs {args.frames * args.detector_ms / 1000:.2f}s ungated")
+        print(f"  face frames returned without the face: {missed}, with a box off by >1/4 face: {stale}")
+
+
+if __name__ == '__main__':
+    main()
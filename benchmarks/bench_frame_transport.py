@@ -0,0 +1,115 @@
+"""
+Frame Transport Benchmark
+Compares the base64 JSON POST path with raw binary WebSocket frames:
+payload size and server-side decode time, plus optional end-to-end
+latency against a running server
+
+Usage:
+    python benchmarks/bench_frame_transport.py [--width 640 --height 480] [--url http://localhost:5000]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+
+def make_jpeg(width: int, height: int, quality: int = 80) -> bytes:
+    """A synthetic camera-like frame: gradients plus a few shapes, JPEG encoded"""
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.dstack([(x * 255 // width), (y * 255 // height), ((x + y) * 127 // (width + height))]).astype(np.uint8)
+    cv2.circle(frame, (width // 2, height // 2), height // 4, (190, 170, 150), -1)
+    cv2.rectangle(frame, (width // 8, height // 8), (width // 4, height // 3), (40, 80, 200), -1)
+    noise = np.random.default_rng(0).integers(0, 20, frame.shape, dtype=np.uint8)
+    _, encoded = cv2.imencode('.jpg', cv2.add(frame, noise), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def http_body(jpeg: bytes) -> bytes:
+    """Request body the browser sends today: a data URL inside JSON"""
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii')
+    return json.dumps({'image': data_url}).encode('utf-8')
+
+
+def decode_http(body: bytes):
+    """Server work for the HTTP path, mirroring face_routes.decode_image"""
+    image_data = json.loads(body)['image']
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    img_bytes = base64.b64decode(image_data)
+    return cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+def decode_binary(jpeg: bytes):
+    """Server work for the WebSocket path, mirroring face_routes.decode_image_bytes"""
+    return cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+
+def time_ms(fn, arg, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def end_to_end(url: str, jpeg: bytes, repeat: int):
+    """Round-trip latency of /api/face/detect vs the 'frame' Socket.IO event"""
+    import socketio
+
+    body = http_body(jpeg)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        req = urllib.request.Request(url + '/api/face/detect', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(req).read()
+    http_ms = (time.perf_counter() - start) / repeat * 1000
+
+    client = socketio.Client()
+    answered = threading.Event()
+    client.on('frame_result', lambda result: answered.set())
+    client.on('frame_dropped', lambda info: answered.set())
+    client.connect(url)
+    start = time.perf_counter()
+    for seq in range(repeat):
+        answered.clear()
+        client.emit('frame', {'image': jpeg, 'mode': 'detect', 'seq': seq})
+        answered.wait(timeout=60)
+    ws_ms = (time.perf_counter() - start) / repeat * 1000
+    client.disconnect()
+    return http_ms, ws_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--url', help='Running server to measure end-to-end latency against')
+    args = parser.parse_args()
+
+    jpeg = make_jpeg(args.width, args.height)
+    body = http_body(jpeg)
+
+    print(f"frame {args.width}x{args.height}")
+    print(f"{'path':>10} {'payload B':>10} {'decode ms':>10}")
+    print(f"{'http':>10} {len(body):>10} {time_ms(decode_http, body, args.repeat):>10.3f}")
+    print(f"{'binary':>10} {len(jpeg):>10} {time_ms(decode_binary, jpeg, args.repeat):>10.3f}")
+
+    if args.url:
+        http_ms, ws_ms = end_to_end(args.url.rstrip('/'), jpeg, max(1, args.repeat // 10))
+        print(f"end-to-end /detect: http {http_ms:.1f} ms, websocket {ws_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
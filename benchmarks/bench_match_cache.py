@@ -0,0 +1,85 @@
+"""
+Match Cache Benchmark
+Replays a kiosk-like workload (a few regulars seen over and over) against
+find_matching_user with and without the match cache
+
+Usage:
+    python benchmarks/bench_match_cache.py [--users 100000] [--regulars 20] [--queries 500]
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+
+def load_gallery(storage: StorageManager, embeddings: np.ndarray):
+    storage.users = [{
+        'user_id': str(uuid.uuid4()),
+        'timestamp': '',
+        'face_embedding': embedding.tolist(),
+        'embedding_dim': embeddings.shape[1],
+        'model_name': 'Facenet',
+        'data': {'name': f'user-{i}'}
+    } for i, embedding in enumerate(embeddings)]
+    storage._rebuild_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--regulars', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dim', type=int, default=128)
+    args = parser.parse_args()
+    # Keep per-user storage logging out of the results
+    logging.getLogger('facerec').setLevel(logging.WARNING)
+
+    config.INDEX_TYPE = 'brute'
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.users, args.dim)).astype(np.float32)
+    regulars = rng.choice(args.users, args.regulars, replace=False)
+    picks = regulars[rng.integers(0, args.regulars, args.queries)]
+    queries = embeddings[picks] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    # Random unit-variance embeddings are far apart; scale the threshold to match
+    threshold = 0.5 * np.sqrt(args.dim)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for enabled in (False, True):
+            config.MATCH_CACHE_ENABLED = enabled
+            storage = StorageManager(os.path.join(tmp, f'users_{enabled}.json'))
+            load_gallery(storage, embeddings)
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # Silence per-match logging
+                matched = [storage.find_matching_user(query, threshold)['data']['name'] for query in queries]
+            elapsed_ms = (time.perf_counter() - start) / args.queries * 1000
+            results[enabled] = (matched, elapsed_ms, storage.get_cache_stats())
+
+    assert results[True][0] == results[False][0], "cached matches differ from the full search"
+
+    print(f"{args.users} users, {args.regulars} regulars, {args.queries} queries")
+    print(f"  full search:  {results[False][1]:.3f} ms/query")
+    print(f"  with cache:   {results[True][1]:.3f} ms/query")
+    stats = results[True][2]
+    print(f"  hit rate {stats['hit_rate']:.1%}, hit {stats['mean_hit_ms']} ms vs miss {stats['mean_miss_ms']} ms, "
+          f"{stats['evictions']} evictions")
+
+
+if __name__ == '__main__':
+    main()
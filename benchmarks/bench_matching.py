@@ -0,0 +1,97 @@
+"""
+Gallery Matching Benchmark
+Compares the per-user matching loop against the batched embedding matrix
+
+Usage:
+    python benchmarks/bench_matching.py [--sizes 1000 10000 100000] [--queries 50]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+
+def make_gallery(size: int, dim: int, rng: np.random.Generator):
+    """Build synthetic user records shaped like the JSON database"""
+    embeddings = rng.standard_normal((size, dim)).astype(np.float32)
+    users = [{
+        'user_id': str(uuid.uuid4()),
+        'timestamp': '',
+        'face_embedding': embedding.tolist(),
+        'embedding_dim': dim,
+        'model_name': 'Facenet',
+        'data': {'name': f'user-{i}'}
+    } for i, embedding in enumerate(embeddings)]
+    return users, embeddings
+
+
+def legacy_find(storage: StorageManager, users, query: np.ndarray):
+    """The original matching loop: one np.array and one norm per user"""
+    best_match = None
+    best_distance = float('inf')
+    for user in users:
+        distance = storage._calculate_distance(query, np.array(user['face_embedding']))
+        if distance < best_distance:
+            best_distance = distance
+            best_match = user
+    return best_match, best_distance
+
+
+def time_per_query(fn, queries) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--dim', type=int, default=128)
+    args = parser.parse_args()
+
+    # Measure the exact matrix scan, not the approximate index
+    config.INDEX_TYPE = 'brute'
+
+    rng = np.random.default_rng(0)
+    print(f"{'users':>8} {'loop ms':>10} {'matrix ms':>10} {'speedup':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = StorageManager(os.path.join(tmp, 'users_database.json'))
+
+        for size in args.sizes:
+            users, embeddings = make_gallery(size, args.dim, rng)
+            # The index takes ownership of the embedding lists, so the loop gets its own copies
+            legacy_users = [dict(user) for user in users]
+            storage.users = users
+            storage._rebuild_index()
+
+            # Perturbed gallery rows so every query has a true nearest neighbour
+            picks = rng.integers(0, size, args.queries)
+            queries = embeddings[picks] + 0.01 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+            for query, pick in zip(queries, picks):
+                expected = storage.users[pick]['user_id']
+                assert legacy_find(storage, legacy_users, query)[0]['user_id'] == expected
+                assert storage.find_top_matches(query, k=1)[0][0]['user_id'] == expected
+
+            loop_ms = time_per_query(lambda q: legacy_find(storage, legacy_users, q), queries)
+            matrix_ms = time_per_query(lambda q: storage.find_top_matches(q, k=5), queries)
+            print(f"{size:>8} {loop_ms:>10.3f} {matrix_ms:>10.3f} {loop_ms / matrix_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
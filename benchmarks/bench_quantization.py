@@ -0,0 +1,69 @@
+"""
+Embedding Quantization Benchmark
+Accuracy-vs-memory report for float32, float16 and int8 embedding storage
+on a synthetic gallery
+
+Each identity gets a random centre; probes are the centre plus noise, so
+"recall" is how often the probe's own identity comes back as the top match.
+Agreement and distance error are measured against the float32 index.
+
+Usage:
+    python benchmarks/bench_quantization.py [--users 200000] [--queries 500] [--noise 1.0]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+from embedding_index import PRECISIONS, create_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--noise', type=float, default=1.0,
+                        help='Probe noise relative to the per-dimension spread of identity centres')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((args.users, args.dim)).astype(np.float32)
+    ids = [str(i) for i in range(args.users)]
+    truth = rng.integers(0, args.users, args.queries)
+    probes = centres[truth] + args.noise * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    reference = None
+    print(f"{args.users} identities, {args.dim}-d, {args.queries} probes (noise {args.noise})")
+    print(f"{'precision':>10} {'MB':>9} {'B/user':>7} {'GB @1M':>7} {'recall@1':>9} "
+          f"{'agree':>7} {'max |dd|':>9} {'ms/query':>9}")
+
+    for precision in PRECISIONS:
+        index = create_index('brute', precision=precision)
+        index.add_batch(ids, centres)
+
+        start = time.perf_counter()
+        top = [index.search(probe, k=1)[0] for probe in probes]
+        ms_per_query = (time.perf_counter() - start) / args.queries * 1000
+
+        matched = np.array([int(item_id) for item_id, _ in top])
+        distances = np.array([distance for _, distance in top])
+        if reference is None:
+            reference = (matched, distances)
+
+        bytes_per_user = index.nbytes() / args.users
+        print(f"{precision:>10} {index.nbytes() / 2**20:>9.1f} {bytes_per_user:>7.0f} "
+              f"{bytes_per_user * 1e6 / 2**30:>7.2f} {np.mean(matched == truth):>9.3f} "
+              f"{np.mean(matched == reference[0]):>7.3f} "
+              f"{np.max(np.abs(distances - reference[1])):>9.4f} {ms_per_query:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
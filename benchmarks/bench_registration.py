@@ -0,0 +1,90 @@
+"""
+Registration Latency Benchmark
+Compares add_user latency with the write-ahead journal against rewriting
+the whole database on every registration, at several gallery sizes
+
+Usage:
+    python benchmarks/bench_registration.py [--sizes 1000 10000 50000] [--adds 20]
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+
+def build_database(path: str, storage_format: str, size: int, dim: int, rng: np.random.Generator):
+    """Write a synthetic database of `size` users in one snapshot"""
+    storage = StorageManager(path, storage_format=storage_format)
+    embeddings = rng.standard_normal((size, dim)).astype(np.float32)
+    storage.users = [{
+        'user_id': str(uuid.uuid4()),
+        'timestamp': '',
+        'face_embedding': embedding.tolist(),
+        'embedding_dim': dim,
+        'model_name': config.FACE_RECOGNITION_MODEL,
+        'data': {'name': f'user-{i}'}
+    } for i, embedding in enumerate(embeddings)]
+    storage._rebuild_index()
+    storage.save_database()
+
+
+def time_registrations(path: str, storage_format: str, adds: int, dim: int, rng: np.random.Generator):
+    """Mean and max add_user latency in milliseconds"""
+    storage = StorageManager(path, storage_format=storage_format)
+    latencies = []
+    for i in range(adds):
+        embedding = rng.standard_normal(dim).astype(np.float32)
+        start = time.perf_counter()
+        storage.add_user({'name': f'new-{i}'}, embedding)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.mean(latencies), np.max(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--adds', type=int, default=20)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--format', choices=['json', 'binary'], default='json')
+    args = parser.parse_args()
+    # Keep per-user storage logging out of the results
+    logging.getLogger('facerec').setLevel(logging.WARNING)
+
+    # Keep compaction out of the measured window
+    config.JOURNAL_COMPACT_EVERY = args.adds + 1
+    config.INDEX_TYPE = 'brute'
+
+    rng = np.random.default_rng(0)
+    print(f"{'users':>8} {'rewrite mean/max ms':>22} {'journal mean/max ms':>22}")
+
+    for size in args.sizes:
+        results = []
+        for journal_enabled in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'users_database.json')
+                config.JOURNAL_ENABLED = journal_enabled
+                with contextlib.redirect_stdout(io.StringIO()):
+                    build_database(path, args.format, size, args.dim, rng)
+                    results.append(time_registrations(path, args.format, args.adds, args.dim, rng))
+
+        (rewrite_mean, rewrite_max), (journal_mean, journal_max) = results
+        print(f"{size:>8} {rewrite_mean:>12.2f} / {rewrite_max:>7.2f} {journal_mean:>12.2f} / {journal_max:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
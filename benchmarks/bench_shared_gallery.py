@@ -0,0 +1,185 @@
+"""
+Shared Gallery Benchmark
+Runs several processes on one binary store, the way gunicorn workers would,
+with and without SHARED_GALLERY, and has each of them register one user
+
+Reports per worker the memory loading the gallery costs it and what
+registering one user adds (private memory and PSS from
+/proc/self/smaps_rollup, so Linux only), how many of the users the others
+registered it can match, and how long it takes to pick them up: the first
+search after the registrations versus a full reload of the database.
+
+Then every worker adds --templates captures to its own user, as /register
+does for a face it already knows. Reported: the time per add_template, the
+time the others' next search takes to apply them, and how many of the other
+users' template sets each worker sees afterwards. Without SHARED_GALLERY
+every capture rewrites the whole database, and the workers rewrite the
+same snapshot files at once; their errors are not shown.
+
+Usage:
+    python benchmarks/bench_shared_gallery.py [--users 200000] [--workers 4] [--precision float32] [--templates 10]
+"""
+
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+
+def build_gallery(database_path: str, users: int, dim: int = 128):
+    """Write a synthetic binary gallery"""
+    storage = StorageManager(database_path, storage_format='binary')
+    embeddings = np.random.default_rng(0).standard_normal((users, dim)).astype(np.float32)
+    storage.users = [{
+        'user_id': str(uuid.uuid4()),
+        'timestamp': '',
+        'face_embedding': embedding.tolist(),
+        'embedding_dim': dim,
+        'model_name': config.FACE_RECOGNITION_MODEL,
+        'data': {'name': f'user-{i}'}
+    } for i, embedding in enumerate(embeddings)]
+    storage._rebuild_index()
+    storage.save_database()
+
+
+def memory() -> dict:
+    """PSS and private memory of this process in MB"""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'pss': fields.get('Pss', 0), 'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)}
+
+
+def worker(position: int, database_path: str, shared: bool, templates: int, barrier, results):
+    config.SHARED_GALLERY = shared
+    config.JOURNAL_ENABLED = False
+    logging.getLogger('facerec').setLevel(logging.CRITICAL)
+    before = memory()
+    storage = StorageManager(database_path, storage_format='binary')
+    loaded = memory()
+    dim = storage.index.dim
+
+    # Everyone registers one user, then looks for everyone else's
+    embedding = np.random.default_rng(1000 + position).standard_normal(dim).astype(np.float32)
+    storage.add_user({'name': f'worker-{position}'}, embedding)
+    barrier.wait()
+    started = time.perf_counter()
+    storage.find_matching_user(embedding)
+    first_search = time.perf_counter() - started
+    started = time.perf_counter()
+    storage.find_matching_user(embedding)
+    search = time.perf_counter() - started
+
+    others = [np.random.default_rng(1000 + other).standard_normal(dim).astype(np.float32)
+              for other in range(barrier.parties) if other != position]
+    found = sum(storage.find_matching_user(other) is not None for other in others)
+    after = memory()
+    barrier.wait()  # Measure before anyone adds templates
+
+    # Everyone adds captures to their own user, then searches once more
+    user_id = next(user['user_id'] for user in storage.get_all_users() if user['data']['name'] == f'worker-{position}')
+    rng = np.random.default_rng(2000 + position)
+    started = time.perf_counter()
+    for _ in range(templates):
+        storage.add_template(user_id, embedding + 0.1 * rng.standard_normal(dim).astype(np.float32))
+    template = (time.perf_counter() - started) / max(templates, 1)
+    barrier.wait()
+    started = time.perf_counter()
+    storage.find_matching_user(embedding)
+    template_sync = time.perf_counter() - started
+    expected = min(templates + 1, config.MAX_TEMPLATES_PER_USER)
+    templates_seen = sum(storage.template_count(user['user_id']) == expected for user in storage.get_all_users()
+                         if user['data']['name'].startswith('worker-') and user['user_id'] != user_id)
+    barrier.wait()  # Measure before anyone reloads or exits
+
+    started = time.perf_counter()
+    storage.load_database()
+    reload = time.perf_counter() - started
+    results.put({
+        'position': position,
+        'load_private': loaded['private'] - before['private'],
+        'register_private': after['private'] - loaded['private'],
+        'register_pss': after['pss'] - loaded['pss'],
+        'found': found,
+        'first_search': first_search,
+        'search': search,
+        'reload': reload,
+        'template': template,
+        'template_sync': template_sync,
+        'templates_seen': templates_seen
+    })
+
+
+def run(database_path: str, workers: int, shared: bool, templates: int) -> list:
+    barrier = mp.Barrier(workers)
+    results = mp.Queue()
+    processes = [mp.Process(target=worker, args=(position, database_path, shared, templates, barrier, results))
+                 for position in range(workers)]
+    for process in processes:
+        process.start()
+    rows = sorted((results.get() for _ in processes), key=lambda row: row['position'])
+    for process in processes:
+        process.join()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200000, help='Synthetic gallery size')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--precision', default=config.EMBEDDING_PRECISION, choices=['float32', 'float16', 'int8'])
+    parser.add_argument('--templates', type=int, default=10, help='Captures each worker adds to its user')
+    args = parser.parse_args()
+    config.EMBEDDING_PRECISION = args.precision
+    logging.getLogger('facerec').setLevel(logging.WARNING)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{args.users} users, {args.precision}, {args.workers} workers")
+        results = {}
+        for shared in (False, True):
+            # A fresh store per mode, so the page cache starts equally cold
+            database_path = os.path.join(work_dir, 'shared' if shared else 'default', 'users_database.json')
+            build_gallery(database_path, args.users)
+            results['shared' if shared else 'default'] = run(database_path, args.workers, shared, args.templates)
+
+        print(f"{'mode':>8} {'load private':>13} {'+register private':>18} {'+register PSS':>14} "
+              f"{'others found':>13} {'first search ms':>16} {'search ms':>10} {'full reload ms':>15}")
+        for mode, rows in results.items():
+            print(f"{mode:>8} {np.mean([r['load_private'] for r in rows]):>12.1f}M "
+                  f"{np.mean([r['register_private'] for r in rows]):>17.1f}M "
+                  f"{np.mean([r['register_pss'] for r in rows]):>13.1f}M "
+                  f"{np.mean([r['found'] for r in rows]):>6.1f} of {args.workers - 1:<4} "
+                  f"{np.mean([r['first_search'] for r in rows]) * 1000:>16.2f} "
+                  f"{np.mean([r['search'] for r in rows]) * 1000:>10.2f} "
+                  f"{np.mean([r['reload'] for r in rows]) * 1000:>15.1f}")
+
+        print(f"\n{args.templates} templates per worker")
+        print(f"{'mode':>8} {'add_template ms':>16} {'next search ms':>15} {'templates seen':>16}")
+        for mode, rows in results.items():
+            print(f"{mode:>8} {np.mean([r['template'] for r in rows]) * 1000:>16.2f} "
+                  f"{np.mean([r['template_sync'] for r in rows]) * 1000:>15.2f} "
+                  f"{np.mean([r['templates_seen'] for r in rows]):>8.1f} of {args.workers - 1:<4}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Startup Benchmark
+Measures how long importing the web app takes and what it loads, then boots
+gunicorn with and without PRELOAD_APP and reports per-worker memory
+
+Import: seconds and RSS for `import app`, whether TensorFlow came with it,
+whether the lightweight endpoints answer without it, and what importing
+DeepFace later costs (when installed).
+
+Workers: boot time and, per worker, RSS, PSS (shared pages split between
+the processes sharing them) and private memory from /proc/<pid>/smaps_rollup.
+Linux only; needs gunicorn and eventlet (webapp/requirements_web.txt).
+Pass --models to build the models in every worker (needs DeepFace).
+
+Usage:
+    python benchmarks/bench_startup.py [--users 20000] [--workers 4] [--models]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+webapp_dir = os.path.join(root_dir, 'webapp')
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, %(webapp_dir)r)
+import app
+result = {'import_seconds': time.perf_counter() - start}
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+
+result['rss_mb'] = rss_mb()
+client = app.app.test_client()
+result['endpoints'] = {path: client.get(path).status_code
+                       for path in ('/api/status', '/api/user/count', '/api/user/list', '/api/template')}
+result['tensorflow_loaded'] = 'tensorflow' in sys.modules
+try:
+    start = time.perf_counter()
+    app.import_deepface()
+    result['deepface_seconds'] = time.perf_counter() - start
+    result['deepface_rss_mb'] = rss_mb() - result['rss_mb']
+except ImportError:
+    result['deepface_seconds'] = None
+print(json.dumps(result))
+"""
+
+
+def build_gallery(data_dir: str, users: int, dim: int = 128):
+    """Write a synthetic JSON gallery where the app expects it (data/ under its working directory)"""
+    storage = StorageManager(os.path.join(data_dir, os.path.basename(config.DATABASE_PATH)), storage_format='json')
+    embeddings = np.random.default_rng(0).standard_normal((users, dim)).astype(np.float32)
+    storage.users = [{
+        'user_id': str(uuid.uuid4()),
+        'timestamp': '',
+        'face_embedding': embedding.tolist(),
+        'embedding_dim': dim,
+        'model_name': config.FACE_RECOGNITION_MODEL,
+        'data': {'name': f'user-{i}'}
+    } for i, embedding in enumerate(embeddings)]
+    storage._rebuild_index()
+    storage.save_database()
+
+
+def app_env(**overrides) -> dict:
+    env = dict(os.environ, STORAGE_FORMAT='json', JOURNAL_ENABLED='false', INFERENCE_WORKERS='0',
+               LOG_LEVEL='WARNING', PRELOAD_APP='false', PRELOAD_MODELS='false', WARMUP_IN_BACKGROUND='false')
+    env.update(overrides)
+    return env
+
+
+def memory(pid: int) -> dict:
+    """RSS, PSS and private memory of a process in MB"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    }
+
+
+def children(pid: int) -> list:
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may hold spaces; the fields after it are fixed
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == pid:
+                found.append(int(entry))
+    return sorted(found)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def boot_workers(work_dir: str, workers: int, preload: bool, models: bool, timeout: float):
+    """Start gunicorn, wait until every worker has settled, return (boot seconds, master, worker memory)"""
+    port = free_port()
+    env = app_env(PRELOAD_APP=str(preload).lower(), PRELOAD_MODELS=str(models).lower())
+    started = time.perf_counter()
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(webapp_dir, 'gunicorn.conf.py'),
+         '--pythonpath', webapp_dir, '--chdir', work_dir, '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        # Workers have booted once all are up, the app answers and their memory stops growing
+        previous = None
+        while time.perf_counter() - started < timeout:
+            time.sleep(0.5)
+            if master.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            pids = children(master.pid)
+            if len(pids) < workers:
+                continue
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/api/user/count', timeout=2).read()
+            except OSError:
+                continue
+            current = [round(memory(pid)['rss']) for pid in pids]
+            if current == previous:
+                boot_seconds = time.perf_counter() - started - 0.5
+                return boot_seconds, memory(master.pid), [memory(pid) for pid in pids]
+            previous = current
+        raise RuntimeError(f"workers did not settle within {timeout:.0f}s")
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000, help='Synthetic gallery size')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--models', action='store_true', help='Build the models in every worker')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+    logging.getLogger('facerec').setLevel(logging.WARNING)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        build_gallery(os.path.join(work_dir, os.path.dirname(config.DATABASE_PATH)), args.users)
+        shutil.copy(os.path.join(root_dir, 'shared', config.DATA_TEMPLATE_PATH), work_dir)
+
+        probe = subprocess.run([sys.executable, '-c', IMPORT_PROBE % {'webapp_dir': webapp_dir}], cwd=work_dir,
+                               env=app_env(), capture_output=True, text=True)
+        if probe.returncode != 0:
+            sys.exit(f"Importing the app failed:\n{probe.stderr}")
+        result = json.loads(probe.stdout.strip().splitlines()[-1])
+        print(f"import app: {result['import_seconds']:.2f}s, RSS {result['rss_mb']:.0f} MB "
+              f"({args.users} users), TensorFlow loaded: {result['tensorflow_loaded']}")
+        print("  without TensorFlow: " + ', '.join(f"{path} {code}" for path, code in result['endpoints'].items()))
+        if result['deepface_seconds'] is None:
+            print("  DeepFace not installed; its import cost is not measured")
+        else:
+            print(f"  deferred DeepFace/TensorFlow import: {result['deepface_seconds']:.2f}s, "
+                  f"+{result['deepface_rss_mb']:.0f} MB")
+
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            print("\ngunicorn is not installed; skipping the worker memory comparison")
+            return
+
+        print(f"\n{args.workers} gunicorn workers{' with models' if args.models else ''}:")
+        print(f"{'mode':>10} {'boot s':>7} {'master RSS':>11} {'worker RSS':>11} {'worker PSS':>11} "
+              f"{'private':>8} {'total PSS':>10}")
+        for preload in (False, True):
+            boot_seconds, master, workers = boot_workers(work_dir, args.workers, preload, args.models, args.timeout)
+            total_pss = master['pss'] + sum(w['pss'] for w in workers)
+            print(f"{'preload' if preload else 'default':>10} {boot_seconds:>7.1f} {master['rss']:>10.0f}M "
+                  f"{np.mean([w['rss'] for w in workers]):>10.0f}M {np.mean([w['pss'] for w in workers]):>10.0f}M "
+                  f"{np.mean([w['private'] for w in workers]):>7.0f}M {total_pss:>9.0f}M")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
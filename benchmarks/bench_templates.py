@@ -0,0 +1,82 @@
+"""
+Multi-Template Enrolment Benchmark
+Compares recognition accuracy and query cost with one capture per user
+against several captures (centroid first pass + template re-rank)
+
+Every capture of an identity is its centre plus capture noise, so a single
+enrolment capture is as noisy as the probe it is compared against.
+
+Usage:
+    python benchmarks/bench_templates.py [--users 20000] [--templates 5] [--noise 1.3]
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--templates', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--noise', type=float, default=1.3,
+                        help='Capture noise relative to the spread of identity centres')
+    args = parser.parse_args()
+    # Keep per-user storage logging out of the results
+    logging.getLogger('facerec').setLevel(logging.WARNING)
+
+    config.INDEX_TYPE = 'brute'
+    config.JOURNAL_ENABLED = False
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((args.users, args.dim)).astype(np.float32)
+
+    def capture(rows):
+        return centres[rows] + args.noise * rng.standard_normal((len(rows), args.dim)).astype(np.float32)
+
+    truth = rng.integers(0, args.users, args.queries)
+    probes = capture(truth)
+
+    print(f"{args.users} users, {args.dim}-d, capture noise {args.noise}, {args.queries} probes")
+    print(f"{'templates':>9} {'top-1 acc':>10} {'ms/query':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = StorageManager(os.path.join(tmp, 'users_database.json'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            storage.users = [{
+                'user_id': str(i), 'timestamp': '', 'embedding_dim': args.dim, 'model_name': 'Facenet',
+                'face_embedding': embedding.tolist(), 'data': {'name': str(i)}
+            } for i, embedding in enumerate(capture(np.arange(args.users)))]
+            storage._rebuild_index()
+            storage.save_database = lambda: None  # Keep the timing about matching
+
+        for count in (1, args.templates):
+            with contextlib.redirect_stdout(io.StringIO()):
+                while storage.template_count('0') < count:
+                    for row, embedding in enumerate(capture(np.arange(args.users))):
+                        storage.add_template(str(row), embedding)
+
+            start = time.perf_counter()
+            top = [storage.find_top_matches(probe, k=1)[0][0]['user_id'] for probe in probes]
+            ms_per_query = (time.perf_counter() - start) / args.queries * 1000
+            accuracy = np.mean(np.array(top, dtype=int) == truth)
+            print(f"{count:>9} {accuracy:>10.3f} {ms_per_query:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Storage Concurrency Stress Test
+Hammers one StorageManager with concurrent registrations, template
+enrolments and recognitions, then checks that nothing was lost or mixed up
+
+Recognizers look up users registered during the run and must always get
+the right user back. Their latency shows whether matching waits for writers.
+Exits with status 1 if any check fails.
+
+Usage:
+    python benchmarks/stress_storage.py [--format json] [--index ivf] [--seconds 10]
+    DATABASE_URL=sqlite:///stress.db python benchmarks/stress_storage.py --format sql
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=['json', 'binary', 'sql'], default='json')
+    parser.add_argument('--index', choices=['brute', 'ivf'], default='ivf')
+    parser.add_argument('--users', type=int, default=5000, help='Users in the gallery before the run')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--dim', type=int, default=128)
+    args = parser.parse_args()
+    # Keep per-user storage logging out of the results
+    logging.getLogger('facerec').setLevel(logging.WARNING)
+
+    config.INDEX_TYPE = args.index
+    # Train the IVF index and compact the journal in the middle of the run
+    config.IVF_MIN_TRAIN_SIZE = args.users + 200
+    config.JOURNAL_COMPACT_EVERY = 100
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'users_database.json')
+        with contextlib.redirect_stdout(io.StringIO()):
+            storage = StorageManager(path, storage_format=args.format)
+            initial = rng.standard_normal((args.users, args.dim)).astype(np.float32)
+            storage.add_users([({'name': f'initial-{i}'}, embedding) for i, embedding in enumerate(initial)])
+
+        registered = {}  # user_id -> embedding, filled by the writers
+        registered_lock = threading.Lock()
+        errors = []
+        latencies = []
+        counts = {'registrations': 0, 'templates': 0, 'recognitions': 0, 'wrong': 0}
+        stop = threading.Event()
+
+        def writer(seed):
+            local = np.random.default_rng(seed)
+            while not stop.is_set():
+                try:
+                    if registered and local.random() < 0.2:
+                        with registered_lock:
+                            user_id = random.choice(list(registered))
+                            embedding = registered[user_id]
+                        storage.add_template(user_id, embedding + 0.01 * local.standard_normal(args.dim))
+                        counts['templates'] += 1
+                    else:
+                        embedding = local.standard_normal(args.dim).astype(np.float32)
+                        user_id = storage.add_user({'name': 'stress'}, embedding)
+                        with registered_lock:
+                            registered[user_id] = embedding
+                        counts['registrations'] += 1
+                except Exception:
+                    errors.append(traceback.format_exc())
+
+        def reader(seed):
+            local = np.random.default_rng(seed)
+            while not stop.is_set():
+                with registered_lock:
+                    if not registered:
+                        continue
+                    user_id = random.choice(list(registered))
+                    embedding = registered[user_id]
+                query = embedding + 0.01 * local.standard_normal(args.dim).astype(np.float32)
+                try:
+                    start = time.perf_counter()
+                    match = storage.find_matching_user(query)
+                    latencies.append(time.perf_counter() - start)
+                    counts['recognitions'] += 1
+                    if match is None or match['user_id'] != user_id:
+                        counts['wrong'] += 1
+                except Exception:
+                    errors.append(traceback.format_exc())
+
+        threads = [threading.Thread(target=writer, args=(1000 + i,)) for i in range(args.writers)]
+        threads += [threading.Thread(target=reader, args=(2000 + i,)) for i in range(args.readers)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            storage.save_database()
+            reloaded = StorageManager(path, storage_format=args.format)
+
+        expected = args.users + len(registered)
+        missing = [user_id for user_id in registered if reloaded.get_user(user_id) is None]
+        ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+        print(f"{args.format}/{args.index}, {args.writers} writers + {args.readers} readers for {args.seconds}s")
+        print(f"  {counts['registrations']} registrations, {counts['templates']} templates, "
+              f"{counts['recognitions']} recognitions ({counts['wrong']} wrong)")
+        print(f"  recognition latency p50 {np.percentile(ms, 50):.2f} ms, p99 {np.percentile(ms, 99):.2f} ms, "
+              f"max {ms.max():.2f} ms")
+        print(f"  users after reload: {reloaded.get_user_count()} (expected {expected}), {len(missing)} missing")
+
+        failed = errors or counts['wrong'] or missing or reloaded.get_user_count() != expected
+        for error in errors[:5]:
+            print(error)
+        print("FAILED" if failed else "OK")
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
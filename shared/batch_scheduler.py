@@ -0,0 +1,94 @@
+"""
+Batch Scheduler Module
+Merges concurrent single-item requests into batched model calls
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent callers and processes them together
+
+    The first item of a batch waits at most `max_wait_ms` for others to join,
+    and a batch never exceeds `max_batch_size` items. Each caller gets a
+    Future resolved with its own result.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 16,
+                 max_wait_ms: float = 10, dispatchers: int = 1):
+        """
+        Args:
+            batch_fn: Processes a list of items and returns one result per item
+            max_batch_size: Largest batch passed to batch_fn
+            max_wait_ms: Latency budget for filling a batch
+            dispatchers: Number of batches that may be processed concurrently
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+
+        # Achieved batch sizes
+        self._lock = threading.Lock()
+        self._batch_sizes: Dict[int, int] = {}
+        self._batches = 0
+        self._items = 0
+
+        for _ in range(max(1, dispatchers)):
+            threading.Thread(target=self._dispatch_loop, daemon=True).start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the returned Future resolves to its result"""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect_batch(self) -> List:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._collect_batch()
+            self._record(len(batch))
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, size: int):
+        with self._lock:
+            self._batches += 1
+            self._items += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+
+    def get_stats(self) -> Dict:
+        """Counts and size distribution of the batches processed so far"""
+        with self._lock:
+            return {
+                'batches': self._batches,
+                'items': self._items,
+                'mean_batch_size': round(self._items / self._batches, 2) if self._batches else 0,
+                'max_batch_size': max(self._batch_sizes) if self._batch_sizes else 0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'queue_depth': self._queue.qsize()
+            }
@@ -0,0 +1,349 @@
+"""
+Binary Store Module
+Stores embeddings as a raw segment (float32, float16 or int8 codes) that is
+memory-mapped on load, with user metadata in a separate compact JSON-lines file.
+New users, and new versions of existing ones, can be appended to both in
+place (see shared_gallery)
+"""
+
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from structured_logging import get_logger
+
+logger = get_logger('binary_store')
+
+# Format 2 names its segment in the header ('segment_version'); format 1
+# used one unversioned segment file per precision
+FORMAT_VERSION = 2
+READABLE_FORMATS = (1, 2)
+
+# Segment file extension per storage precision
+SEGMENT_EXTENSIONS = {'float32': '.f32', 'float16': '.f16', 'int8': '.i8'}
+
+
+def segment_path(base_path: str, precision: str = 'float32', version: Optional[int] = None) -> str:
+    """Path of the raw embedding segment for a storage precision and segment version (None: format 1)"""
+    if version is None:
+        return base_path + SEGMENT_EXTENSIONS[precision]
+    return f"{base_path}.{version}{SEGMENT_EXTENSIONS[precision]}"
+
+
+def scales_path(base_path: str, version: Optional[int] = None) -> str:
+    """Path of the per-row float32 scale factors of an int8 segment"""
+    if version is None:
+        return base_path + '.scales.f32'
+    return f"{base_path}.{version}.scales.f32"
+
+
+def segment_files(base_path: str, header: Dict) -> Tuple[str, Optional[str]]:
+    """(segment path, scales path or None) a metadata header refers to"""
+    precision = header.get('precision', 'float32')
+    version = header.get('segment_version')
+    return (segment_path(base_path, precision, version),
+            scales_path(base_path, version) if precision == 'int8' else None)
+
+
+def meta_path(base_path: str) -> str:
+    """Path of the JSON-lines metadata file"""
+    return base_path + '.meta.jsonl'
+
+
+def exists(base_path: str) -> bool:
+    """Check whether a binary database exists at base_path"""
+    return os.path.exists(meta_path(base_path))
+
+
+def load(base_path: str) -> Tuple[List[Dict], List[str], np.ndarray, Optional[np.ndarray]]:
+    """
+    Load a binary database without copying the embeddings
+
+    Args:
+        base_path: Database path without extension
+
+    Returns:
+        (users, gallery_ids, gallery_matrix, gallery_scales) where
+        gallery_matrix is a read-only memory map whose rows belong to
+        gallery_ids, and gallery_scales is only set for int8 segments
+    """
+    return load_with_position(base_path)[3:]
+
+
+def load_with_position(base_path: str) -> Tuple[Dict, int, int, List[Dict], List[str], np.ndarray, Optional[np.ndarray]]:
+    """
+    Load a binary database and report how far its metadata was read
+
+    A later metadata line for a user replaces the earlier one (an upsert
+    written by append()); the user keeps its original position.
+
+    Args:
+        base_path: Database path without extension
+
+    Returns:
+        (header, offset, superseded, users, gallery_ids, gallery_matrix,
+        gallery_scales): the byte offset after the last complete metadata
+        line, the number of lines a later line replaced, then as load()
+    """
+    users = []
+    positions = {}
+    rows = {}
+    superseded = 0
+    with open(meta_path(base_path), 'rb') as f:
+        first = f.readline()
+        header = _check_header(json.loads(first))
+        offset = len(first)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # Torn by a crash in the middle of an append
+            offset += len(line)
+            if not line.strip():
+                continue
+            user = json.loads(line)
+            row = user.pop('row', None)
+            if row is not None:
+                rows[user['user_id']] = row
+            position = positions.get(user['user_id'])
+            if position is None:
+                positions[user['user_id']] = len(users)
+                users.append(user)
+            else:
+                users[position] = user
+                superseded += 1
+
+    dim = header.get('dim') or 0
+    dtype = np.dtype(header.get('precision', 'float32'))
+    path, scales_file = segment_files(base_path, header)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    segment_rows = size // (dtype.itemsize * dim) if dim else 0
+    if scales_file is not None:
+        scale_size = os.path.getsize(scales_file) if os.path.exists(scales_file) else 0
+        segment_rows = min(segment_rows, scale_size // 4)
+
+    matrix, scales = map_segment(base_path, header, segment_rows)
+
+    # Rows are written in index order, so sorting by row restores the matrix order
+    gallery_ids = sorted((user_id for user_id, row in rows.items() if row < segment_rows), key=rows.get)
+    if len(gallery_ids) < len(rows):
+        dropped = set(rows) - set(gallery_ids)
+        users = [user for user in users if user['user_id'] not in dropped]
+        logger.warning("Dropped users whose embeddings are missing from the segment",
+                       extra={'users': len(dropped), 'path': path})
+
+    if [rows[user_id] for user_id in gallery_ids] != list(range(len(gallery_ids))):
+        raise ValueError(f"Embedding rows in {meta_path(base_path)} are not contiguous")
+
+    count = len(gallery_ids)
+    return (header, offset, superseded, users, gallery_ids,
+            matrix[:count], scales[:count] if scales is not None else None)
+
+
+def read_header(base_path: str) -> Optional[Dict]:
+    """Header of a binary database (format, dim, precision), or None if there is none"""
+    if not exists(base_path):
+        return None
+    with open(meta_path(base_path), 'r', encoding='utf-8') as f:
+        return _check_header(json.loads(f.readline()))
+
+
+def map_segment(base_path: str, header: Dict, rows: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Memory-map the first rows of the segment a metadata header refers to, read-only
+
+    Returns:
+        (matrix, scales) where scales is only set for int8 segments
+    """
+    dim = header.get('dim') or 0
+    dtype = np.dtype(header.get('precision', 'float32'))
+    if not rows:
+        return np.empty((0, dim), dtype=dtype), None
+    path, scales_file = segment_files(base_path, header)
+    matrix = np.memmap(path, dtype=dtype, mode='r', shape=(rows, dim))
+    scales = None
+    if scales_file is not None:
+        scales = np.memmap(scales_file, dtype=np.float32, mode='r', shape=(rows,))
+    return matrix, scales
+
+
+def append(base_path: str, users: List[Dict], codes: np.ndarray, scales: Optional[np.ndarray] = None,
+           segment_rows: Optional[int] = None):
+    """
+    Append users, or new versions of existing users, to a binary database in place
+
+    The rows are written first and the metadata lines referring to them
+    last, so a reader that sees a user can always map its row. New rows go
+    after the last one; a user written again (new templates, or moved into
+    the gallery) gets a line that replaces its earlier one on load, and
+    keeps its row, which is overwritten with the new embedding. Rows are
+    never moved, which keeps existing memory maps valid.
+
+    Args:
+        base_path: Database path without extension
+        users: User records; those with a 'row' own the codes in order,
+               the others keep their embedding inline
+        codes: Embedding rows in the segment's precision
+        scales: Per-row scale factors when codes are int8
+        segment_rows: Rows in the segment after this write; anything past
+                      them (left by a torn earlier append) is cut off.
+                      Defaults to one past the highest row written.
+    """
+    header = read_header(base_path)
+    rows = [user['row'] for user in users if 'row' in user]
+    if rows:
+        precision = header['precision']
+        if codes.dtype != np.dtype(precision) or codes.shape != (len(rows), header['dim']):
+            raise ValueError(f"Expected {len(rows)} rows of {header['dim']} {precision} codes")
+        if segment_rows is None:
+            segment_rows = max(rows) + 1
+        path, scales_file = segment_files(base_path, header)
+        _write_rows(path, rows, codes, codes.itemsize * codes.shape[1], segment_rows)
+        if scales_file is not None:
+            _write_rows(scales_file, rows, np.asarray(scales, dtype=np.float32), 4, segment_rows)
+
+    with open(meta_path(base_path), 'a', encoding='utf-8') as f:
+        for user in users:
+            f.write(json.dumps(user, ensure_ascii=False, separators=(',', ':'), default=_to_json) + '\n')
+        _sync(f)
+
+
+def read_appended(base_path: str, offset: int) -> Tuple[List[Dict], int]:
+    """
+    Read the users whose metadata lines start at or after a byte offset
+
+    Only complete lines are read; an append still being written is left
+    for the next call.
+
+    Args:
+        base_path: Database path without extension
+        offset: Byte offset of the first line to read
+
+    Returns:
+        (users, offset after the last complete line), users keeping their 'row'
+    """
+    with open(meta_path(base_path), 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    users = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return users, offset + end
+
+
+def save(base_path: str, users: List[Dict], index):
+    """
+    Write a binary database
+
+    Embeddings of indexed users go to the segment in index order and in the
+    index's storage precision; any other user keeps its embedding inline in
+    the metadata.
+
+    Rows may be renumbered (merges, users split off into another model's
+    partition), so the embeddings go to a new segment file that only the new
+    metadata names. Renaming the metadata into place switches both at once;
+    until then the old metadata and its segment stay untouched.
+
+    Args:
+        base_path: Database path without extension
+        users: User records
+        index: Embedding index holding the gallery embeddings
+    """
+    precision = index.precision
+    try:
+        previous = read_header(base_path) or {}
+    except ValueError:
+        previous = {}
+    version = previous.get('segment_version', 0) + 1
+    meta_tmp = meta_path(base_path) + '.tmp'
+
+    with open(segment_path(base_path, precision, version), 'wb') as f:
+        np.ascontiguousarray(index.codes).tofile(f)
+        _sync(f)
+    if index.scales is not None:
+        with open(scales_path(base_path, version), 'wb') as f:
+            np.ascontiguousarray(index.scales, dtype=np.float32).tofile(f)
+            _sync(f)
+
+    with open(meta_tmp, 'w', encoding='utf-8') as f:
+        header = {
+            'format': FORMAT_VERSION,
+            'dim': index.dim,
+            'precision': precision,
+            'segment_version': version,
+            'last_updated': datetime.now().isoformat()
+        }
+        f.write(json.dumps(header) + '\n')
+        for user in users:
+            row = index.row_of(user['user_id'])
+            if row is not None:
+                user = {key: value for key, value in user.items() if key != 'face_embedding'}
+                user['row'] = row
+            f.write(json.dumps(user, ensure_ascii=False, separators=(',', ':'), default=_to_json) + '\n')
+        _sync(f)
+
+    os.replace(meta_tmp, meta_path(base_path))
+    _sync_dir(base_path)
+    _remove_old_segments(base_path, header)
+
+
+def _remove_old_segments(base_path: str, header: Dict):
+    """
+    Delete the segments of earlier saves (any version or precision)
+
+    Processes that still have one memory-mapped keep reading it until they
+    reload; the file is only gone once they unmap it.
+    """
+    directory, name = os.path.split(base_path)
+    pattern = re.compile(re.escape(name) + r'(\.\d+)?(\.scales)?(' +
+                         '|'.join(re.escape(ext) for ext in SEGMENT_EXTENSIONS.values()) + r')$')
+    current = {os.path.basename(path) for path in segment_files(base_path, header) if path is not None}
+    for entry in os.listdir(directory or '.'):
+        if pattern.match(entry) and entry not in current:
+            os.remove(os.path.join(directory, entry))
+
+
+def _check_header(header: Dict) -> Dict:
+    if header.get('format') not in READABLE_FORMATS:
+        raise ValueError(f"Unsupported binary database format: {header.get('format')}")
+    return header
+
+
+def _write_rows(path: str, rows: List[int], array: np.ndarray, row_size: int, total_rows: int):
+    """Write array[i] to row rows[i] of a file of fixed-size rows, then cut the file to total_rows rows"""
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        start = 0
+        while start < len(rows):
+            # One write per run of consecutive rows
+            end = start + 1
+            while end < len(rows) and rows[end] == rows[end - 1] + 1:
+                end += 1
+            f.seek(rows[start] * row_size)
+            np.ascontiguousarray(array[start:end]).tofile(f)
+            start = end
+        f.truncate(total_rows * row_size)
+        _sync(f)
+
+
+def _sync(f):
+    """Flush a file to disk before it is renamed into place"""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _sync_dir(path: str):
+    """Make a rename in the directory of path durable"""
+    fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _to_json(value):
+    """json.dumps fallback for numpy values kept in records"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
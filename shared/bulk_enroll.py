@@ -0,0 +1,226 @@
+"""
+Bulk Enrolment Tool
+Registers users from a directory or CSV of photos without going through the
+web API, embedding the photos across a pool of worker processes
+
+Usage:
+    python shared/bulk_enroll.py photos/ [--database data/users_database.json] [--workers -1]
+    python shared/bulk_enroll.py people.csv [--batch-size 16] [--chunk-size 512]
+
+A directory is scanned for images; each photo's metadata is read from a
+JSON file next to it with the same name (photo.jpg -> photo.json), or the
+file name becomes the user's name. A CSV needs an 'image' column (paths are
+relative to the CSV) and one column per data_template.json field.
+
+Every chunk of photos is written with one bulk commit. Photos already
+enrolled are skipped, so an interrupted run is resumed by starting it again.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from face_crops import FaceCropStore
+from inference_pool import InferencePool, resolve_worker_count
+from storage_manager import StorageManager
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# (source key, image path, user data)
+Photo = Tuple[str, str, Dict]
+
+
+def load_template_fields(template_path: str) -> Dict[str, str]:
+    """Field name -> type from the data collection template"""
+    with open(template_path, 'r', encoding='utf-8') as f:
+        return {field['name']: field.get('type', 'string') for field in json.load(f).get('fields', [])}
+
+
+def convert_fields(values: Dict, fields: Dict[str, str], source: str) -> Dict:
+    """Keep the template's fields, converting integers; empty values are left out"""
+    unknown = set(values) - set(fields)
+    if unknown:
+        print(f"Warning: {source}: ignoring fields not in the template: {', '.join(sorted(unknown))}")
+
+    user_data = {}
+    for name, field_type in fields.items():
+        value = values.get(name)
+        if value is None or value == '':
+            continue
+        if field_type == 'integer':
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                print(f"Warning: {source}: {name} is not an integer: {value!r}")
+                continue
+        user_data[name] = value
+    return user_data
+
+
+def read_directory(root: str, fields: Dict[str, str]) -> List[Photo]:
+    """Photos in a directory tree, with metadata from sidecar JSON files"""
+    photos = []
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in sorted(file_names):
+            stem, extension = os.path.splitext(file_name)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(dir_path, file_name)
+            key = os.path.relpath(path, root)
+            sidecar = os.path.join(dir_path, stem + '.json')
+            if os.path.exists(sidecar):
+                with open(sidecar, 'r', encoding='utf-8') as f:
+                    values = json.load(f)
+            else:
+                values = {'name': stem.replace('_', ' ')}
+            photos.append((key, path, convert_fields(values, fields, key)))
+    return sorted(photos)
+
+
+def read_csv(csv_path: str, fields: Dict[str, str]) -> List[Photo]:
+    """Photos listed in a CSV with an 'image' column and one column per template field"""
+    root = os.path.dirname(os.path.abspath(csv_path))
+    photos = []
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            image = (row.pop('image', None) or '').strip()
+            if not image:
+                print(f"Warning: {csv_path}:{line}: no image, skipped")
+                continue
+            photos.append((image, os.path.join(root, image), convert_fields(row, fields, f"{csv_path}:{line}")))
+    return photos
+
+
+class LocalModule:
+    """Runs FaceRecognitionModule in this process with the InferencePool.submit interface"""
+
+    def __init__(self):
+        from face_recognition_module import FaceRecognitionModule
+        self.module = FaceRecognitionModule()
+
+    def submit(self, method: str, *args) -> Future:
+        future = Future()
+        future.set_result(getattr(self.module, method)(*args))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def enroll(photos: List[Photo], storage: StorageManager, pool, crops: Optional[FaceCropStore],
+           batch_size: int, chunk_size: int) -> Tuple[int, List[Tuple[str, str]]]:
+    """
+    Embed and register photos chunk by chunk
+
+    The next chunk is already being embedded while the previous one is
+    committed, so the workers do not wait for the database write.
+
+    Returns:
+        (number of users enrolled, (source key, reason) of every failed photo)
+    """
+    def submit(chunk: List[Photo]) -> List[Future]:
+        return [pool.submit('embed_photos', [path for _, path, _ in chunk[start:start + batch_size]])
+                for start in range(0, len(chunk), batch_size)]
+
+    chunks = [photos[start:start + chunk_size] for start in range(0, len(photos), chunk_size)]
+    enrolled = 0
+    processed = 0
+    failed = []
+    started = time.perf_counter()
+
+    pending = submit(chunks[0]) if chunks else []
+    for number, chunk in enumerate(chunks):
+        futures = pending
+        pending = submit(chunks[number + 1]) if number + 1 < len(chunks) else []
+        results = [result for future in futures for result in future.result()]
+
+        users = []
+        sources = []
+        faces = []
+        for (key, _, user_data), result in zip(chunk, results):
+            if 'embedding' not in result:
+                failed.append((key, result.get('error', 'unknown error')))
+                continue
+            users.append((user_data, result['embedding']))
+            sources.append(key)
+            faces.append(result['face'])
+
+        user_ids = storage.add_users(users, sources)
+        if crops is not None:
+            for user_id, face in zip(user_ids, faces):
+                crops.save(user_id, face)
+
+        enrolled += len(user_ids)
+        processed += len(chunk)
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta = (len(photos) - processed) / rate if rate > 0 else 0.0
+        print(f"[{processed}/{len(photos)}] {enrolled} enrolled, {len(failed)} failed, "
+              f"{rate:.1f} images/s, ETA {eta:.0f}s")
+
+    return enrolled, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Directory of photos or CSV file')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', config.DATABASE_PATH),
+                        help='Path of the JSON database')
+    parser.add_argument('--template', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'data_template.json'),
+                        help='Data collection template the metadata must follow')
+    parser.add_argument('--workers', type=int, default=-1,
+                        help='Embedding worker processes (-1 = one per CPU core, 0 = this process)')
+    parser.add_argument('--batch-size', type=int, default=16, help='Photos per worker call (one model batch)')
+    parser.add_argument('--chunk-size', type=int, default=512, help='Photos per bulk commit')
+    parser.add_argument('--failed-list', help='Write the photos that could not be enrolled to this CSV')
+    args = parser.parse_args()
+
+    fields = load_template_fields(args.template)
+    if os.path.isdir(args.source):
+        photos = read_directory(args.source, fields)
+    else:
+        photos = read_csv(args.source, fields)
+
+    storage = StorageManager(args.database)
+    done = storage.enrolled_sources()
+    pending = [photo for photo in photos if photo[0] not in done]
+    print(f"{len(photos)} photos, {len(photos) - len(pending)} already enrolled, {len(pending)} to go")
+    if not pending:
+        return
+
+    workers = resolve_worker_count(args.workers)
+    if workers:
+        # Two chunks are in flight at a time (see enroll)
+        pool = InferencePool(workers, max_pending=2 * (args.chunk_size // args.batch_size + 1))
+    else:
+        pool = LocalModule()
+    crops = FaceCropStore(config.FACE_CROPS_DIR) if config.STORE_FACE_CROPS else None
+
+    start = time.perf_counter()
+    try:
+        enrolled, failed = enroll(pending, storage, pool, crops, args.batch_size, args.chunk_size)
+    finally:
+        pool.shutdown()
+    elapsed = time.perf_counter() - start
+
+    print(f"Enrolled {enrolled} of {len(pending)} photos in {elapsed:.1f}s "
+          f"({len(pending) / elapsed:.1f} images/s), {len(failed)} failed")
+    if failed and args.failed_list:
+        with open(args.failed_list, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['image', 'error'])
+            writer.writerows(failed)
+        print(f"Failed photos written to {args.failed_list}")
+
+
+if __name__ == '__main__':
+    main()
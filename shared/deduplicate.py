@@ -0,0 +1,257 @@
+"""
+Gallery Deduplication Tool
+Finds users registered more than once and optionally merges them
+
+Usage:
+    python shared/deduplicate.py [--database data/users_database.json] [--threshold 0.7]
+    python shared/deduplicate.py --method ivf --report duplicates.csv [--merge]
+
+Every pair of gallery embeddings closer than the threshold is linked and
+linked users form a cluster (single linkage). Distances are computed in
+blocks of --block-rows x --block-rows, so memory stays bounded whatever
+the gallery size:
+
+- "exact": every pair, O(n^2) work - about two CPU-hours for 1M 128-d users
+- "ivf": only pairs within neighbouring k-means cells (the IVF index's
+  cells when it is trained) - minutes for 1M users, may miss a few pairs
+
+See benchmarks/bench_dedup.py for time, recall and peak memory of both.
+
+With --merge, each cluster is folded into its oldest registration (the
+others become its templates). Run it while no server is writing to the
+database and restart the servers afterwards.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from embedding_index import IVFFlatIndex, as_euclidean, metric_space
+from face_crops import FaceCropStore
+
+DEFAULT_BLOCK_ROWS = 4096
+
+# (rows, other rows) of near-duplicate pairs
+Pairs = Tuple[np.ndarray, np.ndarray]
+
+
+class _Progress:
+    """Prints how many blocks are done at most every few seconds"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def step(self, done: int):
+        now = time.perf_counter()
+        if done < self.total and now - self.last_report < 5.0:
+            return
+        self.last_report = now
+        elapsed = now - self.started
+        eta = elapsed / done * (self.total - done) if done else 0.0
+        print(f"  {done}/{self.total} blocks ({100.0 * done / self.total:.1f}%), "
+              f"{elapsed:.0f}s elapsed, ETA {eta:.0f}s")
+
+
+def _block(index, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows in metric space with their squared norms"""
+    vectors = metric_space(index.vectors(rows), index.metric)
+    return vectors, np.einsum('ij,ij->i', vectors, vectors)
+
+
+def _close_pairs(rows_a: np.ndarray, block_a: Tuple[np.ndarray, np.ndarray],
+                 rows_b: np.ndarray, block_b: Tuple[np.ndarray, np.ndarray], radius: float) -> Pairs:
+    """Pairs of distinct rows between two blocks closer than radius (Euclidean, in metric space)"""
+    vectors_a, sq_norms_a = block_a
+    vectors_b, sq_norms_b = block_b
+    # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2, in place on the one block-sized matrix
+    sq_dist = vectors_a @ vectors_b.T
+    sq_dist *= -2.0
+    sq_dist += sq_norms_a[:, None]
+    sq_dist += sq_norms_b[None, :]
+    a, b = np.nonzero(sq_dist < radius * radius)
+    distinct = rows_a[a] != rows_b[b]
+    return rows_a[a][distinct], rows_b[b][distinct]
+
+
+def exact_pairs(index, radius: float, block_rows: int) -> Iterator[Pairs]:
+    """All pairs closer than radius, scanning the upper triangle of the distance matrix block by block"""
+    count = len(index)
+    starts = range(0, count, block_rows)
+    progress = _Progress(len(starts) * (len(starts) + 1) // 2)
+    done = 0
+    for start_a in starts:
+        rows_a = np.arange(start_a, min(start_a + block_rows, count))
+        block_a = _block(index, rows_a)
+        for start_b in range(start_a, count, block_rows):
+            rows_b = np.arange(start_b, min(start_b + block_rows, count))
+            block_b = block_a if start_b == start_a else _block(index, rows_b)
+            yield _close_pairs(rows_a, block_a, rows_b, block_b, radius)
+            done += 1
+        progress.step(done)
+
+
+def ivf_pairs(index, radius: float, block_rows: int, probe: int) -> Iterator[Pairs]:
+    """Pairs closer than radius among rows in the same or one of the `probe` nearest k-means cells"""
+    cells = index
+    if not (isinstance(index, IVFFlatIndex) and index.is_trained):
+        # Cluster a view of the stored rows; adopt() does not copy them
+        cells = IVFFlatIndex(precision=index.precision, metric=index.metric)
+        cells.adopt(index.ids, index.codes, index.scales)
+        cells.train()
+
+    centroids = cells.centroids
+    nlist = centroids.shape[0]
+    probe = max(1, min(probe, nlist))
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    progress = _Progress(nlist)
+    for list_id in range(nlist):
+        members = cells.list_rows(list_id)
+        if len(members) == 0:
+            continue
+        scores = centroid_sq_norms - 2.0 * (centroids @ centroids[list_id])
+        neighbours = np.argpartition(scores, probe - 1)[:probe] if probe < nlist else np.arange(nlist)
+        candidates = np.sort(np.concatenate([cells.list_rows(int(other)) for other in neighbours]))
+
+        for start_a in range(0, len(members), block_rows):
+            rows_a = np.sort(members[start_a:start_a + block_rows])
+            block_a = _block(index, rows_a)
+            for start_b in range(0, len(candidates), block_rows):
+                rows_b = candidates[start_b:start_b + block_rows]
+                yield _close_pairs(rows_a, block_a, rows_b, _block(index, rows_b), radius)
+        progress.step(list_id + 1)
+
+
+def find_clusters(index, threshold: float, method: str = 'exact', block_rows: int = DEFAULT_BLOCK_ROWS,
+                  probe: int = 4) -> List[np.ndarray]:
+    """
+    Group gallery rows whose embeddings are within threshold of each other
+
+    Args:
+        index: Embedding index holding the gallery
+        threshold: Distance (in the index's metric) below which two users are duplicates
+        method: 'exact' or 'ivf'
+        block_rows: Rows per distance block; memory use is about block_rows^2 * 4 bytes
+        probe: Neighbouring cells compared per cell with the 'ivf' method
+
+    Returns:
+        Clusters of two or more rows, each in ascending (registration) order
+    """
+    radius = float(as_euclidean(threshold, index.metric))
+    if method == 'ivf':
+        pairs = ivf_pairs(index, radius, block_rows, probe)
+    else:
+        pairs = exact_pairs(index, radius, block_rows)
+
+    # Union-find over rows; only the parent array grows with the gallery
+    parent = np.arange(len(index), dtype=np.int64)
+
+    def find(row: int) -> int:
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for rows_a, rows_b in pairs:
+        for a, b in zip(rows_a.tolist(), rows_b.tolist()):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                # The older registration (lower row) becomes the root
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    # Point every row straight at its root
+    roots = parent
+    while True:
+        jumped = roots[roots]
+        if np.array_equal(jumped, roots):
+            break
+        roots = jumped
+    order = np.argsort(roots, kind='stable')
+    sorted_roots = roots[order]
+    boundaries = np.flatnonzero(np.diff(sorted_roots)) + 1
+    return [group for group in np.split(order, boundaries) if len(group) > 1]
+
+
+def describe_cluster(storage, rows: np.ndarray) -> List[Tuple[str, float]]:
+    """(user_id, distance to the first user) for every user of a cluster"""
+    index = storage.index
+    rows = np.sort(rows)
+    distances = index.row_distances(rows, index.vectors(rows[:1])[0])
+    return [(index.ids[row], float(distance)) for row, distance in zip(rows.tolist(), distances.tolist())]
+
+
+def write_report(path: str, storage, clusters: List[List[Tuple[str, float]]], max_cluster_size: int):
+    """One CSV line per user in a duplicate cluster"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cluster', 'user_id', 'name', 'timestamp', 'distance_to_first', 'action'])
+        for number, members in enumerate(clusters):
+            too_large = len(members) > max_cluster_size
+            for position, (user_id, distance) in enumerate(members):
+                user = storage.get_user(user_id)
+                action = 'review' if too_large else ('keep' if position == 0 else 'merge')
+                writer.writerow([number, user_id, user['data'].get('name', ''), user.get('timestamp', ''),
+                                 f"{distance:.4f}", action])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', config.DATABASE_PATH),
+                        help='Path of the JSON database')
+    parser.add_argument('--threshold', type=float, default=config.FACE_MATCH_THRESHOLD,
+                        help='Distance below which two registrations are the same person '
+                             '(default: the recognition threshold)')
+    parser.add_argument('--method', choices=['exact', 'ivf'], default='exact')
+    parser.add_argument('--block-rows', type=int, default=DEFAULT_BLOCK_ROWS,
+                        help='Rows per distance block (memory ~ block_rows^2 * 4 bytes)')
+    parser.add_argument('--probe', type=int, default=4, help='Neighbouring cells compared with --method ivf')
+    parser.add_argument('--report', help='Write the candidate merges to this CSV')
+    parser.add_argument('--merge', action='store_true', help='Merge every cluster into its oldest registration')
+    parser.add_argument('--max-cluster-size', type=int, default=10,
+                        help='Larger clusters are likely chains of different people; report them but never merge')
+    args = parser.parse_args()
+
+    from storage_manager import StorageManager
+    storage = StorageManager(args.database)
+    index = storage.index
+    print(f"Searching {len(index)} users for duplicates ({args.method}, threshold {args.threshold}, "
+          f"{index.metric})")
+
+    start = time.perf_counter()
+    clusters = find_clusters(index, args.threshold, args.method, args.block_rows, args.probe)
+    clusters = [describe_cluster(storage, rows) for rows in clusters]
+    elapsed = time.perf_counter() - start
+
+    duplicates = sum(len(members) - 1 for members in clusters)
+    print(f"Found {len(clusters)} clusters ({duplicates} duplicate registrations) in {elapsed:.1f}s")
+    for members in sorted(clusters, key=len, reverse=True)[:10]:
+        names = [storage.get_user(user_id)['data'].get('name', '?') for user_id, _ in members]
+        print(f"  {len(members)} users, max distance {max(d for _, d in members):.3f}: {', '.join(map(str, names[:5]))}")
+
+    if args.report:
+        write_report(args.report, storage, clusters, args.max_cluster_size)
+        print(f"Candidate merges written to {args.report}")
+
+    if args.merge:
+        groups = [[user_id for user_id, _ in members] for members in clusters
+                  if len(members) <= args.max_cluster_size]
+        removed = storage.merge_users(groups)
+        if config.STORE_FACE_CROPS:
+            crops = FaceCropStore(config.FACE_CROPS_DIR)
+            for group in groups:
+                for user_id in group[1:]:
+                    crops.move(user_id, group[0])
+        print(f"Removed {len(removed)} users; the gallery now has {storage.get_user_count()} users")
+
+
+if __name__ == '__main__':
+    main()
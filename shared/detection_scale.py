@@ -0,0 +1,188 @@
+"""
+Detection Scale Module
+Decodes frames straight to a reduced size for the face detector
+
+JPEG frames can be decoded at 1/2, 1/4 or 1/8 scale (OpenCV's
+IMREAD_REDUCED_* modes), which skips most of the decoding work. Each client
+gets a reduction factor that keeps the frame near DETECTION_WIDTH and the
+faces it last showed at least DETECTION_MIN_FACE_SIZE pixels wide. Face
+boxes are mapped back to full resolution, and the full frame is only
+decoded when a face needs its embedding.
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+import config
+from face_recognition_module import confident_faces
+from metrics import REGISTRY, span
+
+DECODES = REGISTRY.counter('face_frame_decodes_total', 'Frames decoded, by reduction factor', ['factor'])
+
+# Reduction factor -> imdecode mode
+IMREAD_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# A coarser factor is only taken when faces stay this much above the minimum
+# size, so a face near the limit does not flip the scale every frame
+COARSEN_MARGIN = 1.25
+
+
+def decode(img_bytes: bytes, factor: int = 1) -> Optional[np.ndarray]:
+    """Decode encoded image bytes at 1/factor of their size (None if undecodable)"""
+    with span('imdecode'):
+        img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), IMREAD_FLAGS[factor])
+    DECODES.inc(factor=str(factor))
+    return img
+
+
+def scale_faces(faces: List[Dict], factor: int) -> List[Dict]:
+    """Map the facial areas of detected faces from a reduced frame to full resolution (in place)"""
+    if factor == 1:
+        return faces
+    for face in faces:
+        facial_area = face.get('facial_area', {})
+        for key, value in facial_area.items():
+            if isinstance(value, (int, float)) and key in ('x', 'y', 'w', 'h'):
+                facial_area[key] = int(value * factor)
+            elif isinstance(value, (tuple, list)) and key in ('left_eye', 'right_eye'):
+                facial_area[key] = tuple(int(v * factor) for v in value)
+    return faces
+
+
+class ScaledFrame:
+    """A frame decoded for detection, with the full-resolution decode made on demand"""
+
+    def __init__(self, img_bytes: bytes, factor: int = 1):
+        """
+        Args:
+            img_bytes: Encoded image (e.g. a JPEG frame)
+            factor: Reduction factor for the detection image (1, 2, 4 or 8)
+        """
+        self.factor = factor
+        self._bytes = img_bytes
+        self.image = decode(img_bytes, factor)
+        self._full = self.image if factor == 1 else None
+
+    @property
+    def full(self) -> np.ndarray:
+        """The frame at full resolution"""
+        if self._full is None:
+            self._full = decode(self._bytes)
+        return self._full
+
+    def crop(self, face: Dict) -> np.ndarray:
+        """Full-resolution crop of a face whose facial area is in full-resolution coordinates"""
+        facial_area = face.get('facial_area', {})
+        x = max(facial_area.get('x', 0), 0)
+        y = max(facial_area.get('y', 0), 0)
+        return self.full[y:y + facial_area.get('h', 0), x:x + facial_area.get('w', 0)]
+
+
+class DetectionScale:
+    """Reduction factor for the frames of one client, adapted to the faces it shows"""
+
+    def __init__(self, target_width: int = config.DETECTION_WIDTH,
+                 min_face_size: int = config.DETECTION_MIN_FACE_SIZE):
+        """
+        Args:
+            target_width: Frame width the detector gets while no face is in view
+            min_face_size: Smallest face width, in pixels of the reduced frame,
+                           the factor may shrink a face to
+        """
+        self.target_width = target_width
+        self.min_face_size = min_face_size
+        self.factor = 1  # Full size until the first frame shows the client's resolution
+        self.last_used = time.monotonic()
+
+    def update(self, frame: ScaledFrame, faces: List[Dict]):
+        """
+        Choose the factor for the next frame
+
+        Args:
+            frame: The frame just processed
+            faces: Faces found in it, with full-resolution facial areas
+        """
+        self.last_used = time.monotonic()
+        frame_width = frame.image.shape[1] * frame.factor
+        # No face in view: reduce the frame to about target_width
+        base = max((f for f in IMREAD_FLAGS if frame_width / f >= self.target_width), default=1)
+        # DeepFace's whole-frame placeholder for "no face" is not a face the width of the frame
+        widths = [face['facial_area'].get('w', 0) for face in confident_faces(faces)
+                  if face.get('facial_area', {}).get('w')]
+        if not widths:
+            self.factor = base
+            return
+
+        # Faces in view: the coarsest factor that keeps the smallest one detectable,
+        # at most one step coarser than the base (new, smaller faces may walk in)
+        smallest = min(widths)
+        factor = max((f for f in IMREAD_FLAGS if f <= base * 2 and smallest / f >= self.min_face_size), default=1)
+        if factor > self.factor and smallest / factor < self.min_face_size * COARSEN_MARGIN:
+            factor = self.factor
+        self.factor = factor
+
+
+class DetectionScaleRegistry:
+    """Per-session detection scales plus counters of frames decoded at each factor"""
+
+    def __init__(self, session_ttl: float = config.TRACK_SESSION_TTL,
+                 enabled: bool = config.DETECTION_SCALING_ENABLED):
+        """
+        Args:
+            session_ttl: Seconds before an idle session's scale is discarded
+            enabled: False decodes every frame at full size
+        """
+        self.session_ttl = session_ttl
+        self.enabled = enabled
+        self._scales: Dict[str, DetectionScale] = {}
+        self._lock = threading.Lock()
+        self._frames = {factor: 0 for factor in IMREAD_FLAGS}
+
+    def get(self, session_id: str) -> DetectionScale:
+        """Scale for a session, created on first use"""
+        with self._lock:
+            self._expire()
+            scale = self._scales.get(session_id)
+            if scale is None:
+                scale = self._scales[session_id] = DetectionScale()
+            return scale
+
+    def drop(self, session_id: str):
+        """Forget a session, e.g. when its socket disconnects"""
+        with self._lock:
+            self._scales.pop(session_id, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id in [sid for sid, s in self._scales.items() if now - s.last_used > self.session_ttl]:
+            del self._scales[session_id]
+
+    def decode(self, session_id: Optional[str], img_bytes: bytes) -> ScaledFrame:
+        """Decode a frame at the session's factor (full size without a session)"""
+        factor = self.get(session_id).factor if self.enabled and session_id is not None else 1
+        frame = ScaledFrame(img_bytes, factor)
+        with self._lock:
+            self._frames[factor] += 1
+        return frame
+
+    def observe(self, session_id: Optional[str], frame: ScaledFrame, faces: List[Dict]):
+        """Adapt the session's factor to the faces found in a frame"""
+        if self.enabled and session_id is not None:
+            self.get(session_id).update(frame, faces)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'sessions': len(self._scales),
+                'frames': sum(self._frames.values()),
+                'frames_by_factor': {str(factor): count for factor, count in self._frames.items()}
+            }
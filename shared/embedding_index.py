@@ -0,0 +1,771 @@
+"""
+Embedding Index Module
+Keeps face embeddings in one contiguous matrix for batched matching, stored
+as float32 or quantized to float16 / int8, with an optional IVF-flat
+(inverted file) index for approximate search on large galleries
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from structured_logging import get_logger
+
+logger = get_logger('embedding_index')
+
+
+# Storage precisions: float16 halves memory, int8 (one float32 scale per row) quarters it
+PRECISIONS = ('float32', 'float16', 'int8')
+
+# Rows converted to float32 at a time when scoring a quantized matrix; small
+# enough for the converted block to stay in cache
+SCORE_BLOCK_ROWS = 2048
+
+
+def quantize(embeddings: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert float32 embeddings to the storage precision
+
+    Returns:
+        (codes, scales) where scales is None except for int8, which stores
+        each row as round(x / scale) with scale = max|x| / 127
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if precision == 'float32':
+        return embeddings, None
+    if precision == 'float16':
+        return embeddings.astype(np.float16), None
+    if precision == 'int8':
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """Inverse of quantize(), returning float32 rows"""
+    vectors = np.asarray(codes, dtype=np.float32)
+    if scales is not None:
+        vectors = vectors * scales[:, None]
+    return vectors
+
+
+# Distance metrics: raw Euclidean, Euclidean between L2-normalised vectors,
+# and cosine distance (1 - cosine similarity)
+METRICS = ('euclidean', 'euclidean_l2', 'cosine')
+
+
+def metric_space(vectors: np.ndarray, metric: str) -> np.ndarray:
+    """Vectors in the space where the metric's ranking is plain Euclidean distance"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric == 'euclidean':
+        return vectors
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def as_euclidean(distance, metric: str):
+    """Convert a metric distance to the Euclidean distance in metric_space()"""
+    if metric == 'cosine':
+        return np.sqrt(2.0 * np.maximum(distance, 0.0))
+    return distance
+
+
+def from_euclidean(distance, metric: str):
+    """Inverse of as_euclidean()"""
+    if metric == 'cosine':
+        return np.square(distance) / 2.0
+    return distance
+
+
+def pairwise_distances(vectors: np.ndarray, query: np.ndarray, metric: str = 'euclidean') -> np.ndarray:
+    """Metric distance from a query to a small set of vectors, e.g. one user's templates"""
+    space_distances = np.linalg.norm(metric_space(vectors, metric) - metric_space(query, metric), axis=-1)
+    return from_euclidean(space_distances, metric)
+
+
+class BruteForceIndex:
+    """
+    Exact nearest-neighbour search over a growable embedding matrix
+
+    One writer at a time may add rows while other threads search without a
+    lock: rows are written before their ids are published, a search reads
+    the row count once, and growing allocates new buffers instead of moving
+    rows in place. A row overwritten by update() may be scored with a mix of
+    its old and new values by a search running at that moment.
+    """
+
+    kind = 'brute'
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024, precision: str = 'float32',
+                 metric: str = 'euclidean'):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+        self.dim = dim
+        self.precision = precision
+        self.metric = metric
+        self.ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._initial_capacity = initial_capacity
+        self._matrix = None  # (capacity, dim) in the storage precision, only [:len(self)] is valid
+        self._scales = None  # Per-row int8 scale factors
+        self._sq_norms = None  # Squared L2 norm of every stored (dequantized) row
+        self._inv_norms = None  # 1 / L2 norm of every row, kept for the normalised metrics
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Valid rows of the matrix as stored (float32, float16 or int8)"""
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=np.dtype(self.precision))
+        return self._matrix[:len(self.ids)]
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        """Per-row scale factors of an int8 matrix, None for other precisions"""
+        if self._scales is None:
+            return None
+        return self._scales[:len(self.ids)]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Valid rows as float32 (a view for float32 indexes, a copy otherwise)"""
+        return dequantize(self.codes, self.scales)
+
+    def nbytes(self) -> int:
+        """Memory held by the valid rows, their scales and norms"""
+        count = len(self.ids)
+        total = self.codes.nbytes
+        if self._sq_norms is not None:
+            total += self._sq_norms[:count].nbytes
+        if self._inv_norms is not None:
+            total += self._inv_norms[:count].nbytes
+        if self._scales is not None:
+            total += self._scales[:count].nbytes
+        return total
+
+    def _reserve(self, capacity: int):
+        """Grow the backing buffers so they can hold at least `capacity` rows"""
+        if self._matrix is not None and self._matrix.shape[0] >= capacity:
+            return
+
+        new_capacity = max(capacity, self._initial_capacity)
+        if self._matrix is not None:
+            new_capacity = max(new_capacity, self._matrix.shape[0] * 2)
+
+        matrix = np.empty((new_capacity, self.dim), dtype=np.dtype(self.precision))
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        inv_norms = np.empty(new_capacity, dtype=np.float32) if self.metric != 'euclidean' else None
+        scales = np.empty(new_capacity, dtype=np.float32) if self.precision == 'int8' else None
+
+        count = len(self.ids)
+        if count:
+            matrix[:count] = self._matrix[:count]
+            sq_norms[:count] = self._sq_norms[:count]
+            if inv_norms is not None:
+                inv_norms[:count] = self._inv_norms[:count]
+            if scales is not None:
+                scales[:count] = self._scales[:count]
+
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+        self._inv_norms = inv_norms
+        self._scales = scales
+
+    def _set_norms(self, rows: slice, stored: np.ndarray):
+        """Precompute the norms of rows from their stored (dequantized) values"""
+        sq_norms = np.einsum('ij,ij->i', stored, stored)
+        self._sq_norms[rows] = sq_norms
+        if self._inv_norms is not None:
+            self._inv_norms[rows] = 1.0 / np.sqrt(np.maximum(sq_norms, 1e-24))
+
+    def add(self, item_id: str, embedding: np.ndarray):
+        """Append a single embedding to the index"""
+        self.add_batch([item_id], np.asarray(embedding).reshape(1, -1))
+
+    def add_batch(self, item_ids: List[str], embeddings: np.ndarray):
+        """
+        Append several embeddings at once
+
+        Args:
+            item_ids: Identifiers, one per row
+            embeddings: Array of shape (len(item_ids), dim)
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(item_ids):
+            raise ValueError("Expected one embedding row per id")
+        if not item_ids:
+            return
+
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch - expected {self.dim}, got {embeddings.shape[1]}")
+
+        start = len(self.ids)
+        end = start + len(item_ids)
+        self._reserve(end)
+
+        codes, scales = quantize(embeddings, self.precision)
+        self._matrix[start:end] = codes
+        if scales is not None:
+            self._scales[start:end] = scales
+        # Norms of the stored values, so distances are exact for what is stored
+        self._set_norms(slice(start, end), dequantize(codes, scales))
+        for row, item_id in enumerate(item_ids, start):
+            self._rows[item_id] = row
+        self.ids.extend(item_ids)
+        self._on_rows_added(start)
+
+    def update(self, item_id: str, embedding: np.ndarray):
+        """
+        Overwrite the embedding of an indexed id in place
+
+        Args:
+            item_id: Identifier already in the index
+            embedding: New embedding of shape (dim,)
+        """
+        row = self._rows[item_id]
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        if embedding.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch - expected {self.dim}, got {embedding.shape[1]}")
+
+        if not self._matrix.flags.writeable:
+            # Adopted read-only memory map: move to an owned buffer first
+            self._reserve(self._matrix.shape[0] + 1)
+
+        codes, scales = quantize(embedding, self.precision)
+        self._matrix[row] = codes[0]
+        if scales is not None:
+            self._scales[row] = scales[0]
+        self._set_norms(slice(row, row + 1), dequantize(codes, scales))
+        self._on_row_updated(row)
+
+    def row_distances(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Metric distance from the query to the given rows only"""
+        return self._distances(np.asarray(rows, dtype=np.int64), np.asarray(query, dtype=np.float32).ravel())
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Selected rows as float32"""
+        return dequantize(self._matrix[rows], self._scales[rows] if self._scales is not None else None)
+
+    def _project(self, rows: Optional[np.ndarray], query: np.ndarray, count: int) -> np.ndarray:
+        """
+        Dot product of the query with every selected row (the first `count` rows when rows is None)
+
+        Quantized rows are converted to float32 a block at a time so scoring
+        never materializes a float32 copy of the whole gallery.
+        """
+        if rows is not None:
+            count = len(rows)
+        if self.precision == 'float32':
+            return (self._matrix[:count] if rows is None else self._matrix[rows]) @ query
+
+        dots = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORE_BLOCK_ROWS):
+            block = slice(start, min(start + SCORE_BLOCK_ROWS, count)) if rows is None else rows[start:start + SCORE_BLOCK_ROWS]
+            dots[start:start + SCORE_BLOCK_ROWS] = self._matrix[block].astype(np.float32) @ query
+        if self._scales is not None:
+            dots *= self._scales[:count] if rows is None else self._scales[rows]
+        return dots
+
+    def _distances(self, rows: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        """
+        Metric distance from the query to the selected rows
+
+        Every metric is one matrix-vector product plus per-row precomputed
+        norms: ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2 for Euclidean, and
+        cos(x, q) = x.q / (||x|| ||q||) for the normalised metrics.
+        """
+        # Read once: rows added by another thread meanwhile are left out consistently
+        count = len(self.ids)
+        dots = self._project(rows, query, count)
+        if self.metric == 'euclidean':
+            sq_norms = self._sq_norms[:count] if rows is None else self._sq_norms[rows]
+            sq_dist = sq_norms - 2.0 * dots + np.dot(query, query)
+            np.maximum(sq_dist, 0.0, out=sq_dist)
+            return np.sqrt(sq_dist, out=sq_dist)
+
+        inv_norms = self._inv_norms[:count] if rows is None else self._inv_norms[rows]
+        similarity = dots * inv_norms / max(float(np.linalg.norm(query)), 1e-12)
+        if self.metric == 'cosine':
+            return 1.0 - similarity
+        sq_dist = 2.0 - 2.0 * similarity
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        return np.sqrt(sq_dist, out=sq_dist)
+
+    def distances(self, query: np.ndarray) -> np.ndarray:
+        """Metric distance from the query to every stored embedding"""
+        if len(self.ids) == 0:
+            return np.empty(0, dtype=np.float32)
+        return self._distances(None, np.asarray(query, dtype=np.float32).ravel())
+
+    def search(self, query: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        """
+        Find the k closest stored embeddings
+
+        Args:
+            query: Query embedding of shape (dim,)
+            k: Number of results to return
+
+        Returns:
+            List of (id, distance) pairs sorted by increasing distance
+        """
+        count = len(self.ids)
+        if count == 0 or k <= 0:
+            return []
+
+        query = np.asarray(query).ravel()
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch - expected {self.dim}, got {query.shape[0]}")
+
+        return self._top_k(None, self.distances(query), k)
+
+    def get(self, item_id: str) -> Optional[np.ndarray]:
+        """Return the stored embedding for an id as float32, or None if it is not indexed"""
+        row = self._rows.get(item_id)
+        if row is None:
+            return None
+        return self.vectors(np.array([row]))[0]
+
+    def snapshot(self) -> 'IndexSnapshot':
+        """Frozen view of the rows indexed so far, for writing while inserts continue"""
+        return IndexSnapshot(self)
+
+    def row_of(self, item_id: str) -> Optional[int]:
+        """Row of an id in the embedding matrix, or None if it is not indexed"""
+        return self._rows.get(item_id)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._rows
+
+    def maybe_train(self) -> bool:
+        """Train any search structure that needs it. Returns True if the index changed."""
+        return False
+
+    def _top_k(self, rows: Optional[np.ndarray], distances: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """Select the k smallest distances, mapping candidate positions back to ids"""
+        k = min(k, distances.shape[0])
+        if k <= 0:
+            return []
+        if k < distances.shape[0]:
+            top = np.argpartition(distances, k - 1)[:k]
+        else:
+            top = np.arange(distances.shape[0])
+        top = top[np.argsort(distances[top], kind='stable')]
+
+        if rows is not None:
+            return [(self.ids[rows[i]], float(distances[i])) for i in top]
+        return [(self.ids[i], float(distances[i])) for i in top]
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        """Arrays describing the search structure, for save()"""
+        return {
+            'kind': np.array(self.kind),
+            'metric': np.array(self.metric),
+            'ids': np.array(self.ids, dtype=np.str_),
+        }
+
+    def save(self, path: str):
+        """
+        Save the search structure to an .npz file
+
+        Embeddings themselves are not written; they already live in the
+        database and are handed back to the index when it is rebuilt.
+        """
+        # Per-process temp name: worker processes sharing a store may save concurrently
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **self._state())
+        os.replace(tmp_path, path)
+
+    def restore(self, path: str) -> bool:
+        """
+        Restore a structure saved with save() onto the embeddings already added
+
+        The saved structure is only used when its ids are a prefix of this
+        index's ids; any rows added after it was saved are indexed here.
+
+        Args:
+            path: Path to the .npz file
+
+        Returns:
+            True if the saved structure was applied
+        """
+        if not os.path.exists(path):
+            return False
+
+        with np.load(path, allow_pickle=False) as state:
+            if str(state['kind']) != self.kind:
+                return False
+            # Structures from before metrics were configurable were Euclidean
+            saved_metric = str(state['metric']) if 'metric' in state else 'euclidean'
+            if saved_metric != self.metric:
+                return False
+            saved_ids = state['ids']
+            if saved_ids.shape[0] > len(self.ids) or \
+                    not np.array_equal(saved_ids, np.array(self.ids[:saved_ids.shape[0]], dtype=np.str_)):
+                return False
+            return self._restore_state(state)
+
+    def _restore_state(self, state) -> bool:
+        return True
+
+    def adopt(self, item_ids: List[str], matrix: np.ndarray, scales: Optional[np.ndarray] = None):
+        """
+        Use an existing (possibly memory-mapped, read-only) matrix as storage
+
+        A matrix already in this index's precision is not copied; it is only
+        copied into a fresh buffer the first time another embedding is added.
+        A float32 matrix handed to a quantized index is converted.
+
+        Args:
+            item_ids: Identifiers, one per row
+            matrix: Array of shape (len(item_ids), dim)
+            scales: Per-row scale factors when matrix holds int8 codes
+        """
+        if self.ids:
+            raise ValueError("adopt() requires an empty index")
+        if matrix.ndim != 2 or matrix.shape[0] != len(item_ids):
+            raise ValueError("Expected a matrix with one row per id")
+        if not item_ids:
+            return
+
+        if matrix.dtype != np.dtype(self.precision):
+            # Stored in another precision; convert (this copies)
+            self.dim = matrix.shape[1]
+            for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS):
+                block = slice(start, start + SCORE_BLOCK_ROWS)
+                self.add_batch(list(item_ids[block]), dequantize(matrix[block], scales[block] if scales is not None else None))
+            return
+        if self.precision == 'int8' and (scales is None or scales.shape[0] != matrix.shape[0]):
+            raise ValueError("int8 matrices need one scale per row")
+
+        self.dim = matrix.shape[1]
+        self._matrix = matrix
+        self._scales = scales if self.precision == 'int8' else None
+        self._sq_norms = np.empty(matrix.shape[0], dtype=np.float32)
+        if self.metric != 'euclidean':
+            self._inv_norms = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS):
+            block = slice(start, start + SCORE_BLOCK_ROWS)
+            self._set_norms(block, self.vectors(block))
+        self._rows = {item_id: row for row, item_id in enumerate(item_ids)}
+        self.ids = list(item_ids)
+        self._on_rows_added(0)
+
+    def remap(self, item_ids: List[str], matrix: np.ndarray, scales: Optional[np.ndarray] = None):
+        """
+        Move the storage onto a (memory-mapped, read-only) matrix that holds
+        the indexed rows followed by new ones
+
+        Used when rows are appended to a file other processes map as well:
+        the indexed rows are not copied and an owned buffer is dropped. When
+        the matrix is in another precision the new rows are added as copies.
+
+        Args:
+            item_ids: Identifiers of the rows after the indexed ones
+            matrix: Array of shape (len(self) + len(item_ids), dim)
+            scales: Per-row scale factors when matrix holds int8 codes
+        """
+        if not self.ids:
+            self.adopt(item_ids, matrix, scales)
+            return
+        start = len(self.ids)
+        end = start + len(item_ids)
+        if matrix.ndim != 2 or matrix.shape[0] != end:
+            raise ValueError("Expected the indexed rows followed by one row per new id")
+        if matrix.dtype != np.dtype(self.precision):
+            self.add_batch(item_ids, dequantize(matrix[start:], scales[start:] if scales is not None else None))
+            return
+        if self.precision == 'int8' and (scales is None or scales.shape[0] != end):
+            raise ValueError("int8 matrices need one scale per row")
+
+        # Same order as add_batch: every buffer a search may pick up holds
+        # valid values for the rows published so far, the ids come last
+        if self._sq_norms.shape[0] < end:
+            sq_norms = np.empty(end, dtype=np.float32)
+            sq_norms[:start] = self._sq_norms[:start]
+            self._sq_norms = sq_norms
+            if self._inv_norms is not None:
+                inv_norms = np.empty(end, dtype=np.float32)
+                inv_norms[:start] = self._inv_norms[:start]
+                self._inv_norms = inv_norms
+        self._scales = scales if self.precision == 'int8' else None
+        self._matrix = matrix
+        for block_start in range(start, end, SCORE_BLOCK_ROWS):
+            block = slice(block_start, min(block_start + SCORE_BLOCK_ROWS, end))
+            self._set_norms(block, self.vectors(block))
+        for row, item_id in enumerate(item_ids, start):
+            self._rows[item_id] = row
+        self.ids.extend(item_ids)
+        self._on_rows_added(start)
+
+    def rows_changed(self, rows: List[int]):
+        """
+        Pick up rows of a memory-mapped matrix that another process overwrote in place
+
+        Their norms are recomputed from the new values. As with update(), a
+        search running before this may have scored them with the old norms.
+        """
+        for row in rows:
+            self._set_norms(slice(row, row + 1), self.vectors(slice(row, row + 1)))
+            self._on_row_updated(row)
+
+    def _on_rows_added(self, start: int):
+        """Hook for subclasses to index rows [start:len(self)]"""
+
+    def _on_row_updated(self, row: int):
+        """Hook for subclasses to re-index a row whose embedding was overwritten"""
+
+
+class IndexSnapshot:
+    """
+    Read-only view of the first rows of an index
+
+    Growing the index allocates a new buffer rather than moving rows in
+    place, so the captured view stays valid while other threads keep adding
+    embeddings. A row overwritten by update() may show its newer value.
+    """
+
+    def __init__(self, index: BruteForceIndex):
+        self.dim = index.dim
+        self.precision = index.precision
+        self.codes = index.codes
+        self.scales = index.scales
+        self._count = self.codes.shape[0]
+        self._rows = index._rows
+
+    def __len__(self) -> int:
+        return self._count
+
+    def row_of(self, item_id: str) -> Optional[int]:
+        row = self._rows.get(item_id)
+        if row is None or row >= self._count:
+            return None
+        return row
+
+    def get(self, item_id: str) -> Optional[np.ndarray]:
+        row = self.row_of(item_id)
+        if row is None:
+            return None
+        return dequantize(self.codes[row:row + 1], self.scales[row:row + 1] if self.scales is not None else None)[0]
+
+
+class IVFFlatIndex(BruteForceIndex):
+    """
+    Inverted-file index with exact distances inside each probed list
+
+    Embeddings are clustered with k-means into `nlist` cells. A query is only
+    scored against the rows of the `nprobe` closest cells, so raising nprobe
+    trades latency for recall. Until the gallery reaches `min_train_size` the
+    index answers with an exact brute-force scan. For the normalised metrics
+    the cells are built on L2-normalised embeddings.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, dim: Optional[int] = None, nlist: int = 0, nprobe: int = 8,
+                 min_train_size: int = 20000, initial_capacity: int = 1024, precision: str = 'float32',
+                 metric: str = 'euclidean'):
+        super().__init__(dim=dim, initial_capacity=initial_capacity, precision=precision, metric=metric)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.centroids = None
+        self._centroid_sq_norms = None
+        self._list_rows: List[List[int]] = []
+        # Bumped after every change to a list; searches build their row arrays
+        # without a lock, so a cached array only counts for the version it was built at
+        self._list_versions: List[int] = []
+        self._list_cache: List[Optional[Tuple[int, np.ndarray]]] = []
+        self._row_lists = np.empty(0, dtype=np.int32)  # List each row is filed under
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _on_rows_added(self, start: int):
+        if self.is_trained and len(self.ids) > start:
+            self._assign_rows(np.arange(start, len(self.ids)))
+
+    def _on_row_updated(self, row: int):
+        if not self.is_trained:
+            return
+        list_id = int(self._row_lists[row])
+        self._list_rows[list_id].remove(row)
+        self._list_versions[list_id] += 1
+        self._assign_rows(np.array([row]))
+
+    def maybe_train(self) -> bool:
+        if self.is_trained or len(self.ids) < self.min_train_size:
+            return False
+        self.train()
+        return True
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """
+        Cluster the stored embeddings and build the inverted lists
+
+        Args:
+            iterations: Number of k-means (Lloyd) iterations
+            seed: Random seed for centroid initialisation and sampling
+        """
+        count = len(self.ids)
+        if count == 0:
+            return
+
+        nlist = self.nlist or int(4 * np.sqrt(count))
+        nlist = max(1, min(nlist, count, 65536))
+
+        # Train on a sample; 64 points per centroid is plenty for k-means
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, nlist * 64)
+        sample = metric_space(self.vectors(np.sort(rng.choice(count, sample_size, replace=False))), self.metric)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._nearest_centroid(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        self._set_centroids(centroids, np.arange(count))
+        logger.info("Trained IVF index", extra={'lists': nlist, 'embeddings': count})
+
+    def _set_centroids(self, centroids: np.ndarray, rows: np.ndarray, assignment: Optional[np.ndarray] = None):
+        """Build the inverted lists of the given rows, then switch searches over to them"""
+        centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        if assignment is None:
+            assignment = self._assignment(rows, centroids)
+        self._centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        self._list_rows = [[] for _ in range(centroids.shape[0])]
+        self._list_versions = [0] * centroids.shape[0]
+        self._list_cache = [None] * centroids.shape[0]
+        self._row_lists = np.empty(0, dtype=np.int32)
+        self._assign_rows(rows, assignment)
+        # Set last: concurrent searches stay exact until the lists are complete
+        self.centroids = centroids
+
+    @staticmethod
+    def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """Index of the closest centroid for each vector, computed in bounded blocks"""
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        result = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], block_size):
+            block = vectors[start:start + block_size]
+            scores = centroid_sq_norms[None, :] - 2.0 * (block @ centroids.T)
+            result[start:start + block_size] = np.argmin(scores, axis=1)
+        return result
+
+    def _assignment(self, rows: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Nearest centroid of each row"""
+        if not len(rows):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([
+            self._nearest_centroid(metric_space(self.vectors(rows[start:start + SCORE_BLOCK_ROWS]), self.metric),
+                                   centroids)
+            for start in range(0, len(rows), SCORE_BLOCK_ROWS)
+        ])
+
+    def _assign_rows(self, rows: np.ndarray, assignment: Optional[np.ndarray] = None):
+        if assignment is None:
+            assignment = self._assignment(rows, self.centroids)
+        if len(rows) and rows.max() >= len(self._row_lists):
+            # Grow geometrically, like the embedding matrix
+            row_lists = np.full(max(int(rows.max()) + 1, 2 * len(self._row_lists)), -1, dtype=np.int32)
+            row_lists[:len(self._row_lists)] = self._row_lists
+            self._row_lists = row_lists
+        self._row_lists[rows] = assignment
+        order = np.argsort(assignment, kind='stable')
+        sorted_lists = assignment[order]
+        list_ids, starts = np.unique(sorted_lists, return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for list_id, start, end in zip(list_ids.tolist(), starts.tolist(), ends.tolist()):
+            self._list_rows[list_id].extend(rows[order[start:end]].tolist())
+            self._list_versions[list_id] += 1
+
+    def _list_array(self, list_id: int) -> np.ndarray:
+        version = self._list_versions[list_id]
+        cached = self._list_cache[list_id]
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        # The version is read before the list, so an array built while a
+        # writer changes the list is stored under a version that is already stale
+        rows = np.array(self._list_rows[list_id], dtype=np.int64)
+        self._list_cache[list_id] = (version, rows)
+        return rows
+
+    def list_rows(self, list_id: int) -> np.ndarray:
+        """Rows filed under one inverted list"""
+        return self._list_array(list_id)
+
+    def search(self, query: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        if not self.is_trained:
+            return super().search(query, k)
+
+        count = len(self.ids)
+        if count == 0 or k <= 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch - expected {self.dim}, got {query.shape[0]}")
+
+        nlist = self.centroids.shape[0]
+        nprobe = max(1, min(self.nprobe, nlist))
+        centroid_scores = self._centroid_sq_norms - 2.0 * (self.centroids @ metric_space(query, self.metric))
+        if nprobe < nlist:
+            probe = np.argpartition(centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(nlist)
+
+        rows = np.concatenate([self._list_array(list_id) for list_id in probe])
+        if rows.size == 0:
+            return []
+
+        return self._top_k(rows, self._distances(rows, query), k)
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        state = super()._state()
+        if self.is_trained:
+            state['centroids'] = self.centroids
+            state['assignment'] = self._row_lists[:len(self.ids)].copy()
+        return state
+
+    def _restore_state(self, state) -> bool:
+        if self.is_trained or 'centroids' not in state:
+            return False
+        saved_count = state['assignment'].shape[0]
+        self._set_centroids(state['centroids'], np.arange(saved_count), state['assignment'])
+        self._on_rows_added(saved_count)
+        return True
+
+
+INDEX_TYPES = {
+    BruteForceIndex.kind: BruteForceIndex,
+    IVFFlatIndex.kind: IVFFlatIndex,
+}
+
+
+def create_index(kind: str, **params) -> BruteForceIndex:
+    """
+    Create an empty embedding index
+
+    Args:
+        kind: 'brute' for exact search or 'ivf' for approximate search
+        params: Constructor arguments for the index class
+
+    Returns:
+        New index instance
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {sorted(INDEX_TYPES)}")
+    return INDEX_TYPES[kind](**params)
@@ -0,0 +1,119 @@
+"""
+Face Crop Store Module
+Keeps the face crops users were enrolled with, so the gallery can be
+re-embedded when the recognition model changes
+"""
+
+import os
+import time
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+import config
+from structured_logging import get_logger
+
+logger = get_logger('face_crops')
+
+
+def _sync_dir(path: str):
+    """Make the entries just renamed or created in a directory durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FaceCropStore:
+    """
+    JPEG face crops on disk, one directory per user
+
+    Only the most recent crops are kept, matching the templates the
+    storage manager keeps per user.
+    """
+
+    def __init__(self, root: str, max_per_user: int = config.MAX_TEMPLATES_PER_USER):
+        """
+        Args:
+            root: Directory holding one sub-directory of crops per user
+            max_per_user: Crops kept per user (oldest are deleted)
+        """
+        self.root = root
+        self.max_per_user = max_per_user
+
+    def _user_dir(self, user_id: str) -> str:
+        # User ids are generated UUIDs; refuse anything that could leave the root
+        if not user_id or os.path.basename(user_id) != user_id or user_id in ('.', '..'):
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        return os.path.join(self.root, user_id)
+
+    def _files(self, user_id: str) -> List[str]:
+        """Crop files of a user, oldest first"""
+        user_dir = self._user_dir(user_id)
+        if not os.path.isdir(user_dir):
+            return []
+        return [os.path.join(user_dir, name) for name in sorted(os.listdir(user_dir)) if name.endswith('.jpg')]
+
+    def save(self, user_id: str, crop: np.ndarray) -> Optional[str]:
+        """
+        Store one BGR face crop for a user
+
+        Returns:
+            Path of the written file, or None if the crop was empty
+        """
+        if crop is None or crop.size == 0:
+            return None
+
+        user_dir = self._user_dir(user_id)
+        created = not os.path.isdir(user_dir)
+        os.makedirs(user_dir, exist_ok=True)
+        ok, encoded = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        if not ok:
+            logger.error("Error encoding face crop", extra={'user_id': user_id})
+            return None
+        # Nanosecond timestamps sort in capture order; written under another
+        # name and renamed so a reader never loads half a file
+        path = os.path.join(user_dir, f"{time.time_ns()}.jpg")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # The crop is what re-embedding starts from, so make the rename (and
+        # a new user directory) survive a power loss too
+        _sync_dir(user_dir)
+        if created:
+            _sync_dir(self.root)
+
+        for old in self._files(user_id)[:-self.max_per_user]:
+            os.remove(old)
+        return path
+
+    def move(self, from_user_id: str, to_user_id: str):
+        """Hand one user's crops to another, e.g. when duplicate registrations are merged"""
+        files = self._files(from_user_id)
+        if not files:
+            return
+        to_dir = self._user_dir(to_user_id)
+        os.makedirs(to_dir, exist_ok=True)
+        for path in files:
+            os.replace(path, os.path.join(to_dir, os.path.basename(path)))
+        os.rmdir(self._user_dir(from_user_id))
+        for old in self._files(to_user_id)[:-self.max_per_user]:
+            os.remove(old)
+
+    def load(self, user_id: str) -> List[np.ndarray]:
+        """All stored crops of a user as BGR images, oldest first"""
+        crops = []
+        for path in self._files(user_id):
+            crop = cv2.imread(path, cv2.IMREAD_COLOR)
+            if crop is not None:
+                crops.append(crop)
+        return crops
+
+    def count(self, user_id: str) -> int:
+        """Number of crops stored for a user"""
+        return len(self._files(user_id))
@@ -1,24 +1,124 @@
 """
 Face Recognition Module
 Handles face detection, gender classification, and face recognition using DeepFace
+
+DeepFace (and with it TensorFlow) is imported when a model is first needed,
+not with this module, so processes that never run a model start fast.
 """
 
+import threading
+import time
 import cv2
 import numpy as np
 from typing import List, Dict, Optional, Tuple
-from deepface import DeepFace
 
 import config
+from metrics import span
+from structured_logging import get_logger
+
+logger = get_logger('recognition')
+
+
+def import_deepface():
+    """
+    Import DeepFace, which imports TensorFlow
+    
+    Takes seconds and a few hundred MB; call it ahead of time to pay that
+    cost at a convenient moment, e.g. in a gunicorn master before forking.
+    """
+    from deepface import DeepFace
+    return DeepFace
+
+
+def confident_faces(faces: List[Dict], min_confidence: float = config.FACE_DETECTION_CONFIDENCE) -> List[Dict]:
+    """
+    Keep the detections with at least min_confidence
+    
+    With enforce_detection=False, DeepFace.extract_faces never returns an
+    empty list: a frame without a face comes back as one face covering the
+    whole frame with confidence 0. That placeholder is dropped here too.
+    """
+    return [face for face in faces if (face.get('confidence') or 0) >= min_confidence]
 
 
 class FaceRecognitionModule:
     """Handles all face detection and recognition operations"""
     
-    def __init__(self):
+    def __init__(self, preload: bool = config.PRELOAD_MODELS):
         self.detector_backend = config.FACE_DETECTOR_BACKEND
         self.model_name = config.FACE_RECOGNITION_MODEL
-        print(f"Initialized Face Recognition Module")
-        print(f"Detector: {self.detector_backend}, Model: {self.model_name}")
+        self._recognition_model = None
+        self._gender_model = None
+        
+        # Readiness and startup timings, reported by /api/status
+        self.ready = False
+        self.startup_stats = {
+            'model_load_seconds': None,
+            'warmup_seconds': None,
+            'warmup_error': None
+        }
+        self._warmup_thread = None
+        
+        logger.info("Initialized Face Recognition Module",
+                    extra={'detector': self.detector_backend, 'model': self.model_name})
+        
+        if preload:
+            self.preload()
+        else:
+            self.ready = True
+    
+    def preload(self):
+        """Build and warm up the models now, in the background if WARMUP_IN_BACKGROUND is set"""
+        self.ready = False
+        if config.WARMUP_IN_BACKGROUND:
+            self._warmup_thread = threading.Thread(target=self.warm_up, daemon=True)
+            self._warmup_thread.start()
+        else:
+            self.warm_up()
+    
+    def load_models(self):
+        """Build the recognition and gender models and keep handles to them"""
+        start = time.perf_counter()
+        DeepFace = import_deepface()
+        self._get_recognition_model()
+        try:
+            self._gender_model = DeepFace.build_model(model_name='Gender', task='facial_attribute')
+        except TypeError:
+            # Older DeepFace versions have no task argument
+            self._gender_model = DeepFace.build_model('Gender')
+        self.startup_stats['model_load_seconds'] = round(time.perf_counter() - start, 3)
+        logger.info("Models loaded", extra={'seconds': self.startup_stats['model_load_seconds']})
+    
+    def warm_up(self):
+        """
+        Load the models and run one inference through every stage
+        
+        The detector is only built by DeepFace on first use, so a synthetic
+        frame is pushed through the whole pipeline (detection, gender and
+        embedding). The module is marked ready once this has finished.
+        """
+        try:
+            self.load_models()
+            
+            if config.MODEL_WARMUP:
+                start = time.perf_counter()
+                frame = np.full((config.CAMERA_HEIGHT, config.CAMERA_WIDTH, 3), 127, dtype=np.uint8)
+                cv2.circle(frame, (config.CAMERA_WIDTH // 2, config.CAMERA_HEIGHT // 2),
+                           config.CAMERA_HEIGHT // 4, (200, 180, 160), -1)
+                self.analyze_frame(frame, actions=('gender', 'embedding'))
+                self.startup_stats['warmup_seconds'] = round(time.perf_counter() - start, 3)
+                logger.info("Warm-up inference finished", extra={'seconds': self.startup_stats['warmup_seconds']})
+        
+        except Exception as e:
+            # Serve anyway; models will be built lazily on the first request
+            self.startup_stats['warmup_error'] = str(e)
+            logger.exception("Error warming up models")
+        
+        self.ready = True
+    
+    def get_status(self) -> Dict:
+        """Readiness and startup timings of the models"""
+        return dict(self.startup_stats, ready=self.ready)
     
     def detect_faces(self, frame: np.ndarray) -> List[Dict]:
         """
@@ -32,17 +132,19 @@ class FaceRecognitionModule:
         """
         try:
             # DeepFace.extract_faces returns list of face dictionaries
-            faces = DeepFace.extract_faces(
-                img_path=frame,
-                detector_backend=self.detector_backend,
-                enforce_detection=False,
-                align=True
-            )
+            DeepFace = import_deepface()
+            with span('detect'):
+                faces = DeepFace.extract_faces(
+                    img_path=frame,
+                    detector_backend=self.detector_backend,
+                    enforce_detection=False,
+                    align=True
+                )
             
             return faces
         
-        except Exception as e:
-            print(f"Error detecting faces: {e}")
+        except Exception:
+            logger.exception("Error detecting faces")
             return []
     
     def analyze_face(self, frame: np.ndarray, face_region: Dict) -> Optional[Dict]:
@@ -57,33 +159,31 @@ class FaceRecognitionModule:
             Analysis results including gender
         """
         try:
-            # Extract face coordinates
-            facial_area = face_region.get('facial_area', {})
-            x = facial_area.get('x', 0)
-            y = facial_area.get('y', 0)
-            w = facial_area.get('w', 0)
-            h = facial_area.get('h', 0)
-            
-            # Crop face region
-            face_img = frame[y:y+h, x:x+w]
-            
-            # Analyze face attributes
+            # Crop face region; it was found by the detector already, so the
+            # gender model gets it directly instead of detecting again
+            face_img = self._crop_face(frame, face_region)
+            return self._analyze_crop(face_img)
+        
+        except Exception:
+            logger.exception("Error analyzing face")
+            return None
+    
+    def _analyze_crop(self, face_img: np.ndarray) -> Optional[Dict]:
+        """Run gender analysis on an already detected face crop (BGR)"""
+        DeepFace = import_deepface()
+        with span('gender'):
             analysis = DeepFace.analyze(
                 img_path=face_img,
                 actions=['gender'],
-                detector_backend=self.detector_backend,
+                detector_backend='skip',
                 enforce_detection=False,
                 silent=True
             )
-            
-            # DeepFace.analyze returns a list, get first result
-            if isinstance(analysis, list) and len(analysis) > 0:
-                return analysis[0]
-            return analysis
         
-        except Exception as e:
-            print(f"Error analyzing face: {e}")
-            return None
+        # DeepFace.analyze returns a list, get first result
+        if isinstance(analysis, list) and len(analysis) > 0:
+            return analysis[0]
+        return analysis
     
     def get_face_embedding(self, frame: np.ndarray, face_region: Dict) -> Optional[np.ndarray]:
         """
@@ -96,35 +196,214 @@ class FaceRecognitionModule:
         Returns:
             Face embedding as numpy array
         """
+        # Same preprocessing and model call as the batched path, with one face
+        return self.get_face_embeddings([(frame, face_region)])[0]
+    
+    def analyze_frame(self, frame: np.ndarray, actions: Tuple[str, ...] = ('gender', 'embedding')) -> List[Dict]:
+        """
+        Detect faces once and run the requested models on the aligned crops
+        
+        The detector runs a single time per frame; gender analysis and the
+        recognition model receive the aligned faces with detection skipped.
+        
+        Args:
+            frame: Input image frame (BGR format from OpenCV)
+            actions: Any of 'gender' and 'embedding'
+        
+        Returns:
+            List of face dictionaries with 'facial_area', 'confidence' and the
+            aligned 'face' crop (BGR), plus 'gender' and/or 'embedding'
+        """
+        return self.analyze_faces(self.detect_aligned_faces(frame), actions)
+    
+    def detect_aligned_faces(self, frame: np.ndarray) -> List[Dict]:
+        """
+        Detect faces and keep each aligned crop for later analysis
+        
+        Detections below FACE_DETECTION_CONFIDENCE, including the whole-frame
+        placeholder of a frame without faces, are left out.
+        
+        Returns:
+            List of face dictionaries with 'facial_area', 'confidence' and
+            the aligned 'face' crop (BGR)
+        """
+        return [{
+            'facial_area': face.get('facial_area', {}),
+            'confidence': face.get('confidence', 0),
+            'face': self._to_bgr_image(face.get('face'))
+        } for face in confident_faces(self.detect_faces(frame))]
+    
+    def analyze_faces(self, faces: List[Dict], actions: Tuple[str, ...] = ('gender', 'embedding')) -> List[Dict]:
+        """
+        Run the requested models on faces from detect_aligned_faces
+        
+        Args:
+            faces: Face dictionaries holding an aligned 'face' crop
+            actions: Any of 'gender' and 'embedding'
+        
+        Returns:
+            The same face dictionaries with 'gender' and/or 'embedding' added
+        """
+        if 'gender' in actions:
+            for face in faces:
+                try:
+                    analysis = self._analyze_crop(face['face'])
+                except Exception:
+                    logger.exception("Error analyzing face")
+                    analysis = None
+                face['gender'] = self.get_gender_from_analysis(analysis)
+        
+        if 'embedding' in actions:
+            embeddings = self.get_face_embeddings(
+                [(face['face'], self._whole_image_region(face['face'])) for face in faces]
+            )
+            for face, embedding in zip(faces, embeddings):
+                face['embedding'] = embedding
+        
+        return faces
+    
+    def embed_photos(self, paths: List[str]) -> List[Dict]:
+        """
+        Load enrolment photos, keep the main face of each and embed them in one batch
+
+        Used by the bulk enrolment tool; decoding and detection happen here
+        so they run in the inference worker processes too. The face is
+        embedded from its detection box, cropped the way /register,
+        /recognize and the stream crop it, so enrolled and live embeddings
+        are comparable.
+
+        Args:
+            paths: Image file paths
+
+        Returns:
+            Per path a dictionary with the 'face' crop (BGR, the detection
+            box) and its 'embedding', or an 'error' describing why there is none
+        """
+        results = []
+        faces = []
+        regions = []
+        for path in paths:
+            frame = cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is None:
+                results.append({'error': 'unreadable image'})
+                continue
+            detected = [face for face in confident_faces(self.detect_faces(frame))
+                        if self._crop_face(frame, face).size]
+            if not detected:
+                results.append({'error': 'no face detected'})
+                continue
+            # A portrait may catch someone in the background; keep the largest face
+            face = max(detected, key=lambda f: f['facial_area'].get('w', 0) * f['facial_area'].get('h', 0))
+            results.append({'face': self._crop_face(frame, face).copy()})
+            faces.append(results[-1])
+            regions.append((frame, face))
+
+        embeddings = self.get_face_embeddings(regions)
+        for face, embedding in zip(faces, embeddings):
+            if embedding is None:
+                face['error'] = 'could not generate embedding'
+            else:
+                face['embedding'] = embedding
+        return results
+
+    @staticmethod
+    def _whole_image_region(img: np.ndarray) -> Dict:
+        """Face region covering an entire (already cropped) image"""
+        return {'facial_area': {'x': 0, 'y': 0, 'w': img.shape[1], 'h': img.shape[0]}}
+    
+    @staticmethod
+    def _to_bgr_image(face: np.ndarray) -> np.ndarray:
+        """Convert an aligned face from extract_faces (RGB, float in [0, 1]) to BGR uint8"""
+        if face is None:
+            return np.zeros((0, 0, 3), dtype=np.uint8)
+        if face.dtype != np.uint8:
+            face = np.clip(face * 255.0, 0, 255).astype(np.uint8)
+        return np.ascontiguousarray(face[:, :, ::-1])
+    
+    def get_face_embeddings(self, faces: List[Tuple[np.ndarray, Dict]]) -> List[Optional[np.ndarray]]:
+        """
+        Generate embeddings for many faces with one batched forward pass
+        
+        The face regions are expected to come from detect_faces (or a client
+        that ran it), so the crops go straight to the recognition model
+        without another detection pass. get_face_embedding uses the same path
+        for a single face.
+        
+        Args:
+            faces: List of (frame, face_region) pairs; several faces may share a frame
+        
+        Returns:
+            One embedding (or None if the crop was empty) per input face
+        """
+        embeddings: List[Optional[np.ndarray]] = [None] * len(faces)
+        if not faces:
+            return embeddings
+        
         try:
-            # Extract face coordinates
-            facial_area = face_region.get('facial_area', {})
-            x = facial_area.get('x', 0)
-            y = facial_area.get('y', 0)
-            w = facial_area.get('w', 0)
-            h = facial_area.get('h', 0)
+            keras_model = self._get_recognition_model()
+            target_size = tuple(keras_model.input_shape[1:3])
             
-            # Crop face region
-            face_img = frame[y:y+h, x:x+w]
+            batch = []
+            positions = []
+            for position, (frame, face_region) in enumerate(faces):
+                face_img = self._crop_face(frame, face_region)
+                if face_img.size == 0:
+                    continue
+                batch.append(self._prepare_face(face_img, target_size))
+                positions.append(position)
             
-            # Generate embedding
-            embedding_objs = DeepFace.represent(
-                img_path=face_img,
-                model_name=self.model_name,
-                detector_backend=self.detector_backend,
-                enforce_detection=False
-            )
+            if not batch:
+                return embeddings
             
-            # DeepFace.represent returns a list of dictionaries
-            if isinstance(embedding_objs, list) and len(embedding_objs) > 0:
-                embedding = embedding_objs[0].get('embedding')
-                return np.array(embedding)
+            for start in range(0, len(batch), config.MAX_RECOGNITION_BATCH):
+                chunk = np.stack(batch[start:start + config.MAX_RECOGNITION_BATCH])
+                with span('embed'):
+                    outputs = np.asarray(keras_model(chunk, training=False))
+                for offset, embedding in enumerate(outputs):
+                    embeddings[positions[start + offset]] = embedding
             
-            return None
+            return embeddings
         
-        except Exception as e:
-            print(f"Error generating face embedding: {e}")
-            return None
+        except Exception:
+            logger.exception("Error generating batched face embeddings")
+            return embeddings
+    
+    def _get_recognition_model(self):
+        """Build the recognition model once and keep the underlying Keras model"""
+        if self._recognition_model is None:
+            model = import_deepface().build_model(self.model_name)
+            # Newer DeepFace versions wrap the Keras model in a client object
+            self._recognition_model = getattr(model, 'model', model)
+        return self._recognition_model
+    
+    @staticmethod
+    def _crop_face(frame: np.ndarray, face_region: Dict) -> np.ndarray:
+        """Crop a face region out of a frame"""
+        facial_area = face_region.get('facial_area', {})
+        x = max(facial_area.get('x', 0), 0)
+        y = max(facial_area.get('y', 0), 0)
+        w = facial_area.get('w', 0)
+        h = facial_area.get('h', 0)
+        return frame[y:y+h, x:x+w]
+    
+    @staticmethod
+    def _prepare_face(face_img: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
+        """
+        Resize a BGR face crop to the model input size the way DeepFace does:
+        keep the aspect ratio, pad with black to the target size, scale to [0, 1]
+        """
+        target_h, target_w = target_size
+        h, w = face_img.shape[:2]
+        factor = min(target_h / h, target_w / w)
+        resized = cv2.resize(face_img, (max(1, int(w * factor)), max(1, int(h * factor))))
+        
+        pad_h = target_h - resized.shape[0]
+        pad_w = target_w - resized.shape[1]
+        padded = cv2.copyMakeBorder(
+            resized, pad_h // 2, pad_h - pad_h // 2, pad_w // 2, pad_w - pad_w // 2,
+            cv2.BORDER_CONSTANT, value=(0, 0, 0)
+        )
+        return padded.astype(np.float32) / 255.0
     
     def draw_face_box(self, frame: np.ndarray, face_region: Dict, 
                       label: str, color: Tuple[int, int, int]) -> np.ndarray:
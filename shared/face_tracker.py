@@ -0,0 +1,169 @@
+"""
+Face Tracker Module
+Links face detections across frames so a face that stays in view is only
+re-recognized at a fixed interval instead of on every frame
+"""
+
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+
+def box_iou(a: Dict, b: Dict) -> float:
+    """Intersection over union of two {x, y, w, h} boxes"""
+    x1 = max(a['x'], b['x'])
+    y1 = max(a['y'], b['y'])
+    x2 = min(a['x'] + a['w'], b['x'] + b['w'])
+    y2 = min(a['y'] + a['h'], b['y'] + b['h'])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a['w'] * a['h'] + b['w'] * b['h'] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def centroid_shift(a: Dict, b: Dict) -> float:
+    """Distance between box centres, relative to the size of box a"""
+    dx = (a['x'] + a['w'] / 2) - (b['x'] + b['w'] / 2)
+    dy = (a['y'] + a['h'] / 2) - (b['y'] + b['h'] / 2)
+    return (dx * dx + dy * dy) ** 0.5 / max(a['w'], a['h'], 1)
+
+
+class Track:
+    """One face followed across frames, with its cached recognition result"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box: Dict, frame_index: int):
+        self.track_id = next(self._ids)
+        self.box = box
+        self.last_seen = frame_index
+        self.last_recognized: Optional[int] = None
+        self.result: Optional[Dict] = None  # Cached gender/identity for this face
+        self.gallery_version = None  # Gallery the cached result was matched against
+
+
+class FaceTracker:
+    """Tracks faces for one client (socket or HTTP client id)"""
+
+    def __init__(self, iou_threshold: float = config.TRACK_IOU_THRESHOLD,
+                 max_centroid_shift: float = config.TRACK_MAX_CENTROID_SHIFT,
+                 refresh_interval: int = config.TRACK_REFRESH_FRAMES,
+                 max_age: int = config.TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_shift = max_centroid_shift
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.frame_index = 0
+        self.tracks: List[Track] = []
+        self.last_used = time.monotonic()
+
+    def update(self, boxes: List[Dict], gallery_version: int = 0) -> List[Tuple[Track, bool]]:
+        """
+        Assign this frame's face boxes to tracks
+
+        Boxes are matched greedily by IoU, falling back to centroid distance
+        for fast motion. Unmatched boxes start new tracks; tracks unseen for
+        more than max_age frames are dropped.
+
+        Args:
+            boxes: Face boxes {x, y, w, h} detected in the current frame
+            gallery_version: Changes whenever users are added; unrecognized
+                             faces are retried as soon as it changes
+
+        Returns:
+            (track, needs_recognition) for each box, in input order
+        """
+        self.frame_index += 1
+        self.last_used = time.monotonic()
+
+        candidates = []
+        for box_index, box in enumerate(boxes):
+            for track in self.tracks:
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    candidates.append((1.0 + iou, box_index, track))
+                elif centroid_shift(track.box, box) <= self.max_centroid_shift:
+                    candidates.append((1.0 - centroid_shift(track.box, box), box_index, track))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        assigned: Dict[int, Track] = {}
+        used_tracks = set()
+        for _, box_index, track in candidates:
+            if box_index in assigned or track.track_id in used_tracks:
+                continue
+            assigned[box_index] = track
+            used_tracks.add(track.track_id)
+
+        results = []
+        for box_index, box in enumerate(boxes):
+            track = assigned.get(box_index)
+            if track is None:
+                track = Track(box, self.frame_index)
+                self.tracks.append(track)
+            track.box = box
+            track.last_seen = self.frame_index
+            results.append((track, self._needs_recognition(track, gallery_version)))
+
+        self.tracks = [track for track in self.tracks if self.frame_index - track.last_seen <= self.max_age]
+        return results
+
+    def _needs_recognition(self, track: Track, gallery_version: int) -> bool:
+        if track.result is None or self.frame_index - track.last_recognized >= self.refresh_interval:
+            return True
+        # Someone just registered could be this unknown face
+        return not track.result.get('recognized') and track.gallery_version != gallery_version
+
+    def mark_recognized(self, track: Track, result: Dict, gallery_version: int = 0):
+        """Cache a fresh recognition result on a track"""
+        track.result = result
+        track.last_recognized = self.frame_index
+        track.gallery_version = gallery_version
+
+
+class TrackerRegistry:
+    """Per-session trackers plus counters of recognitions run and skipped"""
+
+    def __init__(self, session_ttl: float = config.TRACK_SESSION_TTL):
+        self.session_ttl = session_ttl
+        self._trackers: Dict[str, FaceTracker] = {}
+        self._lock = threading.Lock()
+        self.faces_seen = 0
+        self.recognitions_run = 0
+
+    def get(self, session_id: str) -> FaceTracker:
+        """Tracker for a session, created on first use"""
+        with self._lock:
+            self._expire()
+            tracker = self._trackers.get(session_id)
+            if tracker is None:
+                tracker = self._trackers[session_id] = FaceTracker()
+            return tracker
+
+    def drop(self, session_id: str):
+        """Forget a session, e.g. when its socket disconnects"""
+        with self._lock:
+            self._trackers.pop(session_id, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id in [sid for sid, t in self._trackers.items() if now - t.last_used > self.session_ttl]:
+            del self._trackers[session_id]
+
+    def record(self, faces: int, recognized: int):
+        """Count faces seen in a frame and how many of them went through the models"""
+        with self._lock:
+            self.faces_seen += faces
+            self.recognitions_run += recognized
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            skipped = self.faces_seen - self.recognitions_run
+            return {
+                'sessions': len(self._trackers),
+                'faces_seen': self.faces_seen,
+                'recognitions_run': self.recognitions_run,
+                'recognitions_skipped': skipped,
+                'skip_rate': round(skipped / self.faces_seen, 3) if self.faces_seen else 0.0
+            }
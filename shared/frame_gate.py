@@ -0,0 +1,207 @@
+"""
+Frame Gate Module
+Decides per client whether a frame needs the face detector at all
+
+Two cheap checks run before the SSD detector:
+- motion: a frame that barely differs from the last detected one reuses
+  that detection
+- pre-filter: an OpenCV Haar cascade on a downscaled frame; when it finds
+  no face candidate and the detector found none last time either, the
+  frame is taken to be empty
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import cv2
+import numpy as np
+
+import config
+from metrics import REGISTRY, span
+from structured_logging import get_logger
+
+logger = get_logger('frame_gate')
+
+DECISIONS = REGISTRY.counter('face_frame_gate_total', 'Frames by frame gate decision', ['decision'])
+
+# Gate decisions
+DETECTED = 'detected'  # The detector ran
+UNCHANGED = 'unchanged'  # Reused the last detection, the scene did not move
+NO_FACE = 'no_face'  # Skipped, the pre-filter found no face candidate
+
+# Loaded Haar cascades not in use by a thread (detectMultiScale is not thread-safe)
+_free_cascades = []
+_cascade_lock = threading.Lock()
+_cascade_missing = False
+
+
+def _load_cascade():
+    """A new Haar face cascade, or None (and no further attempts) if OpenCV or the XML lacks it"""
+    global _cascade_missing
+    path = config.FRAME_GATE_CASCADE
+    if not path and hasattr(cv2, 'data'):
+        path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+    # OpenCV 5 moved cascades out of the main package
+    available = hasattr(cv2, 'CascadeClassifier') and path and os.path.exists(path)
+    classifier = cv2.CascadeClassifier(path) if available else None
+    if classifier is None or classifier.empty():
+        _cascade_missing = True
+        logger.warning("Face pre-filter cascade not found, only motion gating is used", extra={'path': path})
+        return None
+    return classifier
+
+
+def _gray(frame: np.ndarray, width: int) -> np.ndarray:
+    """Grayscale copy of a frame scaled down to at most width pixels across"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    height, frame_width = gray.shape[:2]
+    if frame_width > width:
+        gray = cv2.resize(gray, (width, max(1, round(height * width / frame_width))), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def may_contain_face(frame: np.ndarray, width: int = config.FRAME_GATE_PREFILTER_WIDTH) -> bool:
+    """
+    Fast, lenient check for face candidates
+
+    Returns:
+        False only when the Haar cascade finds nothing face-like; True when
+        it does or when no cascade is available
+    """
+    if _cascade_missing:
+        return True
+    with _cascade_lock:
+        classifier = _free_cascades.pop() if _free_cascades else None
+    if classifier is None:
+        classifier = _load_cascade()
+        if classifier is None:
+            return True
+    try:
+        # No histogram equalisation: Haar features are contrast-normalised
+        # already, and equalising amplifies background texture into slow false candidates
+        candidates = classifier.detectMultiScale(_gray(frame, width), scaleFactor=1.2,
+                                                 minNeighbors=config.FRAME_GATE_MIN_NEIGHBORS, minSize=(24, 24))
+    finally:
+        with _cascade_lock:
+            _free_cascades.append(classifier)
+    return len(candidates) > 0
+
+
+class FrameGate:
+    """Motion and pre-filter gating for the frames of one client"""
+
+    def __init__(self, motion_threshold: float = config.FRAME_GATE_MOTION_THRESHOLD,
+                 max_skipped: int = config.FRAME_GATE_MAX_SKIPPED,
+                 prefilter: bool = config.FRAME_GATE_PREFILTER):
+        """
+        Args:
+            motion_threshold: Fraction of thumbnail pixels that must change
+                              (by more than FRAME_GATE_PIXEL_DELTA grey levels)
+                              for a frame to count as moved
+            max_skipped: Frames in a row that may skip the detector
+            prefilter: Whether to use the Haar pre-filter
+        """
+        self.motion_threshold = motion_threshold
+        self.max_skipped = max_skipped
+        self.prefilter = prefilter
+        self._thumbnail: Optional[np.ndarray] = None  # Of the frame last sent to the detector
+        self._result: Any = None
+        self._skipped = 0
+        self._lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def run(self, frame: np.ndarray, detect: Callable[[np.ndarray], Any]):
+        """
+        Detect faces in a frame unless the gate can answer without the detector
+
+        Args:
+            frame: BGR frame
+            detect: Runs the detector (and whatever follows it) on the frame;
+                    its result must be a list of faces
+
+        Returns:
+            (result, decision): the detection result, reused or empty when
+            skipped, and DETECTED, UNCHANGED or NO_FACE
+        """
+        self.last_used = time.monotonic()
+        with span('frame_gate'):
+            thumbnail = cv2.GaussianBlur(_gray(frame, config.FRAME_GATE_THUMBNAIL_WIDTH), (3, 3), 0)
+            with self._lock:
+                previous, result, skipped = self._thumbnail, self._result, self._skipped
+            decision = DETECTED
+            if previous is not None and skipped < self.max_skipped:
+                if previous.shape == thumbnail.shape and self._changed(previous, thumbnail) < self.motion_threshold:
+                    decision = UNCHANGED
+                elif self.prefilter and not result and not may_contain_face(frame):
+                    decision = NO_FACE
+
+        if decision == DETECTED:
+            result = detect(frame)
+            with self._lock:
+                self._thumbnail, self._result, self._skipped = thumbnail, result, 0
+        else:
+            with self._lock:
+                self._skipped += 1
+                if decision == NO_FACE:
+                    # Compare later frames with this empty scene
+                    self._thumbnail = thumbnail
+            result = result if decision == UNCHANGED else []
+        DECISIONS.inc(decision=decision)
+        return result, decision
+
+    @staticmethod
+    def _changed(previous: np.ndarray, thumbnail: np.ndarray) -> float:
+        """Fraction of pixels that differ noticeably between two thumbnails"""
+        return np.count_nonzero(cv2.absdiff(previous, thumbnail) > config.FRAME_GATE_PIXEL_DELTA) / thumbnail.size
+
+
+class FrameGateRegistry:
+    """Per-session frame gates plus counters of detector calls run and saved"""
+
+    def __init__(self, session_ttl: float = config.TRACK_SESSION_TTL):
+        self.session_ttl = session_ttl
+        self._gates: Dict[str, FrameGate] = {}
+        self._lock = threading.Lock()
+        self._decisions = {DETECTED: 0, UNCHANGED: 0, NO_FACE: 0}
+
+    def get(self, session_id: str) -> FrameGate:
+        """Gate for a session, created on first use"""
+        with self._lock:
+            self._expire()
+            gate = self._gates.get(session_id)
+            if gate is None:
+                gate = self._gates[session_id] = FrameGate()
+            return gate
+
+    def drop(self, session_id: str):
+        """Forget a session, e.g. when its socket disconnects"""
+        with self._lock:
+            self._gates.pop(session_id, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id in [sid for sid, g in self._gates.items() if now - g.last_used > self.session_ttl]:
+            del self._gates[session_id]
+
+    def run(self, session_id: str, frame: np.ndarray, detect: Callable[[np.ndarray], Any]):
+        """FrameGate.run on the session's gate, counting the decision"""
+        result, decision = self.get(session_id).run(frame, detect)
+        with self._lock:
+            self._decisions[decision] += 1
+        return result
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            frames = sum(self._decisions.values())
+            saved = frames - self._decisions[DETECTED]
+            return {
+                'sessions': len(self._gates),
+                'frames': frames,
+                'detector_calls': self._decisions[DETECTED],
+                'detector_calls_saved': saved,
+                'skipped_unchanged': self._decisions[UNCHANGED],
+                'skipped_no_face': self._decisions[NO_FACE],
+                'skip_rate': round(saved / frames, 3) if frames else 0.0
+            }
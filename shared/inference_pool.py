@@ -0,0 +1,169 @@
+"""
+Inference Pool Module
+Runs FaceRecognitionModule in dedicated worker processes so model inference
+does not block the web server's request threads
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+import config
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger('inference_pool')
+
+# FaceRecognitionModule of the current worker process
+_worker_module = None
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the inference queue is full and a request should be rejected"""
+
+
+def _init_worker(threads_per_worker: int):
+    """Load and warm up the models once per worker process"""
+    global _worker_module
+
+    # TensorFlow reads these when it is first imported, so set them before
+    # face_recognition_module pulls it in
+    os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(threads_per_worker))
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+
+    # Stage timings are sent back with each result and recorded by the web process
+    metrics.forward_spans()
+    from face_recognition_module import FaceRecognitionModule
+    _worker_module = FaceRecognitionModule(preload=False)
+    _worker_module.warm_up()
+
+
+def _run(method: str, args: tuple):
+    """Call a module method; returns (result, stage timings recorded during the call)"""
+    metrics.take_forwarded_spans()
+    result = getattr(_worker_module, method)(*args)
+    return result, metrics.take_forwarded_spans()
+
+
+def resolve_worker_count(workers: int) -> int:
+    """Translate the INFERENCE_WORKERS setting (-1 = one per CPU core) into a process count"""
+    if workers < 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+class InferencePool:
+    """Bounded pool of worker processes that each hold loaded models"""
+
+    def __init__(self, workers: int = config.INFERENCE_WORKERS,
+                 max_pending: int = config.INFERENCE_QUEUE_SIZE):
+        self.workers = resolve_worker_count(workers)
+        self.max_pending = max_pending
+        self.ready = False
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self._threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self._executor = self._start_executor()
+        logger.info("Inference pool started", extra={'workers': self.workers,
+                                                     'threads_per_worker': self._threads_per_worker,
+                                                     'queue_size': max_pending})
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        # TensorFlow is not fork-safe, so worker processes are spawned fresh
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self._threads_per_worker,)
+        )
+
+    def warm_up(self):
+        """Start every worker now instead of on the first request; sets ready when done"""
+        futures = [self._executor.submit(_run, 'get_status', ()) for _ in range(self.workers)]
+
+        def wait_for_workers():
+            for future in futures:
+                future.result()
+            self.ready = True
+            logger.info("Inference workers ready")
+
+        threading.Thread(target=wait_for_workers, daemon=True).start()
+
+    def submit(self, method: str, *args) -> Future:
+        """
+        Queue a FaceRecognitionModule method call on a worker
+
+        Args:
+            method: Name of the FaceRecognitionModule method
+            args: Positional arguments (must be picklable)
+
+        Returns:
+            Future with the method's return value
+
+        Raises:
+            PoolSaturatedError: If max_pending calls are already queued or running
+            BrokenProcessPool: If a worker died; the pool is restarted for
+                the next call
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PoolSaturatedError(f"Inference queue is full ({self.max_pending} pending)")
+            self._pending += 1
+
+        executor = self._executor
+        try:
+            submitted = executor.submit(_run, method, args)
+        except BaseException as e:
+            # The call never reached a worker, so _complete will not release its slot
+            with self._lock:
+                self._pending -= 1
+            if isinstance(e, BrokenProcessPool):
+                self._restart(executor)
+            raise
+
+        future = Future()
+        submitted.add_done_callback(lambda done: self._complete(done, future))
+        return future
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        """Replace an executor whose worker died (e.g. killed for memory) with fresh workers"""
+        with self._lock:
+            if self._executor is not broken:
+                return  # Another request thread restarted it already
+            self._executor = self._start_executor()
+            self.ready = False
+        broken.shutdown(wait=False, cancel_futures=True)
+        logger.warning("Inference worker died; pool restarted", extra={'workers': self.workers})
+        self.warm_up()
+
+    def call(self, method: str, *args, timeout: Optional[float] = config.INFERENCE_TIMEOUT):
+        """Submit a call and wait for its result"""
+        return self.submit(method, *args).result(timeout=timeout)
+
+    def _complete(self, done: Future, future: Future):
+        """Release the queue slot and pass the worker's result on, recording its stage timings"""
+        with self._lock:
+            self._pending -= 1
+        try:
+            result, spans = done.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        metrics.record_spans(spans)
+        future.set_result(result)
+
+    def get_status(self) -> Dict:
+        """Readiness and queue depth of the pool"""
+        return {
+            'ready': self.ready,
+            'workers': self.workers,
+            'pending': self._pending,
+            'max_pending': self.max_pending
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
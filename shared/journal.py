@@ -0,0 +1,133 @@
+"""
+Journal Module
+Append-only write-ahead log of user registrations
+"""
+
+import base64
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+from structured_logging import get_logger
+
+logger = get_logger('journal')
+
+
+def sealed_path(path: str) -> str:
+    """Path a journal is moved to while it is being compacted into a snapshot"""
+    return path + '.compacting'
+
+
+def encode_entry(record: Dict, embedding: Optional[np.ndarray] = None) -> bytes:
+    """Serialize a user record (and its embedding as base64 float32) to one journal line"""
+    entry = {'user': record}
+    if embedding is not None:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        entry['embedding'] = base64.b64encode(embedding.tobytes()).decode('ascii')
+    return (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def decode_entry(line: bytes) -> Tuple[Dict, Optional[np.ndarray]]:
+    """Inverse of encode_entry"""
+    entry = json.loads(line)
+    embedding = entry.get('embedding')
+    if embedding is not None:
+        embedding = np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+    return entry['user'], embedding
+
+
+def read_entries(path: str) -> Iterator[Tuple[Dict, Optional[np.ndarray]]]:
+    """
+    Read every complete entry of a journal file
+
+    A torn final line (a crash in the middle of an append) is skipped.
+
+    Args:
+        path: Journal file path
+
+    Yields:
+        (user record, embedding) pairs in append order
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                logger.warning("Ignoring incomplete entry at the end of the journal", extra={'path': path})
+                break
+            yield decode_entry(line)
+
+
+class Journal:
+    """Append-only log where every registration is one fsync'd line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entry_count = 0
+        self._file = None
+
+    def open(self):
+        """Open the journal for appending, dropping a torn final line if present"""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                data = f.read()
+                self.entry_count = data.count(b'\n')
+                valid_size = data.rfind(b'\n') + 1
+                if valid_size != len(data):
+                    f.truncate(valid_size)
+        self._file = open(self.path, 'ab')
+
+    def append(self, record: Dict, embedding: Optional[np.ndarray] = None):
+        """Durably append one registration"""
+        self.append_many([(record, embedding)])
+
+    def append_many(self, entries: List[Tuple[Dict, Optional[np.ndarray]]]):
+        """Durably append several registrations with one fsync"""
+        self._file.write(b''.join(encode_entry(record, embedding) for record, embedding in entries))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entry_count += len(entries)
+
+    def seal(self) -> str:
+        """
+        Move the current journal aside and start a new empty one
+
+        The sealed file is kept until a snapshot containing its entries has
+        been written, so a crash during compaction loses nothing. A sealed
+        file left by a failed compaction is extended rather than replaced;
+        entries briefly in both files are harmless, replay is idempotent.
+
+        Returns:
+            Path of the sealed journal
+        """
+        self._file.close()
+        path = sealed_path(self.path)
+        if os.path.exists(path):
+            with open(self.path, 'rb') as source, open(path, 'ab') as sealed:
+                sealed.write(source.read())
+                sealed.flush()
+                os.fsync(sealed.fileno())
+            logger.warning("Appended the journal to a sealed journal left by an earlier compaction",
+                           extra={'path': path})
+            self._file = open(self.path, 'ab')
+            self.reset()
+            return path
+        os.replace(self.path, path)
+        self.entry_count = 0
+        self._file = open(self.path, 'ab')
+        return path
+
+    def reset(self):
+        """Empty the journal once its entries are covered by a snapshot"""
+        self._file.close()
+        with open(self.path, 'wb') as f:
+            os.fsync(f.fileno())
+        self.entry_count = 0
+        self._file = open(self.path, 'ab')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,146 @@
+"""
+Match Cache Module
+Small LRU/TTL cache of recently matched users that answers repeat
+recognitions without scanning the whole gallery
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class _Entry:
+    __slots__ = ('embedding', 'separation', 'stored_at')
+
+    def __init__(self, embedding: np.ndarray, separation: float):
+        self.embedding = embedding
+        self.separation = separation  # Distance to the nearest vector of any other user
+        self.stored_at = time.monotonic()
+
+
+class MatchCache:
+    """
+    Recently matched users, checked before the full gallery search
+
+    A query within separation / 2 of a cached user is closer to that user
+    than to anyone else in the gallery (triangle inequality), so a hit
+    returns what the full search would, as far as the separation is exact
+    (see StorageManager._cache_match). New users, centroids and
+    templates can only shrink separations, which add() applies to every
+    cached entry.
+    """
+
+    def __init__(self, capacity: int = 64, ttl: float = 300):
+        """
+        Args:
+            capacity: Maximum number of cached users (least recently used are evicted)
+            ttl: Seconds before a cached user must be matched by a full search again
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._hit_seconds = 0.0
+        self._miss_seconds = 0.0
+
+    def lookup(self, query: np.ndarray, threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        Find a cached user that is guaranteed to be the query's nearest match
+
+        Returns:
+            (user_id, distance) on a hit, None on a miss
+        """
+        with self._lock:
+            self._expire()
+            best = None
+            for user_id, entry in self._entries.items():
+                distance = float(np.linalg.norm(entry.embedding - query))
+                if distance < min(threshold, entry.separation / 2) and (best is None or distance < best[1]):
+                    best = (user_id, distance)
+            if best is not None:
+                self._entries.move_to_end(best[0])
+            return best
+
+    def store(self, user_id: str, embedding: np.ndarray, separation: float):
+        """Cache a user matched by the full search"""
+        with self._lock:
+            self._entries[user_id] = _Entry(np.array(embedding, dtype=np.float32), separation)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def add(self, embedding: np.ndarray, owner: Optional[str] = None):
+        """
+        Account for a new vector in the gallery (a new user, centroid or template)
+
+        Args:
+            embedding: The new vector
+            owner: User the vector belongs to; that user's own entry is unaffected
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            for user_id, entry in self._entries.items():
+                if user_id == owner or entry.embedding.shape != embedding.shape:
+                    continue
+                distance = float(np.linalg.norm(entry.embedding - embedding))
+                if distance < entry.separation:
+                    entry.separation = distance
+                    self.invalidations += 1
+
+    def discard(self, user_id: str):
+        """Drop one user's entry, e.g. after their centroid moved"""
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after the gallery is reloaded"""
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        # Entries are kept in LRU order, not store order, so check them all
+        for user_id in [uid for uid, entry in self._entries.items() if entry.stored_at < cutoff]:
+            del self._entries[user_id]
+            self.expirations += 1
+
+    def record(self, hit: bool, seconds: float):
+        """Count a lookup and how long the whole match took"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self._hit_seconds += seconds
+            else:
+                self.misses += 1
+                self._miss_seconds += seconds
+
+    def get_stats(self) -> Dict:
+        """Hit rate, evictions and average latency of hits vs. full searches"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            hit_ms = self._hit_seconds * 1000 / self.hits if self.hits else 0.0
+            miss_ms = self._miss_seconds * 1000 / self.misses if self.misses else 0.0
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'mean_hit_ms': round(hit_ms, 3),
+                'mean_miss_ms': round(miss_ms, 3),
+                'saved_ms': round(self.hits * (miss_ms - hit_ms), 1) if self.hits and self.misses else 0.0
+            }
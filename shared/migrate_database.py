@@ -0,0 +1,67 @@
+"""
+Database Migration Tool
+Converts a users database between the JSON, binary and SQL storage formats
+
+Usage:
+    python shared/migrate_database.py [--database data/users_database.json] [--from json] [--to binary]
+
+The SQL store is the database named by the DATABASE_URL environment variable.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import binary_store
+import config
+from storage_manager import StorageManager
+
+FORMATS = ['json', 'binary', 'sql']
+
+
+def migrate(database_path: str, source_format: str, target_format: str) -> StorageManager:
+    """
+    Load a database in one storage format and write it in another
+
+    The source is left in place so the migration can be verified before
+    it is removed.
+
+    Args:
+        database_path: Path of the JSON database (the binary files sit next to it)
+        source_format: 'json', 'binary' or 'sql'
+        target_format: 'json', 'binary' or 'sql'
+
+    Returns:
+        StorageManager holding the migrated database
+    """
+    storage = StorageManager(database_path, storage_format=source_format)
+    if not storage.convert_to(target_format):
+        raise RuntimeError(f"Could not write the database as {target_format}")
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', config.DATABASE_PATH),
+                        help='Path of the JSON database')
+    parser.add_argument('--from', dest='source_format', choices=FORMATS, default='json',
+                        help='Storage format to convert from')
+    parser.add_argument('--to', dest='target_format', choices=FORMATS, default='binary',
+                        help='Storage format to convert to')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    storage = migrate(args.database, args.source_format, args.target_format)
+    print(f"Migrated {storage.get_user_count()} users to {args.target_format} "
+          f"in {time.perf_counter() - start:.2f}s")
+    if args.target_format == 'binary':
+        # The segment's name carries its precision and the version the metadata header points at
+        segment, _ = binary_store.segment_files(storage.base_path, binary_store.read_header(storage.base_path))
+        print(f"Set STORAGE_FORMAT=binary to use {segment} / {binary_store.meta_path(storage.base_path)}")
+
+
+if __name__ == '__main__':
+    main()
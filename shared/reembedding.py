@@ -0,0 +1,210 @@
+"""
+Re-embedding Job
+Migrates users enrolled with another recognition model into the active
+model's gallery, by embedding their stored face crops again
+
+Usage:
+    python shared/reembedding.py [--database data/users_database.json] [--batch-size 32]
+
+Set FACE_RECOGNITION_MODEL to the new model first. The same job runs inside
+the web app (POST /api/face/reembed) so recognition keeps working while it
+migrates; with several workers sharing a SQL store, start it on one of them.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from face_crops import FaceCropStore
+from structured_logging import get_logger
+
+logger = get_logger('reembedding')
+
+# Seconds between progress lines logged while the job runs
+PROGRESS_INTERVAL = 5.0
+
+
+def whole_crop_region(crop: np.ndarray) -> Dict:
+    """Face region covering a whole stored crop"""
+    return {'facial_area': {'x': 0, 'y': 0, 'w': crop.shape[1], 'h': crop.shape[0]}}
+
+
+class ReembeddingJob:
+    """
+    Background migration of every user outside the active gallery partition
+
+    Users are embedded a batch at a time and each batch is written and
+    moved into the searched gallery as soon as it is done, so recognition
+    runs on the partially migrated gallery and a restarted job simply
+    continues with the users that are still left. Users without stored
+    crops cannot be migrated and stay in their old partition.
+    """
+
+    def __init__(self, storage, crops: FaceCropStore,
+                 embed_faces: Callable[[List[Tuple[np.ndarray, Dict]]], List[Optional[np.ndarray]]],
+                 batch_size: int = config.REEMBED_BATCH_SIZE):
+        """
+        Args:
+            storage: StorageManager holding the gallery
+            crops: Store of the crops users were enrolled with
+            embed_faces: Batched embedding function with the signature of
+                         FaceRecognitionModule.get_face_embeddings
+            batch_size: Users embedded per batch
+        """
+        self.storage = storage
+        self.crops = crops
+        self.embed_faces = embed_faces
+        self.batch_size = batch_size
+
+        self._thread = None
+        self._cancel = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        self.state = 'idle'
+        self.error = None
+        self.total = 0
+        self.processed = 0
+        self.migrated = 0
+        self.missing_crops = 0
+        self.failed = 0
+        self._started = None
+        self._finished = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """
+        Start the job in a background thread
+
+        Returns:
+            False if it is already running
+        """
+        if self.running:
+            return False
+        self._cancel.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return True
+
+    def cancel(self):
+        """Stop after the current batch; migrated users stay migrated"""
+        self._cancel.set()
+
+    def run(self):
+        """Migrate every pending user, blocking until done"""
+        self._reset()
+        self.state = 'running'
+        self._started = time.monotonic()
+        pending = self.storage.users_to_migrate()
+        self.total = len(pending)
+        logger.info("Re-embedding users", extra={'users': self.total, 'model_name': config.FACE_RECOGNITION_MODEL})
+
+        last_report = self._started
+        try:
+            for start in range(0, len(pending), self.batch_size):
+                if self._cancel.is_set():
+                    self.state = 'cancelled'
+                    break
+                self._migrate_batch(pending[start:start + self.batch_size])
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    self._log_progress()
+            else:
+                self.state = 'done'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.exception("Error in re-embedding job")
+        finally:
+            self._finished = time.monotonic()
+            self._log_progress()
+
+    def _migrate_batch(self, user_ids: List[str]):
+        """Embed the crops of a batch of users in one call and migrate them"""
+        faces = []
+        owners = []
+        for user_id in user_ids:
+            crops = self.crops.load(user_id)
+            if not crops:
+                self.missing_crops += 1
+                continue
+            for crop in crops:
+                faces.append((crop, whole_crop_region(crop)))
+                owners.append(user_id)
+
+        embeddings: Dict[str, List[np.ndarray]] = {}
+        if faces:
+            for user_id, embedding in zip(owners, self.embed_faces(faces)):
+                if embedding is not None:
+                    embeddings.setdefault(user_id, []).append(np.asarray(embedding, dtype=np.float32))
+
+        with_crops = len(set(owners))
+        migrated = self.storage.migrate_users({user_id: np.stack(rows) for user_id, rows in embeddings.items()})
+        self.migrated += migrated
+        self.failed += with_crops - migrated
+        self.processed += len(user_ids)
+
+    def get_progress(self) -> Dict:
+        """Job state, counts, throughput and estimated time left"""
+        elapsed = 0.0
+        if self._started is not None:
+            elapsed = (self._finished or time.monotonic()) - self._started
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.processed
+        return {
+            'state': self.state,
+            'model_name': config.FACE_RECOGNITION_MODEL,
+            'total': self.total,
+            'processed': self.processed,
+            'migrated': self.migrated,
+            'missing_crops': self.missing_crops,
+            'failed': self.failed,
+            'percent': round(100.0 * self.processed / self.total, 1) if self.total else 0.0,
+            'elapsed_seconds': round(elapsed, 1),
+            'users_per_second': round(rate, 2),
+            'eta_seconds': round(remaining / rate, 1) if self.state == 'running' and rate > 0 else None,
+            'error': self.error
+        }
+
+    def _log_progress(self):
+        progress = self.get_progress()
+        logger.info("Re-embedding progress", extra={key: progress[key] for key in (
+            'state', 'processed', 'total', 'percent', 'migrated', 'missing_crops', 'failed',
+            'users_per_second', 'eta_seconds')})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', config.DATABASE_PATH),
+                        help='Path of the JSON database')
+    parser.add_argument('--crops', default=config.FACE_CROPS_DIR, help='Directory of stored face crops')
+    parser.add_argument('--batch-size', type=int, default=config.REEMBED_BATCH_SIZE, help='Users per batch')
+    args = parser.parse_args()
+
+    from face_recognition_module import FaceRecognitionModule
+    from storage_manager import StorageManager
+
+    storage = StorageManager(args.database)
+    # Build the models before the job starts rather than in a background
+    # warm-up thread racing its first batch
+    face_module = FaceRecognitionModule(preload=False)
+    face_module.warm_up()
+    job = ReembeddingJob(storage, FaceCropStore(args.crops), face_module.get_face_embeddings, args.batch_size)
+    job.run()
+    # Fold the journal into a snapshot so the next start does not replay the migration
+    storage.save_database()
+
+
+if __name__ == '__main__':
+    main()
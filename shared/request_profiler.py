@@ -0,0 +1,89 @@
+"""
+Request Profiler Module
+Profiles a random sample of requests with cProfile and dumps each one to a .prof file
+
+Enabled with PROFILE_SAMPLE_RATE; inspect a dump with
+    python -m pstats data/profiles/<file>.prof
+or a viewer such as snakeviz.
+"""
+
+import cProfile
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import config
+from structured_logging import get_logger
+
+logger = get_logger('profiler')
+
+
+class RequestProfiler:
+    """
+    Samples requests for profiling
+
+    cProfile follows the thread that started it, which is the request's
+    thread. Only one request is profiled at a time (Python allows a single
+    active profiler), so a busy server profiles fewer than sample_rate requests.
+    """
+
+    def __init__(self, sample_rate: float = config.PROFILE_SAMPLE_RATE, directory: str = config.PROFILE_DIR):
+        """
+        Args:
+            sample_rate: Fraction of requests to profile (0 disables profiling)
+            directory: Where .prof dumps are written
+        """
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self._active = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """Start profiling the current request if it is sampled; pass the result to stop()"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile: Optional[cProfile.Profile], name: str, seconds: float) -> Optional[str]:
+        """
+        Stop a profile from start() and write it out
+
+        Args:
+            profile: Value returned by start() (None does nothing)
+            name: Request name used in the file name, e.g. the endpoint
+            seconds: Request duration, also used in the file name
+
+        Returns:
+            Path of the dump, or None
+        """
+        if profile is None:
+            return None
+        try:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+            file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{safe_name}-{seconds * 1000:.0f}ms.prof"
+            path = os.path.join(self.directory, file_name)
+            profile.dump_stats(path)
+            logger.info("Request profile written", extra={'path': path, 'request': name,
+                                                          'duration_ms': round(seconds * 1000, 2)})
+            return path
+        except Exception:
+            logger.exception("Error writing request profile")
+            return None
+        finally:
+            self._active.release()
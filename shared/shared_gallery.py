@@ -0,0 +1,246 @@
+"""
+Shared Gallery Module
+Lets several processes (e.g. gunicorn workers) serve one binary store: the
+embedding segment is memory-mapped read-only by all of them, so the page
+cache holds a single copy, and a generation counter in a small shared file
+tells each process when another one has written
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+import binary_store
+
+# Generation counter file: (generation, epoch) as little-endian uint64.
+# Every write bumps the generation; rewriting the whole store also bumps the epoch.
+COUNTER_FORMAT = '<QQ'
+COUNTER_SIZE = struct.calcsize(COUNTER_FORMAT)
+
+
+class SharedGallery:
+    """
+    Coordinates the processes sharing one binary store
+
+    New users are appended to the segment and the metadata in place, and a
+    process that sees the generation change reads only the metadata lines
+    written since it last looked and maps the longer segment. A user written
+    again (new templates, moved into the gallery by re-embedding) is an
+    upsert: one more metadata line, and its row overwritten in place.
+    Rewriting the store (a snapshot after merges, or to fold in superseded
+    lines) bumps the epoch, and every other process reloads it.
+
+    Writers hold an exclusive lock on a lock file. The caller serializes the
+    threads of one process (StorageManager's write lock); the lock is
+    re-entrant within that thread.
+    """
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.lock_path = base_path + '.lock'
+        self.counter_path = base_path + '.gen'
+        self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._depth = 0
+        self._counter = self._map_counter()
+
+        # What this process has read, set by loaded() / rewritten()
+        self._seen = None
+        self._epoch = None
+        self._offset = 0
+        self.rows = 0
+        self.dim = None
+        self.precision = None
+        self._header = {}
+        # Metadata lines a later line for the same user replaced
+        self.superseded = 0
+
+    def _map_counter(self) -> mmap.mmap:
+        """Map the counter file, creating it zeroed on first use"""
+        fd = os.open(self.counter_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < COUNTER_SIZE:
+                os.ftruncate(fd, COUNTER_SIZE)
+            return mmap.mmap(fd, COUNTER_SIZE)
+        finally:
+            os.close(fd)
+
+    @property
+    def generation(self) -> int:
+        """Writes to the store so far, by any process; a memory read, no system call"""
+        return struct.unpack_from(COUNTER_FORMAT, self._counter)[0]
+
+    @property
+    def epoch(self) -> int:
+        """Full rewrites of the store so far"""
+        return struct.unpack_from(COUNTER_FORMAT, self._counter)[1]
+
+    def changed(self) -> bool:
+        """Whether another process wrote since this one last loaded or caught up"""
+        return self._seen is not None and self.generation != self._seen
+
+    def outdated(self) -> bool:
+        """Whether another process rewrote the whole store since this one loaded it"""
+        return self._epoch is not None and self.epoch != self._epoch
+
+    @property
+    def held(self) -> bool:
+        return self._depth > 0
+
+    @contextmanager
+    def lock(self, blocking: bool = True):
+        """
+        Hold the cross-process write lock
+
+        Yields:
+            False if blocking is False and another process holds the lock
+        """
+        if self._depth == 0:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+        self._depth += 1
+        try:
+            yield True
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _bump(self, rewrite: bool):
+        generation, epoch = struct.unpack_from(COUNTER_FORMAT, self._counter)
+        struct.pack_into(COUNTER_FORMAT, self._counter, 0, generation + 1, epoch + int(rewrite))
+
+    def load(self) -> Optional[Tuple[List[Dict], List[str], np.ndarray, Optional[np.ndarray]]]:
+        """
+        Load the whole store without taking the lock
+
+        The metadata is read up to its last complete line; what is appended
+        meanwhile is picked up by the next changes(). A rewrite in the
+        middle of the read starts it over.
+
+        Returns:
+            (users, gallery_ids, matrix, scales) as binary_store.load, or
+            None if there is no store yet
+        """
+        while True:
+            generation, epoch = struct.unpack_from(COUNTER_FORMAT, self._counter)
+            if not binary_store.exists(self.base_path):
+                self._set_state({}, 0, 0, 0, generation, epoch)
+                return None
+            try:
+                header, offset, superseded, *gallery = binary_store.load_with_position(self.base_path)
+            except FileNotFoundError:
+                continue  # The segment was replaced between reading the metadata and mapping it
+            if self.epoch == epoch:
+                break
+        self._set_state(header, offset, len(gallery[1]), superseded, generation, epoch)
+        return tuple(gallery)
+
+    def loaded(self, rows: int):
+        """Record that the whole store was just written or loaded (under the lock), `rows` segment rows of it"""
+        header = binary_store.read_header(self.base_path) or {}
+        meta = binary_store.meta_path(self.base_path)
+        offset = os.path.getsize(meta) if os.path.exists(meta) else 0
+        self._set_state(header, offset, rows, 0, *struct.unpack_from(COUNTER_FORMAT, self._counter))
+
+    def _set_state(self, header: Dict, offset: int, rows: int, superseded: int, generation: int, epoch: int):
+        self._header = header
+        self.dim = header.get('dim')
+        self.precision = header.get('precision')
+        self._offset = offset
+        self.rows = rows
+        self.superseded = superseded
+        self._seen, self._epoch = generation, epoch
+
+    def rewritten(self, rows: int):
+        """Tell the other processes this one rewrote the whole store, which now matches its gallery"""
+        self._bump(rewrite=True)
+        self.loaded(rows)
+
+    def can_append(self, index) -> bool:
+        """Whether users can be appended (or upserted) for an index that maps this store row for row"""
+        return (index.dim is not None and self.dim == index.dim and self.precision == index.precision
+                and self.rows == len(index))
+
+    def append(self, users: List[Dict], codes: np.ndarray, scales: Optional[np.ndarray] = None) -> bool:
+        """
+        Append users after the last row, or upsert users at their own row
+        (see binary_store.append), then bump the generation
+
+        The caller picks the users up like any other process's, with changes().
+
+        Returns:
+            False if the metadata has lines this process has not read, left
+            by a writer that died before bumping the generation; the store
+            should then be rewritten
+        """
+        if os.path.getsize(binary_store.meta_path(self.base_path)) != self._offset:
+            return False
+        rows = [user['row'] for user in users if 'row' in user]
+        binary_store.append(self.base_path, users, codes, scales, max([self.rows] + [row + 1 for row in rows]))
+        self._bump(rewrite=False)
+        return True
+
+    def changes(self) -> Optional[Tuple[List[Dict], List[str], np.ndarray, Optional[np.ndarray]]]:
+        """
+        Read what was appended since this process last looked (under the lock)
+
+        Returns:
+            (users, ids, matrix, scales): the user records written, in
+            order, those with a segment row keeping their 'row'; the ids of
+            the rows added after the known ones; and the segment mapped up
+            to its last row. None if the store was rewritten and must be
+            reloaded.
+        """
+        if self.epoch != self._epoch or not binary_store.exists(self.base_path):
+            return None
+        if binary_store.read_header(self.base_path) != self._header:
+            return None
+        meta = binary_store.meta_path(self.base_path)
+        if os.path.getsize(meta) < self._offset:
+            return None
+
+        users, offset = binary_store.read_appended(self.base_path, self._offset)
+        added = {}
+        superseded = 0
+        for user in users:
+            row = user.get('row')
+            if row is None:
+                continue
+            if row < self.rows or row in added:
+                superseded += 1  # An upsert overwrote a row in place
+            else:
+                added[row] = user['user_id']
+        if sorted(added) != list(range(self.rows, self.rows + len(added))):
+            return None
+        ids = [added[row] for row in sorted(added)]
+        self._offset = offset
+        self.rows += len(ids)
+        self.superseded += superseded
+        self._seen = self.generation
+        return users, ids, *self.map_segment()
+
+    def map_segment(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """The segment rows this process knows about, memory-mapped read-only"""
+        return binary_store.map_segment(self.base_path, self._header, self.rows)
+
+    def after_fork(self):
+        """Open a lock of this process's own; a lock inherited over fork() is shared with the parent"""
+        os.close(self._lock_fd)
+        self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._depth = 0
+
+    def get_stats(self) -> Dict:
+        return {
+            'generation': self.generation,
+            'epoch': self.epoch,
+            'rows': self.rows,
+            'superseded': self.superseded,
+            'behind': self.changed()
+        }
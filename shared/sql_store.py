@@ -0,0 +1,202 @@
+"""
+SQL Store Module
+Stores users in a SQL database (SQLite locally, PostgreSQL in production)
+with embeddings kept as float32 binary blobs
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from sqlalchemy import (Column, Integer, LargeBinary, MetaData, String, Table, Text,
+                        create_engine, select)
+
+import config
+
+metadata = MetaData()
+
+users_table = Table(
+    'users', metadata,
+    Column('seq', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', String(36), nullable=False, unique=True),
+    Column('model_name', String(64)),
+    Column('embedding_dim', Integer),
+    Column('embedding', LargeBinary),
+    Column('record', Text, nullable=False),  # Remaining user record fields as JSON
+    # Never reuse a seq on SQLite: replace_user() relies on rewritten rows sorting last
+    sqlite_autoincrement=True,
+)
+
+# One row per deleted user, so workers polling the store can drop them too
+deleted_users_table = Table(
+    'deleted_users', metadata,
+    Column('seq', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', String(36), nullable=False),
+    sqlite_autoincrement=True,
+)
+
+
+class SqlStore:
+    """User table access with pooled connections and bulk inserts"""
+
+    def __init__(self, url: str):
+        engine_args = {'pool_pre_ping': True}
+        if not url.startswith('sqlite'):
+            engine_args.update(pool_size=config.SQL_POOL_SIZE, max_overflow=config.SQL_MAX_OVERFLOW)
+
+        self.engine = create_engine(url, **engine_args)
+        metadata.create_all(self.engine)
+
+    @staticmethod
+    def _to_row(record: Dict, embedding: Optional[np.ndarray]) -> Dict:
+        record = {key: value for key, value in record.items() if key != 'face_embedding'}
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+        return {
+            'user_id': record['user_id'],
+            'model_name': record.get('model_name'),
+            'embedding_dim': None if embedding is None else embedding.shape[0],
+            'embedding': None if embedding is None else embedding.tobytes(),
+            'record': json.dumps(record, ensure_ascii=False, separators=(',', ':')),
+        }
+
+    def insert_users(self, users: List[Tuple[Dict, Optional[np.ndarray]]]):
+        """
+        Insert users in one transaction
+
+        Args:
+            users: (user record, embedding) pairs
+        """
+        if not users:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(users_table.insert(), [self._to_row(record, embedding) for record, embedding in users])
+
+    def replace_user(self, record: Dict, embedding: Optional[np.ndarray]):
+        """
+        Rewrite a stored user, e.g. after another template was enrolled
+
+        The row is deleted and re-inserted in one transaction so it gets a new
+        seq and other workers pick the change up on their next refresh.
+        """
+        self.replace_users([(record, embedding)])
+
+    def replace_users(self, users: List[Tuple[Dict, Optional[np.ndarray]]]):
+        """Rewrite several stored users in one transaction (see replace_user)"""
+        if not users:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(users_table.delete().where(users_table.c.user_id.in_([record['user_id'] for record, _ in users])))
+            conn.execute(users_table.insert(), [self._to_row(record, embedding) for record, embedding in users])
+
+    def delete_users(self, user_ids: List[str]):
+        """
+        Delete users in one transaction, e.g. duplicates merged into another user
+
+        Each deletion is also recorded in deleted_users (see load_deletions).
+        """
+        if not user_ids:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(users_table.delete().where(users_table.c.user_id.in_(list(user_ids))))
+            conn.execute(deleted_users_table.insert(), [{'user_id': user_id} for user_id in user_ids])
+
+    def load_deletions(self, since_seq: int = 0) -> Tuple[List[str], int]:
+        """
+        Load the ids of users deleted after a sequence number
+
+        Polled like load_users, with the same overlap for out-of-order commits.
+
+        Args:
+            since_seq: Only return deletions recorded after this sequence number
+
+        Returns:
+            (deleted user ids, highest sequence number seen)
+        """
+        query = select(deleted_users_table.c.seq, deleted_users_table.c.user_id) \
+            .where(deleted_users_table.c.seq > since_seq).order_by(deleted_users_table.c.seq)
+
+        user_ids = []
+        last_seq = since_seq
+        with self.engine.connect() as conn:
+            for seq, user_id in conn.execute(query):
+                user_ids.append(user_id)
+                last_seq = seq
+        return user_ids, last_seq
+
+    def existing_user_ids(self) -> set:
+        """Ids of every stored user"""
+        with self.engine.connect() as conn:
+            return set(conn.execute(select(users_table.c.user_id)).scalars())
+
+    def load_users(self, since_seq: int = 0) -> Tuple[List[Tuple[int, Dict, Optional[np.ndarray]]], int]:
+        """
+        Load users in insertion order, in one query
+
+        This is what lets several worker processes share one store: each
+        loads everything once and then polls for rows after its last seq.
+        PostgreSQL hands out seqs when rows are inserted, not when they are
+        committed, so a poll may see seq 12 before seq 11 exists; pollers
+        pass a since_seq some way below their last seq to re-read that window.
+
+        Args:
+            since_seq: Only return rows inserted after this sequence number
+
+        Returns:
+            ((seq, user record, embedding) triples, highest sequence number seen)
+        """
+        query = select(users_table.c.seq, users_table.c.embedding, users_table.c.record) \
+            .where(users_table.c.seq > since_seq).order_by(users_table.c.seq)
+
+        users = []
+        last_seq = since_seq
+        with self.engine.connect() as conn:
+            for seq, blob, record in conn.execute(query):
+                embedding = None if blob is None else np.frombuffer(blob, dtype=np.float32)
+                users.append((seq, json.loads(record), embedding))
+                last_seq = seq
+        return users, last_seq
+
+    def load_gallery(self, model_name: Optional[str] = None) -> Tuple[List[Dict], List[str], np.ndarray, int]:
+        """
+        Load every user with one model's embeddings packed into one matrix
+
+        The gallery holds the users enrolled with model_name (or with no
+        recorded model), at the dimension of the first of them. Every other
+        user keeps its embedding inline in the record.
+
+        Args:
+            model_name: Model whose users form the gallery; None for the first user's model
+
+        Returns:
+            (users, gallery_ids, gallery_matrix, highest sequence number)
+        """
+        rows, last_seq = self.load_users()
+        if not rows:
+            return [], [], np.empty((0, 0), dtype=np.float32), last_seq
+
+        if model_name is None:
+            model_name = rows[0][1].get('model_name')
+        gallery_dim = next((embedding.shape[0] for _, record, embedding in rows if embedding is not None
+                            and record.get('model_name', model_name) == model_name), None)
+        users = []
+        gallery_ids = []
+        blobs = []
+        for _, record, embedding in rows:
+            in_gallery = record.get('model_name', model_name) == model_name
+            if embedding is not None and in_gallery and embedding.shape[0] == gallery_dim:
+                gallery_ids.append(record['user_id'])
+                blobs.append(embedding)
+            elif embedding is not None:
+                record['face_embedding'] = embedding.tolist()
+            users.append(record)
+
+        matrix = np.vstack(blobs) if blobs else np.empty((0, gallery_dim or 0), dtype=np.float32)
+        return users, gallery_ids, matrix, last_seq
+
+    def close(self):
+        self.engine.dispose()
+
+    def after_fork(self):
+        """Forget pooled connections inherited from the parent process without closing them"""
+        self.engine.dispose(close=False)
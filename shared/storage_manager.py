@@ -3,31 +3,119 @@ Storage Manager Module
 Handles saving and loading user data with face embeddings
 """
 
+import functools
 import json
 import os
+import threading
+import time
 import uuid
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 
 import config
+from embedding_index import as_euclidean, create_index, dequantize, from_euclidean, metric_space, pairwise_distances, quantize
+from match_cache import MatchCache
+import binary_store
+from journal import Journal, read_entries, sealed_path
+from metrics import REGISTRY, span
+from structured_logging import get_logger
+
+logger = get_logger('storage')
+
+MATCHES = REGISTRY.counter('face_gallery_matches_total', 'Gallery searches by outcome', ['result'])
+
+
+def _writes(method):
+    """
+    Run a StorageManager method holding the write lock
+    
+    With a shared gallery the lock covers the other processes as well, and
+    the gallery first catches up with what they wrote, so a snapshot written
+    here never drops their users.
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._write_lock:
+            if self._shared is None or self._shared.held:
+                return method(self, *args, **kwargs)
+            if self._shared.outdated():
+                # Reload before taking the cross-process lock, so other
+                # processes' writers do not wait for it
+                self.load_database()
+            with self._shared.lock():
+                self._sync_shared()
+                return method(self, *args, **kwargs)
+    return locked
 
 
 class StorageManager:
-    """Manages user data storage with face embeddings"""
+    """
+    Manages user data storage with face embeddings
+    
+    Safe to share between request threads: methods that change the gallery
+    take a write lock, one writer at a time, while matching never locks.
+    Writers only append to the index and the lookup dicts, or build a new
+    gallery and swap it in, so a concurrent search sees either the old or
+    the new state of every user (see BruteForceIndex).
+    
+    With SHARED_GALLERY the processes using one binary store map its
+    embeddings instead of each holding a copy (see SharedGallery).
+    """
     
-    def __init__(self, database_path: Optional[str] = None):
+    def __init__(self, database_path: Optional[str] = None, storage_format: Optional[str] = None):
         self.database_path = database_path or os.environ.get('DATABASE_PATH', config.DATABASE_PATH)
+        self.base_path = os.path.splitext(self.database_path)[0]
+        self.index_path = self.base_path + '.index.npz'
         self.users = []
+        self._users_by_id = {}
+        self._user_positions = {}
+        # The index is the partition of the active model; users enrolled with
+        # other models are grouped by (model_name, embedding_dim) and never scanned
+        self._index = self._new_index()
+        self._other_partitions: Dict[Tuple[str, int], set] = {}
+        # Face templates of users enrolled more than once; their index row holds the centroid
+        self._templates: Dict[str, np.ndarray] = {}
+        self._warned_dims = set()
+        self.match_cache = MatchCache(config.MATCH_CACHE_SIZE, config.MATCH_CACHE_TTL) \
+            if config.MATCH_CACHE_ENABLED else None
+        self._write_lock = threading.RLock()
         
-        # Check if using SQL database (future-proofing)
+        # Use the SQL store when DATABASE_URL is set (SQLite or PostgreSQL)
         self.db_url = os.environ.get('DATABASE_URL')
-        if self.db_url:
-            print(f"SQL Database detected: {self.db_url.split('@')[-1]}")
-            # In a real implementation, we would initialize SQLAlchemy here
-            # For now, we'll stick to JSON but keep the structure ready
-        
+        self._sql_store = None
+        self._sql_seq = 0
+        self._sql_seen: Dict[str, int] = {}  # Seq last applied per user inside the refresh overlap
+        self._sql_deleted_seq = 0  # Deletions after this seq have not been applied yet
+        self._last_refresh = 0.0
+        if self.db_url and storage_format in (None, 'sql'):
+            from sql_store import SqlStore
+            logger.info("SQL database detected", extra={'database': self.db_url.split('@')[-1]})
+            self._sql_store = SqlStore(self.db_url)
+            storage_format = 'sql'
+        self.storage_format = storage_format or config.STORAGE_FORMAT
         self._ensure_data_directory()
+        
+        # Processes sharing a binary store append registrations to it in place
+        # and pick up each other's from there
+        self._shared = None
+        if config.SHARED_GALLERY:
+            if self.storage_format == 'binary':
+                from shared_gallery import SharedGallery
+                self._shared = SharedGallery(self.base_path)
+            else:
+                logger.warning("SHARED_GALLERY requires STORAGE_FORMAT=binary; each process keeps its own gallery",
+                               extra={'storage_format': self.storage_format})
+        
+        # Registrations are appended to a write-ahead journal and folded into
+        # a full snapshot in the background every JOURNAL_COMPACT_EVERY entries.
+        # The SQL store commits every registration itself, and so does a shared gallery.
+        self._journal = None
+        if config.JOURNAL_ENABLED and self.storage_format != 'sql' and self._shared is None:
+            self._journal = Journal(self.base_path + '.journal.jsonl')
+        self._compaction = None
+        self._reload = None
+        
         self.load_database()
     
     def _ensure_data_directory(self):
@@ -35,56 +123,556 @@ class StorageManager:
         data_dir = os.path.dirname(self.database_path)
         if data_dir and not os.path.exists(data_dir):
             os.makedirs(data_dir)
-            print(f"Created data directory: {data_dir}")
+            logger.info("Created data directory", extra={'path': data_dir})
     
     def load_database(self):
-        """Load existing user database from JSON file"""
-        if os.path.exists(self.database_path):
+        """
+        Load existing user database in the configured storage format
+        
+        Holds the write lock but not a shared gallery's cross-process lock:
+        the store is read without it (see SharedGallery.load) and what other
+        processes write meanwhile is applied by the next sync.
+        """
+        with self._write_lock:
+            gallery = None
             try:
-                with open(self.database_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.users = data.get('users', [])
-                
-                print(f"Loaded {len(self.users)} users from database")
-                
-                # Check for model compatibility
-                if self.users:
-                    first_user = self.users[0]
-                    stored_model = first_user.get('model_name', 'Unknown')
-                    stored_dim = first_user.get('embedding_dim', len(first_user.get('face_embedding', [])))
-                    
-                    if stored_model != 'Unknown' and stored_model != config.FACE_RECOGNITION_MODEL:
-                        print("\n" + "="*60)
-                        print("⚠️  MODEL COMPATIBILITY WARNING")
-                        print("="*60)
-                        print(f"Database was created with: {stored_model} (embedding dim: {stored_dim})")
-                        print(f"Current config uses: {config.FACE_RECOGNITION_MODEL}")
-                        print("\nExisting users will NOT be recognized with the new model.")
-                        print("Options:")
-                        print("  1. Delete data/users_database.json to start fresh")
-                        print("  2. Change FACE_RECOGNITION_MODEL back to '{}'".format(stored_model))
-                        print("="*60 + "\n")
-                        
+                if self.storage_format == 'sql':
+                    gallery = self._load_sql()
+                elif self.storage_format == 'binary':
+                    gallery = self._load_binary()
+                else:
+                    self._load_json()
             except Exception as e:
-                print(f"Error loading database: {e}")
+                logger.exception("Error loading database")
                 self.users = []
+                gallery = None
+            
+            self._rebuild_index(gallery)
+            self._check_model_compatibility()
+            
+            if self._journal is not None:
+                self._recover_journal()
+    
+    def _load_json(self):
+        """Load users from the JSON database file"""
+        if not os.path.exists(self.database_path):
+            logger.info("No existing database found. Starting fresh.")
+            self.users = []
+            return
+        
+        with open(self.database_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            self.users = data.get('users', [])
+        
+        logger.info("Loaded users from database", extra={'users': len(self.users)})
+    
+    def _load_binary(self) -> Optional[Tuple]:
+        """Load users from the binary store, memory-mapping the embeddings"""
+        if self._shared is not None:
+            loaded = self._shared.load()
+        elif binary_store.exists(self.base_path):
+            loaded = binary_store.load(self.base_path)
         else:
-            print("No existing database found. Starting fresh.")
+            loaded = None
+        if loaded is None:
+            logger.info("No existing database found. Starting fresh.")
             self.users = []
+            return None
+        
+        self.users, gallery_ids, gallery_matrix, gallery_scales = loaded
+        logger.info("Loaded users from database", extra={'users': len(self.users)})
+        return gallery_ids, gallery_matrix, gallery_scales
     
-    def save_database(self):
-        """Save user database to JSON file"""
+    def _load_sql(self) -> Tuple[List[str], np.ndarray]:
+        """Load users from the SQL store with one bulk query"""
+        self.users, gallery_ids, gallery_matrix, self._sql_seq = \
+            self._sql_store.load_gallery(config.FACE_RECOGNITION_MODEL)
+        self._sql_seen = {}
+        self._last_refresh = time.monotonic()
+        logger.info("Loaded users from database", extra={'users': len(self.users)})
+        return gallery_ids, gallery_matrix
+    
+    @_writes
+    def refresh(self):
+        """
+        Pick up users registered by other processes sharing the SQL store
+        or the shared gallery
+        
+        Only rows inserted since the last load are fetched, plus an overlap
+        of SQL_REFRESH_OVERLAP seqs below it: a row can commit after rows
+        with higher seqs were already seen. Rows applied by an earlier poll
+        are skipped by their user id and seq. Users deleted by other
+        processes (see SqlStore.load_deletions) are dropped afterwards.
+        """
+        if self._sql_store is None:
+            return  # A shared gallery caught up when the write lock was taken
+        
+        since_seq = max(self._sql_seq - config.SQL_REFRESH_OVERLAP, 0)
+        rows, last_seq = self._sql_store.load_users(since_seq=since_seq)
+        self._last_refresh = time.monotonic()
+        seen = self._sql_seen
+        for seq, record, embedding in rows:
+            if seen.get(record['user_id']) == seq:
+                continue
+            seen[record['user_id']] = seq
+            self._apply_record(record, embedding)
+        
+        self._sql_seq = max(self._sql_seq, last_seq)
+        # Forget rows that have left the overlap window
+        horizon = self._sql_seq - config.SQL_REFRESH_OVERLAP
+        self._sql_seen = {user_id: seq for user_id, seq in seen.items() if seq > horizon}
+        
+        # Deleting an already removed user changes nothing, so the overlap needs no bookkeeping
+        deleted, last_seq = self._sql_store.load_deletions(
+            since_seq=max(self._sql_deleted_seq - config.SQL_REFRESH_OVERLAP, 0))
+        self._sql_deleted_seq = max(self._sql_deleted_seq, last_seq)
+        removed = {user_id for user_id in deleted if user_id in self._users_by_id}
+        if removed:
+            self._remove_users(removed)
+            self._index.maybe_train()
+    
+    def after_fork(self):
+        """
+        Prepare a forked copy of this manager (e.g. a gunicorn worker of a preloaded app)
+        
+        Database connections opened by the parent must not be shared, so the
+        child drops them from its pool and opens its own.
+        """
+        if self._sql_store is not None:
+            self._sql_store.after_fork()
+        if self._shared is not None:
+            self._shared.after_fork()
+    
+    def _refresh_if_stale(self):
+        """Catch up with other processes before a search, without ever waiting for a writer"""
+        if self._sql_store is not None:
+            stale = time.monotonic() - self._last_refresh > config.SQL_REFRESH_INTERVAL
+        else:
+            stale = self._shared is not None and self._shared.changed()
+        if stale and self._shared is not None and self._shared.outdated():
+            # A rewritten store is reloaded in the background; searches keep
+            # using the current gallery until the new one is swapped in
+            if self._reload is None or not self._reload.is_alive():
+                self._reload = threading.Thread(target=self.refresh, daemon=True)
+                self._reload.start()
+            return
+        # Matching never waits for a writer; the next query refreshes instead
+        if not stale or not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            if self._shared is None:
+                self.refresh()
+                return
+            with self._shared.lock(blocking=False) as acquired:
+                if acquired:
+                    self._sync_shared()
+        finally:
+            self._write_lock.release()
+    
+    def _sync_shared(self):
+        """
+        Apply what other processes wrote to the shared gallery since this one last looked
+        
+        Records written since are read from the end of the metadata: new
+        users' rows are mapped from the segment, and users written again
+        (upserts) replace their record and have their overwritten row's
+        norms recomputed. A rewritten store is reloaded. Called with the
+        write lock and the shared lock held.
+        """
+        if not self._shared.changed():
+            return
+        
+        changes = self._shared.changes()
+        # The index maps the store row for row unless rows were split off at
+        # load (users of another model) and not written back yet
+        if changes is None or len(self._index) + len(changes[1]) != changes[2].shape[0]:
+            logger.info("Shared gallery was rewritten by another process; reloading")
+            self.load_database()
+            return
+        
+        users, mapped_ids, matrix, scales = changes
+        updated = {}
+        for user in users:
+            user_id = user['user_id']
+            if user.pop('row', None) is None:
+                self._insert_user(user, np.asarray(user.pop('face_embedding'), dtype=np.float32))
+                continue
+            templates = user.pop('face_templates', None)
+            if user_id in self._users_by_id:
+                # Replaced rather than mutated, so snapshots taken earlier stay consistent
+                self.users[self._user_positions[user_id]] = user
+                self._users_by_id[user_id] = user
+                self._remove_from_other_partition(user_id)
+            else:
+                self._add_record(user)
+            if templates is not None:
+                self._templates[user_id] = np.array(templates, dtype=np.float32)
+            if user_id in self._index:
+                updated[user_id] = self._index.row_of(user_id)
+        
+        self._index.remap(mapped_ids, matrix, scales)
+        self._index.rows_changed(list(updated.values()))
+        if self.match_cache is not None:
+            for user_id in mapped_ids:
+                self.match_cache.add(metric_space(self._index.get(user_id), config.DISTANCE_METRIC))
+            for user_id in updated:
+                self._recache_templates(user_id)
+        if self._index.maybe_train():
+            self.save_index()
+    
+    def _append_shared(self, users: List[Tuple[Dict, np.ndarray]]) -> bool:
+        """
+        Write users to the shared gallery's store, then map them in the way
+        other processes will
+        
+        New users are appended; a user already in the gallery (new templates)
+        keeps its row, which is overwritten, and a user moving into the
+        gallery gets a new row. Once enough metadata lines have been
+        superseded, a snapshot folds them in the background.
+        
+        Args:
+            users: (record, embedding) pairs; the embedding is the user's
+                   index row (the centroid for users with templates)
+        
+        Returns:
+            False when there is no shared gallery or its store cannot be
+            appended to (none written yet, another precision or dimension);
+            the caller then saves a full snapshot
+        """
+        if self._shared is None or not self._shared.can_append(self._index):
+            return False
+        
+        records, embeddings = [], []
+        added = 0
+        for record, face_embedding in users:
+            row = self._index.row_of(record['user_id'])
+            if row is None and self._fits_gallery(record, face_embedding):
+                row = self._shared.rows + added
+                added += 1
+            if row is not None:
+                records.append(dict(record, row=row))
+                embeddings.append(np.asarray(face_embedding, dtype=np.float32).ravel())
+            else:
+                records.append(dict(record, face_embedding=np.asarray(face_embedding).tolist()))
+        codes, scales = quantize(np.array(embeddings, dtype=np.float32).reshape(-1, self._index.dim), self._index.precision)
+        
+        if not self._shared.append(records, codes, scales):
+            return False
+        self._sync_shared()
+        
+        if self._shared.superseded >= config.JOURNAL_COMPACT_EVERY and \
+                (self._compaction is None or not self._compaction.is_alive()):
+            self._compaction = threading.Thread(target=self._compact_shared, daemon=True)
+            self._compaction.start()
+        return True
+    
+    @_writes
+    def _compact_shared(self):
+        """Rewrite the shared store once superseded metadata lines have piled up"""
+        # Another process may have compacted it first
+        if self._shared.superseded >= config.JOURNAL_COMPACT_EVERY:
+            self.save_database()
+    
+    def get_shared_stats(self) -> Optional[Dict]:
+        """Shared gallery generation and rows, or None when SHARED_GALLERY is off"""
+        return self._shared.get_stats() if self._shared is not None else None
+    
+    def _check_model_compatibility(self):
+        """Report users enrolled with other models, which are not matched until re-embedded"""
+        other = [partition for partition in self.get_partitions() if not partition['active']]
+        if not other:
+            return
+        
+        for partition in other:
+            logger.warning("Users enrolled with another model will not be recognized until they are re-embedded "
+                           "(python shared/reembedding.py or POST /api/face/reembed) or FACE_RECOGNITION_MODEL "
+                           "is changed back",
+                           extra={'users': partition['users'], 'model_name': partition['model_name'],
+                                  'embedding_dim': partition['embedding_dim'],
+                                  'active_model': config.FACE_RECOGNITION_MODEL})
+    
+    def _index_params(self) -> Dict:
+        """Constructor arguments for the configured index type"""
+        params = {'precision': config.EMBEDDING_PRECISION, 'metric': config.DISTANCE_METRIC}
+        if config.INDEX_TYPE == 'ivf':
+            params.update({
+                'nlist': config.IVF_NLIST,
+                'nprobe': config.IVF_NPROBE,
+                'min_train_size': config.IVF_MIN_TRAIN_SIZE
+            })
+        return params
+    
+    def _new_index(self):
+        """Create an empty index of the configured type"""
+        return create_index(config.INDEX_TYPE, **self._index_params())
+    
+    def _rebuild_index(self, gallery: Optional[Tuple] = None):
+        """
+        Rebuild the embedding index and id lookup from self.users
+        
+        The index is built aside and swapped in when complete, so searches
+        running meanwhile (e.g. during a background reload of a shared
+        gallery) keep using the old one.
+        
+        Args:
+            gallery: (ids, matrix[, scales]) of embeddings loaded outside the records,
+                     e.g. the memory-mapped binary segment. When omitted the
+                     embeddings are taken from the records themselves.
+        """
+        users_by_id = {user['user_id']: user for user in self.users}
+        index = self._new_index()
+        self._other_partitions = {}
+        templates = {user['user_id']: user.pop('face_templates') for user in self.users if 'face_templates' in user}
+        
+        if gallery is not None:
+            gallery = self._split_gallery(users_by_id, *gallery)
+            index.adopt(*gallery)
+        elif self.users:
+            # The active model's partition; its dimension is taken from the
+            # first of its users
+            members = [user for user in self.users if 'face_embedding' in user and self._uses_active_model(user)]
+            gallery_dim = len(members[0]['face_embedding']) if members else None
+            members = [user for user in members if len(user['face_embedding']) == gallery_dim]
+            if members:
+                index.add_batch(
+                    [user['user_id'] for user in members],
+                    np.array([user['face_embedding'] for user in members], dtype=np.float32)
+                )
+            # The index now owns these embeddings; drop the per-record lists
+            for user in members:
+                del user['face_embedding']
+        
+        for user in self.users:
+            if user['user_id'] not in index:
+                self._add_to_other_partition(user)
+                # Kept with the record so they survive the next snapshot
+                if user['user_id'] in templates:
+                    user['face_templates'] = templates.pop(user['user_id'])
+        
+        # Reuse the saved index structure when it covers a prefix of the
+        # gallery, so a trained index is not re-clustered on every startup
+        try:
+            index.restore(self.index_path)
+        except Exception as e:
+            logger.warning("Error loading saved index, rebuilding", extra={'error': str(e)})
+        trained = index.maybe_train()
+        
+        # Index before the lookup dict (see find_top_matches)
+        self._index = index
+        self._users_by_id = users_by_id
+        self._user_positions = {user['user_id']: position for position, user in enumerate(self.users)}
+        self._templates = {user_id: np.array(user_templates, dtype=np.float32)
+                           for user_id, user_templates in templates.items()}
+        if self.match_cache is not None:
+            self.match_cache.clear()
+        if trained:
+            self.save_index()
+    
+    def _split_gallery(self, users_by_id: Dict[str, Dict], gallery_ids: List[str], matrix: np.ndarray,
+                       scales: Optional[np.ndarray] = None) -> Tuple:
+        """
+        Keep only the active model's rows of a stored gallery
+        
+        A gallery written before FACE_RECOGNITION_MODEL changed holds the old
+        model's embeddings; those move into their records (and so into their
+        own partition) and the rest is copied out of the stored matrix.
+        """
+        keep = np.array([self._uses_active_model(users_by_id[user_id]) for user_id in gallery_ids], dtype=bool)
+        if keep.all():
+            return gallery_ids, matrix, scales
+        
+        for row in np.flatnonzero(~keep):
+            row_scales = scales[row:row + 1] if scales is not None else None
+            users_by_id[gallery_ids[row]]['face_embedding'] = dequantize(matrix[row:row + 1], row_scales)[0].tolist()
+        rows = np.flatnonzero(keep)
+        return [gallery_ids[row] for row in rows], matrix[rows], scales[rows] if scales is not None else None
+    
+    @staticmethod
+    def _uses_active_model(user: Dict) -> bool:
+        """Whether a record was enrolled with the configured model (records without one are assumed to be)"""
+        return user.get('model_name', config.FACE_RECOGNITION_MODEL) == config.FACE_RECOGNITION_MODEL
+    
+    def _add_to_other_partition(self, user: Dict):
+        """File a user that cannot be scored against the gallery under its (model_name, embedding_dim)"""
+        key = (user.get('model_name', 'Unknown'), user.get('embedding_dim') or len(user.get('face_embedding', [])))
+        self._other_partitions.setdefault(key, set()).add(user['user_id'])
+    
+    def _remove_from_other_partition(self, user_id: str):
+        for key, members in list(self._other_partitions.items()):
+            if user_id in members:
+                members.discard(user_id)
+                if not members:
+                    del self._other_partitions[key]
+                return
+    
+    def get_partitions(self) -> List[Dict]:
+        """Users per (model_name, embedding_dim) partition; only the active one is searched"""
+        partitions = [{
+            'model_name': config.FACE_RECOGNITION_MODEL,
+            'embedding_dim': self._index.dim,
+            'users': len(self._index),
+            'active': True
+        }]
+        for (model_name, embedding_dim), members in sorted(self._other_partitions.items()):
+            partitions.append({'model_name': model_name, 'embedding_dim': embedding_dim,
+                               'users': len(members), 'active': False})
+        return partitions
+    
+    def users_to_migrate(self) -> List[str]:
+        """Ids of users outside the active partition, in registration order"""
+        pending = set().union(*self._other_partitions.values())
+        return sorted(pending, key=self._user_positions.get)
+    
+    def save_index(self):
+        """Save the embedding index next to the database so it is not rebuilt at startup"""
         try:
-            data = {
-                'users': self.users,
-                'last_updated': datetime.now().isoformat()
-            }
-            with open(self.database_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            print(f"Database saved successfully with {len(self.users)} users")
+            self._index.save(self.index_path)
         except Exception as e:
-            print(f"Error saving database: {e}")
+            logger.exception("Error saving index")
+    
+    def _recover_journal(self):
+        """Replay journal entries written after the last snapshot"""
+        self._journal.close()
+        sealed = sealed_path(self._journal.path)
+        
+        replayed = 0
+        for path in (sealed, self._journal.path):
+            for record, embedding in read_entries(path):
+                # Entries already in the snapshot change nothing, so replay is idempotent
+                if self._apply_record(record, embedding):
+                    replayed += 1
+        
+        self._journal.open()
+        if replayed:
+            logger.info("Recovered registrations from journal", extra={'registrations': replayed})
+        
+        # A leftover sealed journal means a compaction was interrupted
+        if os.path.exists(sealed):
+            self.save_database()
+    
+    @_writes
+    def save_database(self):
+        """Write a full snapshot of the database in the configured storage format"""
+        if self._journal is None:
+            if self._write_snapshot(self._snapshot_users(), self._index) and self._shared is not None:
+                # The store now matches this gallery row for row; map it rather than keep a copy
+                self._shared.rewritten(len(self._index))
+                self._index.remap([], *self._shared.map_segment())
+            return
+        
+        if self._compaction is not None:
+            self._compaction.join()
+        
+        if self._write_snapshot(self._snapshot_users(), self._index):
+            sealed = sealed_path(self._journal.path)
+            if os.path.exists(sealed):
+                os.remove(sealed)
+            self._journal.reset()
+    
+    @_writes
+    def convert_to(self, storage_format: str) -> bool:
+        """
+        Write the whole database in another storage format
+        
+        Used by the migration tool; the source files are left untouched.
+        
+        Args:
+            storage_format: 'json', 'binary' or 'sql' (sql requires DATABASE_URL)
+        
+        Returns:
+            True if the database was written
+        """
+        if storage_format == 'sql' and self._sql_store is None:
+            from sql_store import SqlStore
+            if not self.db_url:
+                raise ValueError("DATABASE_URL must be set to convert to the SQL store")
+            self._sql_store = SqlStore(self.db_url)
+        
+        self.storage_format = storage_format
+        return self._write_snapshot(self._snapshot_users(), self._index)
+    
+    def _maybe_compact(self):
+        """Start a background compaction once the journal is long enough"""
+        if self._journal.entry_count < config.JOURNAL_COMPACT_EVERY:
+            return
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        
+        # Seal the journal and capture the gallery as it is right now; later
+        # registrations go to a fresh journal while the snapshot is written
+        sealed = self._journal.seal()
+        users = self._snapshot_users()
+        index = self._index.snapshot()
+        
+        self._compaction = threading.Thread(
+            target=self._compact, args=(sealed, users, index), daemon=True
+        )
+        self._compaction.start()
     
+    def _compact(self, sealed: str, users: List[Dict], index):
+        """Write a snapshot covering a sealed journal, then drop the journal"""
+        if self._write_snapshot(users, index):
+            os.remove(sealed)
+    
+    def _write_snapshot(self, users: List[Dict], index) -> bool:
+        """Save the given users and embeddings in the configured storage format"""
+        try:
+            with span('save_database'):
+                if self.storage_format == 'sql':
+                    self._save_sql(users, index)
+                elif self.storage_format == 'binary':
+                    binary_store.save(self.base_path, users, index)
+                else:
+                    self._save_json(users, index)
+            logger.info("Database saved", extra={'users': len(users), 'storage_format': self.storage_format})
+            return True
+        except Exception:
+            logger.exception("Error saving database")
+            return False
+    
+    def _save_json(self, users: List[Dict], index):
+        """Save user database to JSON file"""
+        data = {
+            'users': [self._user_with_embedding(user, index) for user in users],
+            'last_updated': datetime.now().isoformat()
+        }
+        # Write to a temporary file and rename, so a crash never leaves a
+        # half-written database behind
+        tmp_path = self.database_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.database_path)
+    
+    def _save_sql(self, users: List[Dict], index):
+        """Bulk insert users that are not in the SQL store yet"""
+        stored = self._sql_store.existing_user_ids()
+        missing = []
+        for user in users:
+            if user['user_id'] in stored:
+                continue
+            embedding = index.get(user['user_id'])
+            if embedding is None and 'face_embedding' in user:
+                embedding = np.array(user['face_embedding'], dtype=np.float32)
+            missing.append((user, embedding))
+        self._sql_store.insert_users(missing)
+    
+    def _snapshot_users(self) -> List[Dict]:
+        """Copy of the user list with multi-template users' templates inlined as lists"""
+        templates = self._templates
+        return [dict(user, face_templates=templates[user['user_id']].tolist())
+                if user['user_id'] in templates else user for user in self.users]
+    
+    @staticmethod
+    def _user_with_embedding(user: Dict, index) -> Dict:
+        """Copy of a user record with its indexed embedding inlined as a list"""
+        embedding = index.get(user['user_id'])
+        if embedding is None:
+            return user
+        return dict(user, face_embedding=embedding.tolist())
+    
+    @_writes
     def add_user(self, user_data: Dict, face_embedding: np.ndarray) -> str:
         """
         Add a new user to the database
@@ -96,22 +684,280 @@ class StorageManager:
         Returns:
             user_id: Unique identifier for the user
         """
-        user_id = str(uuid.uuid4())
+        user_record = self._new_record(user_data, face_embedding)
+        user_id = user_record['user_id']
+        
+        if self._sql_store is not None:
+            self._sql_store.insert_users([(user_record, face_embedding)])
+        elif self._journal is not None:
+            self._journal.append(user_record, face_embedding)
+        
+        if not self._append_shared([(user_record, face_embedding)]):
+            self._insert_user(user_record, face_embedding)
+            
+            if self._journal is not None:
+                self._maybe_compact()
+            elif self._sql_store is None:
+                self.save_database()
         
-        user_record = {
-            'user_id': user_id,
+        logger.info("Added new user", extra={'user_id': user_id, 'user_name': user_data.get('name', 'Unknown')})
+        return user_id
+    
+    @staticmethod
+    def _new_record(user_data: Dict, face_embedding: np.ndarray) -> Dict:
+        """Record for a newly registered user"""
+        return {
+            'user_id': str(uuid.uuid4()),
             'timestamp': datetime.now().isoformat(),
-            'face_embedding': face_embedding.tolist(),  # Convert numpy array to list
             'embedding_dim': len(face_embedding),  # Store embedding dimension
             'model_name': config.FACE_RECOGNITION_MODEL,  # Store model used
             'data': user_data
         }
+    
+    @_writes
+    def add_users(self, users: List[Tuple[Dict, np.ndarray]], sources: Optional[List[str]] = None) -> List[str]:
+        """
+        Add many users with one write
+        
+        The SQL store inserts them in one transaction and a shared gallery
+        appends them to its store. The file formats journal them with one
+        fsync and leave the snapshot to the background compaction, so bulk
+        enrolment does not rewrite the whole database per call; only without
+        a journal is a snapshot written each time.
+        
+        Args:
+            users: (user_data, face_embedding) pairs
+            sources: Optional source identifier per user (e.g. the photo it
+                     was enrolled from), see enrolled_sources()
         
+        Returns:
+            The new user ids, in input order
+        """
+        records = []
+        for position, (user_data, face_embedding) in enumerate(users):
+            record = self._new_record(user_data, face_embedding)
+            if sources is not None:
+                record['source'] = sources[position]
+            records.append(record)
+        if not records:
+            return []
+        
+        entries = [(record, embedding) for record, (_, embedding) in zip(records, users)]
+        if self._sql_store is not None:
+            self._sql_store.insert_users(entries)
+        elif self._journal is not None:
+            self._journal.append_many(entries)
+        
+        if not self._append_shared(entries):
+            for record, face_embedding in entries:
+                self._insert_user(record, face_embedding)
+            
+            if self._journal is not None:
+                self._maybe_compact()
+            elif self._sql_store is None:
+                self.save_database()
+        
+        logger.info("Added new users", extra={'users': len(records)})
+        return [record['user_id'] for record in records]
+    
+    def enrolled_sources(self) -> set:
+        """Source identifiers of users added by add_users, used to resume a bulk enrolment"""
+        return {user['source'] for user in self.users if 'source' in user}
+    
+    def _insert_user(self, user_record: Dict, face_embedding: np.ndarray):
+        """Add a user record and its embedding to the in-memory gallery"""
+        fits = self._fits_gallery(user_record, face_embedding)
+        if not fits:
+            # Not scorable against this gallery; keep the embedding in the record
+            user_record['face_embedding'] = np.asarray(face_embedding).tolist()
+            self._add_to_other_partition(user_record)
+        
+        # The record goes in before the index row, so a concurrent search never
+        # finds an id it cannot look up
+        self._add_record(user_record)
+        if fits:
+            self._index_user(user_record, face_embedding)
+    
+    def _add_record(self, user_record: Dict):
+        """Append a user record to the list and the lookup dicts"""
+        self._user_positions[user_record['user_id']] = len(self.users)
         self.users.append(user_record)
-        self.save_database()
+        self._users_by_id[user_record['user_id']] = user_record
+    
+    def _fits_gallery(self, user_record: Dict, face_embedding: np.ndarray) -> bool:
+        """Whether a user belongs to the active model's partition"""
+        if not self._uses_active_model(user_record):
+            return False
+        return self._index.dim is None or self._index.dim == len(face_embedding)
+    
+    def _index_user(self, user_record: Dict, face_embedding: np.ndarray):
+        """Add a record's embedding (and templates) to the index"""
+        templates = user_record.pop('face_templates', None)
+        self._index.add(user_record['user_id'], face_embedding)
+        if templates is not None:
+            self._templates[user_record['user_id']] = np.array(templates, dtype=np.float32)
+        if self.match_cache is not None:
+            self.match_cache.add(metric_space(face_embedding, config.DISTANCE_METRIC))
+        if self._index.maybe_train():
+            self.save_index()
+    
+    def _apply_record(self, user_record: Dict, face_embedding: np.ndarray) -> bool:
+        """
+        Apply a journal entry or SQL row: insert a new user, move a re-embedded
+        user into the gallery, or update a user's templates
         
-        print(f"Added new user: {user_data.get('name', 'Unknown')} (ID: {user_id})")
-        return user_id
+        Returns:
+            True if the gallery changed
+        """
+        user_id = user_record['user_id']
+        if user_id not in self._users_by_id:
+            self._insert_user(user_record, face_embedding)
+            return True
+        
+        if user_id not in self._index:
+            if not self._fits_gallery(user_record, face_embedding):
+                return False
+            self._remove_from_other_partition(user_id)
+            # Replace the record rather than mutate it, so snapshots taken earlier stay consistent
+            self.users[self._user_positions[user_id]] = user_record
+            self._users_by_id[user_id] = user_record
+            self._index_user(user_record, face_embedding)
+            return True
+        
+        templates = user_record.get('face_templates')
+        if templates is None:
+            return False
+        templates = np.array(templates, dtype=np.float32)
+        if user_id in self._templates and np.array_equal(self._templates[user_id], templates):
+            return False
+        self._set_templates(user_id, templates)
+        return True
+    
+    @_writes
+    def migrate_users(self, embeddings: Dict[str, np.ndarray]) -> int:
+        """
+        Move users from another model's partition into the active gallery
+        
+        Used by the re-embedding job once it has embedded a user's stored
+        face crops with the active model. The users are written in one batch
+        and become searchable immediately.
+        
+        Args:
+            embeddings: Per user id, the user's face crops embedded with the
+                        active model (one row per crop, oldest first)
+        
+        Returns:
+            Number of users migrated
+        """
+        migrated = []
+        for user_id, user_embeddings in embeddings.items():
+            user = self._users_by_id.get(user_id)
+            if user is None or user_id in self._index:
+                continue
+            templates = np.atleast_2d(np.asarray(user_embeddings, dtype=np.float32))[-config.MAX_TEMPLATES_PER_USER:]
+            if self._index.dim is not None and templates.shape[1] != self._index.dim:
+                raise ValueError(f"Embedding dimension mismatch - expected {self._index.dim}, got {templates.shape[1]}")
+            
+            record = {key: value for key, value in user.items() if key not in ('face_embedding', 'face_templates')}
+            record['model_name'] = config.FACE_RECOGNITION_MODEL
+            record['embedding_dim'] = templates.shape[1]
+            if len(templates) > 1:
+                record['face_templates'] = templates.tolist()
+            migrated.append((record, metric_space(templates, config.DISTANCE_METRIC).mean(axis=0)))
+        
+        if not migrated:
+            return 0
+        
+        if self._sql_store is not None:
+            self._sql_store.replace_users(migrated)
+        elif self._journal is not None:
+            for record, centroid in migrated:
+                self._journal.append(record, centroid)
+        
+        if self._append_shared(migrated):
+            return len(migrated)
+        
+        for record, centroid in migrated:
+            self._apply_record(dict(record), centroid)
+        
+        if self._journal is not None:
+            self._maybe_compact()
+        elif self._sql_store is None:
+            self.save_database()
+        return len(migrated)
+    
+    @_writes
+    def add_template(self, user_id: str, face_embedding: np.ndarray) -> int:
+        """
+        Add another face capture to an existing user
+        
+        The user's index row becomes the centroid of all templates, which is
+        what the first-pass search scores; the templates themselves are only
+        compared when re-ranking the closest candidates.
+        
+        Args:
+            user_id: Id of a user in the gallery
+            face_embedding: Face embedding vector (numpy array)
+        
+        Returns:
+            Number of templates the user now has
+        """
+        user = self._users_by_id.get(user_id)
+        if user is None or user_id not in self._index:
+            raise ValueError(f"User {user_id} is not in the gallery")
+        face_embedding = np.asarray(face_embedding, dtype=np.float32).ravel()
+        if face_embedding.shape[0] != self._index.dim:
+            raise ValueError(f"Embedding dimension mismatch - expected {self._index.dim}, got {face_embedding.shape[0]}")
+        
+        templates = self._templates.get(user_id)
+        if templates is None:
+            templates = self._index.get(user_id)[None, :]
+        # Keep the most recent captures so the centroid follows the person over time
+        templates = np.vstack([templates, face_embedding])[-config.MAX_TEMPLATES_PER_USER:]
+        centroid = metric_space(templates, config.DISTANCE_METRIC).mean(axis=0)
+        
+        record = dict(user, face_templates=templates.tolist())
+        if self._sql_store is not None:
+            self._sql_store.replace_user(record, centroid)
+        elif self._journal is not None:
+            self._journal.append(record, centroid)
+        
+        # A shared gallery gets an upsert of the user instead of a snapshot
+        if not self._append_shared([(record, centroid)]):
+            self._set_templates(user_id, templates)
+            
+            if self._journal is not None:
+                self._maybe_compact()
+            elif self._sql_store is None:
+                self.save_database()
+        
+        logger.info("Added template", extra={'user_id': user_id, 'user_name': user['data'].get('name', 'Unknown'),
+                                             'templates': len(templates)})
+        return len(templates)
+    
+    def _set_templates(self, user_id: str, templates: np.ndarray):
+        """Install a user's template set and move their index row to its centroid"""
+        # For the normalised metrics only directions count, so average those
+        centroid = metric_space(templates, config.DISTANCE_METRIC).mean(axis=0)
+        # Replaced rather than mutated, so snapshots taken earlier stay consistent
+        self._templates[user_id] = templates
+        self._index.update(user_id, centroid)
+        if self.match_cache is not None:
+            self._recache_templates(user_id)
+    
+    def _recache_templates(self, user_id: str):
+        """Replace a user's match cache entries with their new centroid and latest template"""
+        self.match_cache.discard(user_id)
+        self.match_cache.add(metric_space(self._index.get(user_id), config.DISTANCE_METRIC), owner=user_id)
+        templates = self._templates.get(user_id)
+        if templates is not None:
+            self.match_cache.add(metric_space(templates[-1], config.DISTANCE_METRIC), owner=user_id)
+    
+    def template_count(self, user_id: str) -> int:
+        """Number of face templates stored for a user"""
+        if user_id in self._templates:
+            return len(self._templates[user_id])
+        return 1 if user_id in self._users_by_id else 0
     
     def find_matching_user(self, face_embedding: np.ndarray, threshold: float = config.FACE_MATCH_THRESHOLD) -> Optional[Dict]:
         """
@@ -124,30 +970,157 @@ class StorageManager:
         Returns:
             User record if match found, None otherwise
         """
-        if not self.users:
+        self._refresh_if_stale()
+        
+        with span('gallery_search'):
+            started = time.perf_counter()
+            cached = self._match_cached(face_embedding, threshold)
+            if cached is not None:
+                self.match_cache.record(True, time.perf_counter() - started)
+                MATCHES.inc(result='cached')
+                return cached
+            
+            # With the cache on, keep the candidates around the match: they
+            # bound how far the matched user is from everyone else
+            k = config.TEMPLATE_RERANK_CANDIDATES if self.match_cache is not None else 1
+            matches = self.find_top_matches(face_embedding, k=k)
+            if self.match_cache is not None:
+                self.match_cache.record(False, time.perf_counter() - started)
+            
+            # Return match only if distance is below threshold
+            if not matches or matches[0][1] >= threshold:
+                MATCHES.inc(result='no_match')
+                return None
+            
+            best_match, best_distance = matches[0]
+            logger.debug("Match found", extra={'user_id': best_match['user_id'], 'distance': round(float(best_distance), 4)})
+            MATCHES.inc(result='match')
+            self._cache_match(face_embedding, matches)
+            return best_match
+    
+    def _match_cached(self, face_embedding: np.ndarray, threshold: float) -> Optional[Dict]:
+        """Answer a query from the match cache, or None on a miss"""
+        if self.match_cache is None:
             return None
+        face_embedding = np.asarray(face_embedding, dtype=np.float32).ravel()
+        if face_embedding.shape[0] != self._index.dim:
+            return None
+        # The cache works in Euclidean terms (in metric_space), where the
+        # triangle inequality it relies on holds for every metric
+        metric = config.DISTANCE_METRIC
+        hit = self.match_cache.lookup(metric_space(face_embedding, metric), as_euclidean(threshold, metric))
+        if hit is None:
+            return None
+        user_id, distance = hit
+        user = self._users_by_id.get(user_id)
+        if user is None:
+            return None  # Merged away since it was cached
+        distance = self._template_distance(user_id, face_embedding, from_euclidean(distance, metric))
+        logger.debug("Match found", extra={'user_id': user_id, 'distance': round(float(distance), 4), 'cached': True})
+        return user
+    
+    def _cache_match(self, face_embedding: np.ndarray, matches: List[Tuple[Dict, float]]):
+        """
+        Remember a matched user together with the distance to its nearest other user
         
-        best_match = None
-        best_distance = float('inf')
+        The separation comes from the candidates the search already scored
+        rather than a scan of the whole gallery. Users outside them were
+        farther than the k-th candidate from the query, which bounds their
+        distance from the matched user by the triangle inequality. Only the
+        candidates' templates are checked, since the search re-ranks just
+        those too, and an IVF index only scored the lists it probed, so the
+        bound is approximate in the same way as the search itself.
         
-        for user in self.users:
-            stored_embedding = np.array(user['face_embedding'])
-            distance = self._calculate_distance(face_embedding, stored_embedding)
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_match = user
+        Args:
+            face_embedding: The query that was matched
+            matches: (user record, distance) candidates from find_top_matches, closest first
+        """
+        if self.match_cache is None:
+            return
+        metric = config.DISTANCE_METRIC
+        index = self._index
+        user_id = matches[0][0]['user_id']
+        embedding = index.get(user_id)
+        if embedding is None:
+            return
         
-        # Return match only if distance is below threshold
-        if best_distance < threshold:
-            print(f"Match found: {best_match['data'].get('name', 'Unknown')} (distance: {best_distance:.4f})")
-            return best_match
+        point = metric_space(embedding, metric)
+        separation = float('inf')
+        if len(index) > len(matches):
+            # Everyone left out is at least the k-th candidate's distance from the query
+            query_offset = float(np.linalg.norm(metric_space(np.asarray(face_embedding).ravel(), metric) - point))
+            separation = float(as_euclidean(matches[-1][1], metric)) - query_offset
         
-        return None
+        # Another candidate's template may sit closer than their centroid
+        others = []
+        for user, _ in matches[1:]:
+            centroid = index.get(user['user_id'])
+            if centroid is not None:
+                others.append(centroid[None, :])
+            templates = self._templates.get(user['user_id'])
+            if templates is not None:
+                others.append(templates)
+        if others:
+            separation = min(separation, float(as_euclidean(
+                pairwise_distances(np.vstack(others), embedding, metric).min(), metric)))
+        self.match_cache.store(user_id, metric_space(embedding, metric), max(separation, 0.0))
+    
+    def find_top_matches(self, face_embedding: np.ndarray, k: int = 5) -> List[Tuple[Dict, float]]:
+        """
+        Find the k closest users to a face embedding
+        
+        Args:
+            face_embedding: Face embedding to match
+            k: Maximum number of candidates to return
+        
+        Returns:
+            List of (user record, distance) pairs, closest first
+        """
+        # Look up records in a dict taken before the index: merge_users and
+        # reloads swap in the index first, so every id it returns is in
+        # users_by_id, unless a reload swapped in both meanwhile; ids added
+        # by it are left out of this search
+        users_by_id = self._users_by_id
+        index = self._index
+        if len(index) == 0:
+            return []
+        
+        face_embedding = np.asarray(face_embedding).ravel()
+        if face_embedding.shape[0] != index.dim:
+            # Warn once per query dimension rather than on every frame
+            if face_embedding.shape[0] not in self._warned_dims:
+                self._warned_dims.add(face_embedding.shape[0])
+                logger.warning("Embedding dimension mismatch; this usually happens when switching between "
+                               "different face recognition models",
+                               extra={'query_dim': face_embedding.shape[0], 'gallery_dim': index.dim})
+            return []
+        
+        if not self._templates:
+            return [(users_by_id[user_id], distance) for user_id, distance in index.search(face_embedding, k)
+                    if user_id in users_by_id]
+        
+        # First pass on one centroid per user, then re-rank the closest
+        # candidates by their nearest individual template
+        candidates = index.search(face_embedding, max(k, config.TEMPLATE_RERANK_CANDIDATES))
+        reranked = sorted(
+            ((user_id, self._template_distance(user_id, face_embedding, distance)) for user_id, distance in candidates),
+            key=lambda candidate: candidate[1]
+        )
+        return [(users_by_id[user_id], distance) for user_id, distance in reranked[:k] if user_id in users_by_id]
+    
+    def _template_distance(self, user_id: str, face_embedding: np.ndarray, centroid_distance: float) -> float:
+        """Distance to a user's closest template, or to their centroid if that is closer"""
+        templates = self._templates.get(user_id)
+        if templates is None:
+            return centroid_distance
+        return min(centroid_distance, float(pairwise_distances(templates, face_embedding, config.DISTANCE_METRIC).min()))
     
     def _calculate_distance(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
-        Calculate Euclidean distance between two embeddings
+        Calculate the configured metric's distance between two embeddings
+        
+        Gallery matching goes through the index; this is for one-off comparisons.
+        Dimensions are checked once per gallery (see find_top_matches), not here.
         
         Args:
             embedding1: First embedding vector
@@ -156,19 +1129,103 @@ class StorageManager:
         Returns:
             Distance value (returns infinity if dimensions don't match)
         """
-        # Check if embeddings have the same dimension
         if embedding1.shape != embedding2.shape:
-            print(f"Warning: Embedding dimension mismatch - {embedding1.shape} vs {embedding2.shape}")
-            print(f"This usually happens when switching between different face recognition models.")
-            print(f"Current model embedding size: {embedding1.shape[0]}, Stored embedding size: {embedding2.shape[0]}")
             return float('inf')  # Return infinite distance (no match)
         
-        return np.linalg.norm(embedding1 - embedding2)
+        return float(pairwise_distances(embedding2, embedding1, config.DISTANCE_METRIC))
+    
+    @property
+    def index(self):
+        """Embedding index of the active partition, for offline jobs that scan the whole gallery"""
+        return self._index
+    
+    @_writes
+    def merge_users(self, groups: List[List[str]]) -> List[str]:
+        """
+        Fold duplicate registrations into one user per group
+        
+        The first id of each group is kept; the embeddings of the others
+        become its templates (the most recent MAX_TEMPLATES_PER_USER) and
+        their records are deleted. Rows cannot be removed from an index in
+        place, so the gallery is rebuilt and the whole database rewritten.
+        
+        Args:
+            groups: Lists of user ids of the same person, the user to keep first
+        
+        Returns:
+            Ids of the deleted users
+        """
+        merged = {}
+        for group in groups:
+            members = [user_id for user_id in group if user_id in self._index]
+            if len(members) < 2:
+                continue
+            keeper, others = members[0], members[1:]
+            templates = np.vstack([self._templates.get(user_id, self._index.get(user_id)[None, :])
+                                   for user_id in members])[-config.MAX_TEMPLATES_PER_USER:]
+            merged[keeper] = (others, templates)
+        removed = {user_id for others, _ in merged.values() for user_id in others}
+        if not removed:
+            return []
+        
+        self._remove_users(removed)
+        
+        updated = []
+        for keeper, (others, templates) in merged.items():
+            user = self._users_by_id[keeper]
+            record = dict(user, merged_user_ids=user.get('merged_user_ids', []) + others)
+            self.users[self._user_positions[keeper]] = record
+            self._users_by_id[keeper] = record
+            self._set_templates(keeper, templates)
+            updated.append((dict(record, face_templates=templates.tolist()), self._index.get(keeper)))
+        
+        # The saved structure described the old rows
+        self._index.maybe_train()
+        self.save_index()
+        
+        if self._sql_store is not None:
+            self._sql_store.delete_users(sorted(removed))
+            self._sql_store.replace_users(updated)
+        else:
+            self.save_database()
+        
+        logger.info("Merged duplicate registrations", extra={'removed': len(removed), 'users': len(merged)})
+        return sorted(removed)
+    
+    def _remove_users(self, removed: set):
+        """Drop users from memory; rows cannot be removed from an index in place, so it is rebuilt"""
+        # Copy the surviving rows into a fresh index, a block at a time
+        kept_ids = [user_id for user_id in self._index.ids if user_id not in removed]
+        rows = np.array([self._index.row_of(user_id) for user_id in kept_ids], dtype=np.int64)
+        index = self._new_index()
+        for start in range(0, len(rows), 65536):
+            index.add_batch(kept_ids[start:start + 65536], self._index.vectors(rows[start:start + 65536]))
+        
+        # Index before the lookup dict (see find_top_matches)
+        self._index = index
+        self.users = [user for user in self.users if user['user_id'] not in removed]
+        self._users_by_id = {user['user_id']: user for user in self.users}
+        self._user_positions = {user['user_id']: position for position, user in enumerate(self.users)}
+        for user_id in removed:
+            self._remove_from_other_partition(user_id)
+        self._templates = {user_id: templates for user_id, templates in self._templates.items() if user_id not in removed}
+        if self.match_cache is not None:
+            self.match_cache.clear()
     
     def get_user_count(self) -> int:
         """Get total number of users in database"""
+        self._refresh_if_stale()
         return len(self.users)
     
+    def get_cache_stats(self) -> Optional[Dict]:
+        """Match cache metrics, or None when the cache is disabled"""
+        return self.match_cache.get_stats() if self.match_cache is not None else None
+    
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        """Get one user record by id"""
+        return self._users_by_id.get(user_id)
+    
     def get_all_users(self) -> List[Dict]:
         """Get all user records"""
+        self._refresh_if_stale()
         return self.users
@@ -0,0 +1,73 @@
+"""
+Structured Logging Module
+Loggers that write one line per record, as JSON or as text with key=value fields
+
+Values passed with extra= become separate fields instead of being
+formatted into the message, e.g.
+    logger.info("Match found", extra={'user_id': user_id, 'distance': 0.41})
+"""
+
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+import config
+
+ROOT_LOGGER = 'facerec'
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message and the extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        # numpy scalars become numbers, anything else unknown its str()
+        return json.dumps(entry, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with the extra fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def _configure():
+    root = logging.getLogger(ROOT_LOGGER)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if config.LOG_FORMAT == 'json' else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL.upper())
+    # The server (e.g. gunicorn) may configure the root logger as well
+    root.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for one module, e.g. get_logger('storage')"""
+    _configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
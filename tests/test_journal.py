@@ -0,0 +1,48 @@
+"""
+Journal Tests
+Sealing and replaying the registration write-ahead log
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+from journal import Journal, read_entries
+
+
+def user_ids(path):
+    return [record['user_id'] for record, _ in read_entries(path)]
+
+
+def test_seal_moves_entries_aside(tmp_path):
+    journal = Journal(str(tmp_path / 'users.journal.jsonl'))
+    journal.open()
+    journal.append({'user_id': 'a'})
+
+    sealed = journal.seal()
+    journal.append({'user_id': 'b'})
+
+    assert user_ids(sealed) == ['a']
+    assert user_ids(journal.path) == ['b']
+    assert journal.entry_count == 1
+
+
+def test_seal_keeps_entries_of_a_failed_compaction(tmp_path):
+    journal = Journal(str(tmp_path / 'users.journal.jsonl'))
+    journal.open()
+    journal.append({'user_id': 'a'})
+    journal.seal()  # Its compaction failed, so the sealed file is still there
+
+    journal.append({'user_id': 'b'})
+    sealed = journal.seal()
+    journal.append({'user_id': 'c'})
+
+    assert user_ids(sealed) == ['a', 'b']
+    assert user_ids(journal.path) == ['c']
+    assert journal.entry_count == 1
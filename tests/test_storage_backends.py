@@ -0,0 +1,150 @@
+"""
+Storage Backend Tests
+Runs the same add / find / delete / reload cases against the JSON, binary
+and SQL (SQLite) stores
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+import config
+from storage_manager import StorageManager
+
+DIM = 128
+THRESHOLD = 0.7  # Random 128-d gallery vectors are far further apart than this
+
+
+@pytest.fixture(params=['json', 'binary', 'sql'])
+def open_store(request, tmp_path, monkeypatch):
+    """Factory for managers over one store; every call is a fresh process' view of it"""
+    monkeypatch.setattr(config, 'DISTANCE_METRIC', 'euclidean')
+    if request.param == 'sql':
+        pytest.importorskip('sqlalchemy')
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///' + str(tmp_path / 'users.db'))
+    else:
+        monkeypatch.delenv('DATABASE_URL', raising=False)
+    database_path = str(tmp_path / 'users_database.json')
+    managers = []
+
+    def open_manager():
+        manager = StorageManager(database_path, storage_format=request.param)
+        managers.append(manager)
+        return manager
+
+    yield open_manager
+
+    for manager in managers:
+        if manager._compaction is not None:
+            manager._compaction.join()
+        if manager._sql_store is not None:
+            manager._sql_store.close()
+
+
+@pytest.fixture
+def embeddings():
+    return np.random.default_rng(0).standard_normal((6, DIM)).astype(np.float32)
+
+
+def near(embedding: np.ndarray) -> np.ndarray:
+    """A new capture of the same face"""
+    return embedding + np.float32(0.01)
+
+
+def test_add_and_find(open_store, embeddings):
+    storage = open_store()
+    user_id = storage.add_user({'name': 'Ada'}, embeddings[0])
+    storage.add_users([({'name': str(i)}, embedding) for i, embedding in enumerate(embeddings[1:])])
+
+    match = storage.find_matching_user(near(embeddings[0]), THRESHOLD)
+    assert match['user_id'] == user_id
+    assert match['data']['name'] == 'Ada'
+    assert storage.get_user_count() == len(embeddings)
+
+
+def test_unknown_face_is_not_matched(open_store, embeddings):
+    storage = open_store()
+    storage.add_users([({'name': str(i)}, embedding) for i, embedding in enumerate(embeddings[:-1])])
+
+    assert storage.find_matching_user(embeddings[-1], THRESHOLD) is None
+
+
+def test_reload(open_store, embeddings):
+    storage = open_store()
+    ids = storage.add_users([({'name': str(i)}, embedding) for i, embedding in enumerate(embeddings)])
+    storage.add_template(ids[1], near(embeddings[1]))
+
+    reloaded = open_store()
+    assert reloaded.get_user_count() == len(embeddings)
+    assert reloaded.template_count(ids[1]) == 2
+    for user_id, embedding in zip(ids, embeddings):
+        assert reloaded.find_matching_user(near(embedding), THRESHOLD)['user_id'] == user_id
+
+
+def test_delete(open_store, embeddings):
+    storage = open_store()
+    ids = storage.add_users([({'name': str(i)}, embedding) for i, embedding in enumerate(embeddings)])
+
+    # Deleting a duplicate registration folds it into the user that is kept
+    assert storage.merge_users([[ids[0], ids[1]]]) == [ids[1]]
+    assert storage.get_user(ids[1]) is None
+    assert storage.find_matching_user(near(embeddings[1]), THRESHOLD)['user_id'] == ids[0]
+
+    reloaded = open_store()
+    assert reloaded.get_user_count() == len(embeddings) - 1
+    assert reloaded.get_user(ids[1]) is None
+    assert reloaded.find_matching_user(near(embeddings[1]), THRESHOLD)['user_id'] == ids[0]
+    assert reloaded.find_matching_user(near(embeddings[2]), THRESHOLD)['user_id'] == ids[2]
+
+
+def test_sql_refresh_picks_up_rows_committed_out_of_order(open_store, embeddings):
+    storage = open_store()
+    if storage.storage_format != 'sql':
+        pytest.skip("only the SQL store is polled by other processes")
+    from sql_store import users_table
+
+    worker = open_store()
+    ids = storage.add_users([({'name': str(i)}, embedding) for i, embedding in enumerate(embeddings[:3])])
+    worker.refresh()
+    assert worker.get_user_count() == 3
+
+    # A transaction that took seq 10 commits after one that took seq 11 was polled
+    def insert(seq, user_id, embedding):
+        with storage._sql_store.engine.begin() as conn:
+            row = storage._sql_store._to_row({'user_id': user_id, 'data': {}}, embedding)
+            conn.execute(users_table.insert(), [dict(row, seq=seq)])
+
+    insert(11, 'later', embeddings[3])
+    worker.refresh()
+    insert(10, 'earlier', embeddings[4])
+    worker.refresh()
+
+    assert worker.get_user_count() == 5
+    assert worker.find_matching_user(near(embeddings[4]), THRESHOLD)['user_id'] == 'earlier'
+    assert worker.find_matching_user(near(embeddings[0]), THRESHOLD)['user_id'] == ids[0]
+
+
+def test_sql_refresh_drops_users_deleted_by_another_process(open_store, embeddings):
+    storage = open_store()
+    if storage.storage_format != 'sql':
+        pytest.skip("only the SQL store is polled by other processes")
+
+    worker = open_store()
+    ids = storage.add_users([({'name': str(i)}, embedding) for i, embedding in enumerate(embeddings)])
+    worker.refresh()
+    storage.merge_users([[ids[0], ids[1]]])
+    worker.refresh()
+
+    assert worker.get_user(ids[1]) is None
+    assert worker.get_user_count() == len(embeddings) - 1
+    assert worker.template_count(ids[0]) == 2
+    assert worker.find_matching_user(near(embeddings[1]), THRESHOLD)['user_id'] == ids[0]
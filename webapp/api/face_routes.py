@@ -2,87 +2,253 @@
 Face Detection and Recognition API Routes
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 import base64
-import numpy as np
-import cv2
-import sys
-import os
-
-# Add root and shared directories to path
-root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-sys.path.append(root_dir)
-sys.path.append(os.path.join(root_dir, 'shared'))
+import time
 
+# The shared modules are on sys.path via app.py
 from face_recognition_module import FaceRecognitionModule
-from storage_manager import StorageManager
+from inference_pool import PoolSaturatedError
+from batch_scheduler import MicroBatcher
+from face_tracker import TrackerRegistry, box_iou
+from frame_gate import FrameGateRegistry
+from detection_scale import DetectionScaleRegistry, decode, scale_faces
+from face_crops import FaceCropStore
+from reembedding import ReembeddingJob
+from metrics import COUNT_BUCKETS, REGISTRY, span
+from structured_logging import get_logger
 import config
 
 bp = Blueprint('face', __name__, url_prefix='/api/face')
+logger = get_logger('face_routes')
+
+FACES_PER_FRAME = REGISTRY.histogram(
+    'face_faces_per_frame', 'Faces found in each analysed frame', ['source'], buckets=COUNT_BUCKETS
+)
 
 # Modules will be initialized when app starts
 face_module = None
 storage = None
+inference_pool = None
+embedding_batcher = None
+face_crops = None
+reembedding_job = None
+
+# Per-client face tracks used to skip re-recognizing faces that stay in view
+face_trackers = TrackerRegistry()
+
+# Per-client gates that skip the detector for unchanged or empty frames
+frame_gates = FrameGateRegistry()
+
+# Per-client reduction factors for decoding frames before detection
+detection_scales = DetectionScaleRegistry()
 
-def init_modules(face_mod, stor):
+# Latency of the first request to each endpoint, reported by /api/status
+first_request_seconds = {}
+
+def init_modules(face_mod, stor, pool=None):
     """Initialize modules from main app"""
-    global face_module, storage
+    global face_module, storage, inference_pool, embedding_batcher, face_crops, reembedding_job
     face_module = face_mod
     storage = stor
+    inference_pool = pool
+    
+    # Enrolled crops let users be re-embedded after a model change
+    if config.STORE_FACE_CROPS:
+        face_crops = FaceCropStore(config.FACE_CROPS_DIR)
+        reembedding_job = ReembeddingJob(
+            storage, face_crops, lambda faces: run_inference('get_face_embeddings', faces)
+        )
+    
+    if config.MICROBATCH_ENABLED:
+        # Let every pool worker process a batch at the same time
+        embedding_batcher = MicroBatcher(
+            lambda faces: run_inference('get_face_embeddings', faces),
+            max_batch_size=config.MICROBATCH_MAX_SIZE,
+            max_wait_ms=config.MICROBATCH_MAX_WAIT_MS,
+            dispatchers=pool.workers if pool is not None else 1
+        )
 
-def decode_image(image_data):
-    """Decode base64 image to numpy array"""
+def run_inference(method, *args):
+    """
+    Call a FaceRecognitionModule method, on the inference pool when one is configured
+    
+    Raises:
+        PoolSaturatedError: If the pool queue is full
+    """
+    if inference_pool is None:
+        return getattr(face_module, method)(*args)
+    return inference_pool.call(method, *args)
+
+def embed_face(img, face_region):
+    """Embedding for one face, merged with concurrent requests when micro-batching is on"""
+    if embedding_batcher is None:
+        return run_inference('get_face_embedding', img, face_region)
+    return embedding_batcher.submit((img, face_region)).result(timeout=config.INFERENCE_TIMEOUT)
+
+def busy_response():
+    """HTTP 503 telling the client to retry once the inference queue drains"""
+    response = jsonify({'error': 'Server busy, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_request
+def record_first_request(response):
+    """Remember how long the first call to each endpoint took"""
+    if request.endpoint not in first_request_seconds and 'request_started' in g:
+        first_request_seconds[request.endpoint] = round(time.perf_counter() - g.request_started, 3)
+    return response
+
+def decode_base64(image_data):
+    """Encoded image bytes from a base64 string or data URL, or None if invalid"""
     try:
         # Remove data URL prefix if present
         if ',' in image_data:
             image_data = image_data.split(',')[1]
         
-        # Decode base64
-        img_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        return img
+        with span('base64_decode'):
+            return base64.b64decode(image_data)
+    except Exception as e:
+        logger.warning("Error decoding image", extra={'error': str(e)})
+        return None
+
+def decode_image(image_data):
+    """Decode base64 image to numpy array"""
+    img_bytes = decode_base64(image_data)
+    return decode_image_bytes(img_bytes) if img_bytes is not None else None
+
+def decode_image_bytes(img_bytes):
+    """Decode raw encoded image bytes (e.g. a JPEG frame) to numpy array"""
+    try:
+        return decode(img_bytes)
+    except Exception as e:
+        logger.warning("Error decoding image", extra={'error': str(e)})
+        return None
+
+def decode_frame(img_bytes, session_id=None):
+    """
+    Decode a frame for face detection, reduced in size when the session allows it
+    
+    Returns:
+        ScaledFrame, or None if the bytes are not a valid image
+    """
+    if img_bytes is None:
+        return None
+    try:
+        frame = detection_scales.decode(session_id, img_bytes)
     except Exception as e:
-        print(f"Error decoding image: {e}")
+        logger.warning("Error decoding image", extra={'error': str(e)})
         return None
+    return frame if frame.image is not None else None
+
+def embed_crops(frame, faces):
+    """
+    Add 'embedding' to detected faces, computed from full-resolution crops
+    
+    The boxes are cut from the full frame, the same way /register and
+    /recognize embed a client box, so a reduced detection frame does not
+    lower the quality of the crops the gallery is matched with.
+    """
+    crops = [frame.crop(face) for face in faces]
+    embeddings = run_inference(
+        'get_face_embeddings', [(crop, FaceRecognitionModule._whole_image_region(crop)) for crop in crops]
+    )
+    for face, embedding in zip(faces, embeddings):
+        face['embedding'] = embedding
+    return faces
+
+def detect_gated(frame, session_id=None):
+    """Detected faces with their gender, through the session's frame gate when gating is on"""
+    # Boxes are returned in the coordinates of the image that was sent
+    analyze = lambda img: scale_faces(run_inference('analyze_frame', img, ('gender',)), frame.factor)
+    if config.FRAME_GATE_ENABLED and session_id:
+        return frame_gates.run(session_id, frame.image, analyze)
+    return analyze(frame.image)
+
+def detected_box(frame, session_id, client_box):
+    """
+    The box of the face the server detects in a frame at a client box, or None
+    
+    Goes through the same frame gate as /detect, so recognizing the frame a
+    client just ran /detect on reuses that detection.
+    """
+    boxes = [{key: face['facial_area'].get(key, 0) for key in ('x', 'y', 'w', 'h')}
+             for face in detect_gated(frame, session_id)]
+    best = max(boxes, key=lambda box: box_iou(box, client_box), default=None)
+    if best is None or box_iou(best, client_box) < config.TRACK_IOU_THRESHOLD:
+        return None
+    return best
+
+def face_region_from_request(face_data):
+    """Build a detect_faces-style face region from a client {x, y, w, h} box"""
+    return {
+        'facial_area': {
+            'x': face_data.get('x', 0),
+            'y': face_data.get('y', 0),
+            'w': face_data.get('w', 100),
+            'h': face_data.get('h', 100)
+        }
+    }
+
+def save_face_crop(user_id, img, face_region):
+    """Keep the crop a user was enrolled with, for re-embedding after a model change"""
+    if face_crops is None:
+        return
+    try:
+        face_crops.save(user_id, FaceRecognitionModule._crop_face(img, face_region))
+    except Exception:
+        logger.exception("Error saving face crop", extra={'user_id': user_id})
+
+def user_summary(user):
+    """Public fields of a matched user record"""
+    return {
+        'id': user['user_id'],
+        'data': user['data'],
+        'timestamp': user['timestamp']
+    }
 
 @bp.route('/detect', methods=['POST'])
 def detect_face():
     """
     Detect faces in the provided image
     
-    Request: {image: "base64_encoded_image"}
+    Request: {image: "base64_encoded_image", client_id: optional}
     Response: {faces: [{x, y, w, h, confidence, gender}]}
+    
+    Clients that send a stable client_id get frame gating: a frame that did
+    not change, or holds no face candidate, skips the detector.
     """
     try:
         data = request.get_json()
         if not data or 'image' not in data:
             return jsonify({'error': 'No image provided'}), 400
         
-        # Decode image
-        img = decode_image(data['image'])
-        if img is None:
+        # Decode image, reduced for the detector when the client is known
+        session_id = f"http:{data['client_id']}" if data.get('client_id') else None
+        frame = decode_frame(decode_base64(data['image']), session_id)
+        if frame is None:
             return jsonify({'error': 'Invalid image data'}), 400
         
-        # Detect faces
-        faces = face_module.detect_faces(img)
+        # Detect faces once and classify gender on the aligned crops
+        faces = detect_gated(frame, session_id)
+        detection_scales.observe(session_id, frame, faces)
+        FACES_PER_FRAME.observe(len(faces), source='detect')
         
         result_faces = []
         for face in faces:
-            facial_area = face.get('facial_area', {})
-            confidence = face.get('confidence', 0)
-            
-            # Analyze for gender
-            analysis = face_module.analyze_face(img, face)
-            gender = face_module.get_gender_from_analysis(analysis)
-            
+            facial_area = face['facial_area']
             result_faces.append({
                 'x': facial_area.get('x', 0),
                 'y': facial_area.get('y', 0),
                 'w': facial_area.get('w', 0),
                 'h': facial_area.get('h', 0),
-                'confidence': confidence,
-                'gender': gender
+                'confidence': face['confidence'],
+                'gender': face['gender']
             })
         
         return jsonify({
@@ -91,10 +257,10 @@ def detect_face():
             'count': len(result_faces)
         })
     
+    except PoolSaturatedError:
+        return busy_response()
     except Exception as e:
-        print(f"Error in detect_face: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in detect_face")
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/recognize', methods=['POST'])
@@ -102,32 +268,51 @@ def recognize_face():
     """
     Recognize a face and check if it matches existing users
     
-    Request: {image: "base64_encoded_image", face: {x, y, w, h}}
+    Request: {image: "base64_encoded_image", face: {x, y, w, h}, client_id: optional}
     Response: {recognized: true/false, user: {...} or null}
+    
+    Clients that send a stable client_id get face tracking: while the same
+    face stays in view, the last result is returned without running the model.
+    A track only continues through a face the server itself detects in the
+    image at the client's box, never through the client's box alone.
     """
     try:
         data = request.get_json()
         if not data or 'image' not in data:
             return jsonify({'error': 'No image provided'}), 400
         
-        # Decode image
-        img = decode_image(data['image'])
-        if img is None:
-            return jsonify({'error': 'Invalid image data'}), 400
-        
         # Get face region
         face_data = data.get('face', {})
-        face_region = {
-            'facial_area': {
-                'x': face_data.get('x', 0),
-                'y': face_data.get('y', 0),
-                'w': face_data.get('w', 100),
-                'h': face_data.get('h', 100)
-            }
-        }
+        face_region = face_region_from_request(face_data)
+        
+        img_bytes = decode_base64(data['image'])
+        tracker = track = None
+        if config.TRACKING_ENABLED and data.get('client_id'):
+            session_id = f"http:{data['client_id']}"
+            frame = decode_frame(img_bytes, session_id)
+            if frame is None:
+                return jsonify({'error': 'Invalid image data'}), 400
+            
+            # Any image could be sent with a tracked box, so only a face
+            # detected in this one may inherit the track's cached identity
+            box = detected_box(frame, session_id, face_region['facial_area'])
+            needs_recognition = True
+            if box is not None:
+                tracker = face_trackers.get(session_id)
+                gallery_version = storage.get_user_count()
+                track, needs_recognition = tracker.update([box], gallery_version)[0]
+            face_trackers.record(1, int(needs_recognition))
+            if not needs_recognition:
+                return jsonify(dict(track.result, track_id=track.track_id))
+            img = frame.full
+        else:
+            # Decode image
+            img = decode_image_bytes(img_bytes) if img_bytes is not None else None
+        if img is None:
+            return jsonify({'error': 'Invalid image data'}), 400
         
         # Generate face embedding
-        face_embedding = face_module.get_face_embedding(img, face_region)
+        face_embedding = embed_face(img, face_region)
         
         if face_embedding is None:
             return jsonify({'error': 'Could not generate face embedding'}), 400
@@ -135,27 +320,82 @@ def recognize_face():
         # Check against database
         matching_user = storage.find_matching_user(face_embedding)
         
-        if matching_user:
-            return jsonify({
-                'success': True,
-                'recognized': True,
-                'user': {
-                    'id': matching_user['user_id'],
-                    'data': matching_user['data'],
-                    'timestamp': matching_user['timestamp']
-                }
-            })
-        else:
-            return jsonify({
-                'success': True,
-                'recognized': False,
-                'user': None
+        result = {
+            'success': True,
+            'recognized': matching_user is not None,
+            'user': user_summary(matching_user) if matching_user else None
+        }
+        if track is not None:
+            tracker.mark_recognized(track, result, gallery_version)
+            result = dict(result, track_id=track.track_id)
+        return jsonify(result)
+    
+    except PoolSaturatedError:
+        return busy_response()
+    except Exception as e:
+        logger.exception("Error in recognize_face")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/recognize_batch', methods=['POST'])
+def recognize_faces_batch():
+    """
+    Recognize many faces, from one or more frames, in a single model pass
+    
+    Request: {images: ["base64_encoded_image", ...], faces: [{image: 0, x, y, w, h}, ...]}
+             (a single {image: "..."} is also accepted; face.image defaults to 0)
+    Response: {results: [{face: {...}, recognized: true/false, user: {...} or null}]}
+    """
+    try:
+        data = request.get_json()
+        if not data or not ('images' in data or 'image' in data):
+            return jsonify({'error': 'No image provided'}), 400
+        
+        faces_data = data.get('faces', [])
+        if not faces_data:
+            return jsonify({'error': 'No faces provided'}), 400
+        if len(faces_data) > config.MAX_RECOGNITION_BATCH:
+            return jsonify({'error': f'At most {config.MAX_RECOGNITION_BATCH} faces per request'}), 400
+        
+        # Decode every frame once, however many faces it holds
+        images = []
+        for image_data in data.get('images', [data.get('image')]):
+            img = decode_image(image_data) if image_data else None
+            if img is None:
+                return jsonify({'error': 'Invalid image data'}), 400
+            images.append(img)
+        
+        faces = []
+        for face_data in faces_data:
+            image_index = face_data.get('image', 0)
+            if not 0 <= image_index < len(images):
+                return jsonify({'error': f'Face refers to missing image {image_index}'}), 400
+            faces.append((images[image_index], face_region_from_request(face_data)))
+        
+        # One batched forward pass for all faces
+        embeddings = run_inference('get_face_embeddings', faces)
+        
+        results = []
+        for face_data, face_embedding in zip(faces_data, embeddings):
+            matching_user = None
+            if face_embedding is not None:
+                matching_user = storage.find_matching_user(face_embedding)
+            results.append({
+                'face': face_data,
+                'recognized': matching_user is not None,
+                'user': user_summary(matching_user) if matching_user else None,
+                'error': None if face_embedding is not None else 'Could not generate face embedding'
             })
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'count': len(results)
+        })
     
+    except PoolSaturatedError:
+        return busy_response()
     except Exception as e:
-        print(f"Error in recognize_face: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in recognize_faces_batch")
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/register', methods=['POST'])
@@ -163,8 +403,11 @@ def register_user():
     """
     Register a new user with face embedding
     
+    A face that already matches a registered user is added to that user as
+    another template instead of creating a duplicate record.
+    
     Request: {image: "base64_encoded_image", face: {x, y, w, h}, userData: {...}}
-    Response: {success: true, user_id: "..."}
+    Response: {success: true, user_id: "...", templates: n}
     """
     try:
         data = request.get_json()
@@ -178,21 +421,26 @@ def register_user():
         
         # Get face region
         face_data = data.get('face', {})
-        face_region = {
-            'facial_area': {
-                'x': face_data.get('x', 0),
-                'y': face_data.get('y', 0),
-                'w': face_data.get('w', 100),
-                'h': face_data.get('h', 100)
-            }
-        }
+        face_region = face_region_from_request(face_data)
         
         # Generate face embedding
-        face_embedding = face_module.get_face_embedding(img, face_region)
+        face_embedding = embed_face(img, face_region)
         
         if face_embedding is None:
             return jsonify({'error': 'Could not generate face embedding'}), 400
         
+        # Re-enrolment of a known face
+        matching_user = storage.find_matching_user(face_embedding)
+        if matching_user:
+            templates = storage.add_template(matching_user['user_id'], face_embedding)
+            save_face_crop(matching_user['user_id'], img, face_region)
+            return jsonify({
+                'success': True,
+                'user_id': matching_user['user_id'],
+                'templates': templates,
+                'message': 'Face added to existing user'
+            })
+        
         # Get user data
         user_data = data['userData']
         
@@ -202,15 +450,79 @@ def register_user():
         
         # Save to database
         user_id = storage.add_user(user_data, face_embedding)
+        save_face_crop(user_id, img, face_region)
         
         return jsonify({
             'success': True,
             'user_id': user_id,
+            'templates': 1,
             'message': 'User registered successfully'
         })
     
+    except PoolSaturatedError:
+        return busy_response()
+    except Exception as e:
+        logger.exception("Error in register_user")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/users/<user_id>/templates', methods=['POST'])
+def add_user_template(user_id):
+    """
+    Enrol another capture of an existing user's face
+    
+    Request: {image: "base64_encoded_image", face: {x, y, w, h}}
+    Response: {success: true, user_id: "...", templates: n}
+    """
+    try:
+        data = request.get_json()
+        if not data or 'image' not in data:
+            return jsonify({'error': 'No image provided'}), 400
+        if storage.template_count(user_id) == 0:
+            return jsonify({'error': 'Unknown user'}), 404
+        
+        img = decode_image(data['image'])
+        if img is None:
+            return jsonify({'error': 'Invalid image data'}), 400
+        
+        face_region = face_region_from_request(data.get('face', {}))
+        face_embedding = embed_face(img, face_region)
+        if face_embedding is None:
+            return jsonify({'error': 'Could not generate face embedding'}), 400
+        
+        templates = storage.add_template(user_id, face_embedding)
+        save_face_crop(user_id, img, face_region)
+        return jsonify({'success': True, 'user_id': user_id, 'templates': templates})
+    
+    except PoolSaturatedError:
+        return busy_response()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Error in register_user: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in add_user_template")
         return jsonify({'error': str(e)}), 500
+
+@bp.route('/reembed', methods=['GET'])
+def reembedding_progress():
+    """
+    Progress of the re-embedding job and the size of every gallery partition
+    
+    Response: {partitions: [...], job: {state, processed, total, eta_seconds, ...}}
+    """
+    return jsonify({
+        'partitions': storage.get_partitions(),
+        'job': reembedding_job.get_progress() if reembedding_job else None
+    })
+
+@bp.route('/reembed', methods=['POST'])
+def start_reembedding():
+    """
+    Re-embed users enrolled with another model from their stored face crops
+    
+    Runs in the background; recognition keeps using the active partition,
+    which grows as users are migrated. Poll GET /reembed for progress.
+    """
+    if reembedding_job is None:
+        return jsonify({'error': 'Face crops are not stored (STORE_FACE_CROPS=false)'}), 400
+    if not reembedding_job.start():
+        return jsonify({'error': 'Re-embedding is already running', 'job': reembedding_job.get_progress()}), 409
+    return jsonify({'success': True, 'pending_users': len(storage.users_to_migrate())}), 202
@@ -0,0 +1,170 @@
+"""
+Live Stream WebSocket Events
+Receives raw binary JPEG frames over Socket.IO and pushes detection and
+recognition results back on the same socket
+"""
+
+from flask import request
+from flask_socketio import emit
+import time
+
+from inference_pool import PoolSaturatedError
+from api import face_routes
+from metrics import REGISTRY
+from detection_scale import scale_faces
+from face_recognition_module import confident_faces
+from structured_logging import get_logger
+import config
+
+logger = get_logger('stream_events')
+
+FRAMES = REGISTRY.counter('face_stream_frames_total', 'Live stream frames by outcome', ['outcome'])
+FRAME_SECONDS = REGISTRY.histogram('face_stream_frame_seconds', 'Server time per processed live stream frame')
+
+# Sessions with a frame currently being processed
+busy_sessions = set()
+
+def face_box(face):
+    """{x, y, w, h} of a detected face"""
+    facial_area = face['facial_area']
+    return {
+        'x': facial_area.get('x', 0),
+        'y': facial_area.get('y', 0),
+        'w': facial_area.get('w', 0),
+        'h': facial_area.get('h', 0)
+    }
+
+def face_result(face, mode):
+    """Client-facing result for an analyzed face, matched against the gallery in recognize mode"""
+    result = dict(face_box(face), confidence=face['confidence'], gender=face['gender'])
+    if mode == 'recognize':
+        matching_user = None
+        if face.get('embedding') is not None:
+            matching_user = face_routes.storage.find_matching_user(face['embedding'])
+        result['recognized'] = matching_user is not None
+        result['user'] = face_routes.user_summary(matching_user) if matching_user else None
+    return result
+
+def process_frame(frame, mode, session_id=None):
+    """
+    Detect faces in a frame and, in recognize mode, match them against the gallery
+    
+    Detection runs on the frame as decoded for the session, possibly at a
+    reduced size; boxes are mapped back to full resolution and embeddings
+    are computed from full-resolution crops.
+    With tracking enabled, faces that stay in view reuse their last result
+    and only new or stale tracks go through the gender and embedding models.
+    With frame gating, unchanged or empty frames skip the detector as well.
+    
+    Args:
+        frame: ScaledFrame from face_routes.decode_frame
+    
+    Returns:
+        List of face result dictionaries
+    """
+    def embed(faces):
+        return face_routes.embed_crops(frame, faces) if mode == 'recognize' else faces
+    
+    # Placeholder and low-confidence detections never reach the gate, the
+    # detection scale, the tracker or the embedding model
+    def detect(img):
+        if not config.TRACKING_ENABLED or session_id is None:
+            faces = confident_faces(face_routes.run_inference('analyze_frame', img, ('gender',)))
+            return embed(scale_faces(faces, frame.factor))
+        return scale_faces(confident_faces(face_routes.run_inference('detect_aligned_faces', img)), frame.factor)
+    
+    if config.FRAME_GATE_ENABLED and session_id is not None:
+        # The gate is per session and mode: a reused detection must have run the same models
+        faces = face_routes.frame_gates.run(f"{session_id}:{mode}", frame.image, detect)
+    else:
+        faces = detect(frame.image)
+    face_routes.detection_scales.observe(session_id, frame, faces)
+    face_routes.FACES_PER_FRAME.observe(len(faces), source='stream')
+    
+    if not config.TRACKING_ENABLED or session_id is None:
+        return [face_result(face, mode) for face in faces]
+    
+    tracker = face_routes.face_trackers.get(session_id)
+    gallery_version = face_routes.storage.get_user_count()
+    assignments = tracker.update([face_box(face) for face in faces], gallery_version)
+    
+    stale = [face for face, (_, needs_recognition) in zip(faces, assignments) if needs_recognition]
+    analyzed = iter(embed(face_routes.run_inference('analyze_faces', stale, ('gender',))) if stale else [])
+    face_routes.face_trackers.record(len(faces), len(stale))
+    
+    results = []
+    for face, (track, needs_recognition) in zip(faces, assignments):
+        if needs_recognition:
+            result = face_result(next(analyzed), mode)
+            tracker.mark_recognized(track, result, gallery_version)
+        else:
+            result = dict(track.result, confidence=face['confidence'], **face_box(face))
+        results.append(dict(result, track_id=track.track_id))
+    
+    return results
+
+def end_session(session_id):
+    """Release per-connection state when a socket disconnects"""
+    busy_sessions.discard(session_id)
+    face_routes.face_trackers.drop(session_id)
+    face_routes.detection_scales.drop(session_id)
+    for mode in ('detect', 'recognize'):
+        face_routes.frame_gates.drop(f"{session_id}:{mode}")
+
+def register_events(socketio):
+    """Register the live stream handlers on the app's SocketIO instance"""
+    
+    @socketio.on('frame')
+    def handle_frame(payload):
+        """
+        Process one binary frame
+        
+        Payload: {image: <JPEG bytes>, mode: "detect"|"recognize", seq: int, client_ts: number}
+        Emits: frame_result {seq, client_ts, faces, timings} or frame_dropped {seq, reason}
+        """
+        started = time.perf_counter()
+        payload = payload or {}
+        seq = payload.get('seq')
+        
+        # A client that sends faster than we process gets frames dropped
+        # rather than an ever-growing backlog
+        if request.sid in busy_sessions:
+            FRAMES.inc(outcome='busy')
+            emit('frame_dropped', {'seq': seq, 'reason': 'busy'})
+            return
+        
+        busy_sessions.add(request.sid)
+        try:
+            frame = face_routes.decode_frame(payload.get('image') or b'', request.sid)
+            if frame is None:
+                FRAMES.inc(outcome='invalid')
+                emit('frame_dropped', {'seq': seq, 'reason': 'invalid image'})
+                return
+            decoded = time.perf_counter()
+            
+            faces = process_frame(frame, payload.get('mode', 'recognize'), request.sid)
+            finished = time.perf_counter()
+            FRAMES.inc(outcome='processed')
+            FRAME_SECONDS.observe(finished - started)
+            
+            emit('frame_result', {
+                'seq': seq,
+                'client_ts': payload.get('client_ts'),
+                'faces': faces,
+                'timings': {
+                    'payload_bytes': len(payload.get('image')),
+                    'decode_ms': round((decoded - started) * 1000, 2),
+                    'inference_ms': round((finished - decoded) * 1000, 2),
+                    'server_ms': round((finished - started) * 1000, 2)
+                }
+            })
+        
+        except PoolSaturatedError:
+            FRAMES.inc(outcome='busy')
+            emit('frame_dropped', {'seq': seq, 'reason': 'busy'})
+        except Exception as e:
+            FRAMES.inc(outcome='error')
+            logger.exception("Error in handle_frame")
+            emit('frame_dropped', {'seq': seq, 'reason': str(e)})
+        finally:
+            busy_sessions.discard(request.sid)
@@ -3,17 +3,12 @@ User Management API Routes
 """
 
 from flask import Blueprint, request, jsonify
-import sys
-import os
 
-# Add root and shared directories to path
-root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-sys.path.append(root_dir)
-sys.path.append(os.path.join(root_dir, 'shared'))
-
-from storage_manager import StorageManager
+# The shared modules are on sys.path via app.py
+from structured_logging import get_logger
 
 bp = Blueprint('user', __name__, url_prefix='/api/user')
+logger = get_logger('user_routes')
 
 # Storage will be initialized when app starts
 storage = None
@@ -46,7 +41,7 @@ def list_users():
         })
     
     except Exception as e:
-        print(f"Error in list_users: {e}")
+        logger.exception("Error in list_users")
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/count', methods=['GET'])
@@ -59,5 +54,5 @@ def get_user_count():
             'count': count
         })
     except Exception as e:
-        print(f"Error in get_user_count: {e}")
+        logger.exception("Error in get_user_count")
         return jsonify({'error': str(e)}), 500
@@ -3,7 +3,10 @@ Flask Web Application for Face Recognition
 Main application entry point
 """
 
-from flask import Flask, render_template, request, jsonify
+import time
+startup_began = time.perf_counter()
+
+from flask import Flask, Response, render_template, request, jsonify, g
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 import sys
@@ -14,23 +17,67 @@ root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(root_dir)
 sys.path.append(os.path.join(root_dir, 'shared'))
 
-from face_recognition_module import FaceRecognitionModule
+from face_recognition_module import FaceRecognitionModule, import_deepface
 from storage_manager import StorageManager
+from inference_pool import InferencePool
+from request_profiler import RequestProfiler
+from structured_logging import get_logger
+import metrics
 import config
 
+logger = get_logger('app')
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
 CORS(app, resources={r"/api/*": {"origins": os.environ.get('ALLOWED_ORIGINS', '*')}})
 socketio = SocketIO(app, cors_allowed_origins=os.environ.get('ALLOWED_ORIGINS', '*'))
 
-# Initialize modules
-face_module = FaceRecognitionModule()
+# Initialize modules. Models are built by init_worker(), which runs at the end
+# of this module or, with PRELOAD_APP, in each gunicorn worker after the fork.
+inference_pool = None
+face_module = FaceRecognitionModule(preload=False)
 storage = StorageManager()
+if config.PRELOAD_APP and config.PRELOAD_MODELS and not config.INFERENCE_WORKERS:
+    # Every worker will load TensorFlow: import it once here and share the
+    # pages. Importing runs nothing; the workers build the models after the fork.
+    import_deepface()
+startup_seconds = None
+
+logger.info("Face Recognition Web Application", extra={'users': storage.get_user_count()})
+
+# Request metrics for /api/metrics, and sampled cProfile dumps when PROFILE_SAMPLE_RATE is set
+REQUESTS = metrics.REGISTRY.counter('face_http_requests_total', 'API requests by endpoint and status', ['endpoint', 'status'])
+REQUEST_SECONDS = metrics.REGISTRY.histogram('face_http_request_seconds', 'API request latency', ['endpoint'])
+metrics.REGISTRY.gauge('face_gallery_users', 'Users in the searched gallery partition',
+                       callback=lambda: storage.get_partitions()[0]['users'])
+metrics.REGISTRY.gauge('face_inference_queue_depth', 'Inference calls queued or running in the worker pool',
+                       callback=lambda: inference_pool.get_status()['pending'] if inference_pool else 0)
+metrics.REGISTRY.gauge('face_microbatch_queue_depth', 'Faces waiting for a micro-batch',
+                       callback=lambda: face_routes.embedding_batcher.get_stats()['queue_depth']
+                       if face_routes.embedding_batcher else 0)
+profiler = RequestProfiler()
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.profile = profiler.start() if request.path.startswith('/api/') else None
+
+@app.after_request
+def record_request_metrics(response):
+    """Count and time API requests; write the request's profile if it was sampled"""
+    if request.path.startswith('/api/') and 'metrics_started' in g:
+        endpoint = request.endpoint or 'unknown'
+        seconds = time.perf_counter() - g.metrics_started
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+        profiler.stop(g.pop('profile', None), endpoint, seconds)
+    return response
 
-print("="*60)
-print("Face Recognition Web Application")
-print(f"Database contains {storage.get_user_count()} users")
-print("="*60)
+@app.teardown_request
+def stop_unfinished_profile(exc):
+    """after_request is skipped when a view raises; never leave a profiler running"""
+    if g.get('profile') is not None:
+        profiler.stop(g.pop('profile'), request.endpoint or 'unknown', time.perf_counter() - g.metrics_started)
 
 @app.route('/')
 def index():
@@ -39,12 +86,33 @@ def index():
 
 @app.route('/api/status', methods=['GET'])
 def status():
-    """API health check"""
+    """API health check - returns 503 until the models are warmed up"""
+    model_status = face_module.get_status()
+    if inference_pool is not None:
+        model_status['inference_pool'] = inference_pool.get_status()
+        model_status['ready'] = inference_pool.ready
+    ready = model_status.pop('ready')
     return jsonify({
-        'status': 'online',
+        'status': 'online' if ready else 'warming_up',
+        'ready': ready,
         'users_count': storage.get_user_count(),
-        'model': config.FACE_RECOGNITION_MODEL
-    })
+        'model': config.FACE_RECOGNITION_MODEL,
+        'startup': dict(model_status, app_startup_seconds=startup_seconds),
+        'first_request_seconds': face_routes.first_request_seconds,
+        'microbatch': face_routes.embedding_batcher.get_stats() if face_routes.embedding_batcher else None,
+        'tracking': face_routes.face_trackers.get_stats(),
+        'frame_gate': face_routes.frame_gates.get_stats(),
+        'detection_scale': face_routes.detection_scales.get_stats(),
+        'match_cache': storage.get_cache_stats(),
+        'shared_gallery': storage.get_shared_stats(),
+        'partitions': storage.get_partitions(),
+        'reembedding': face_routes.reembedding_job.get_progress() if face_routes.reembedding_job else None
+    }), 200 if ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latencies, request counters and gauges in the Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/api/template', methods=['GET'])
 def get_template():
@@ -58,35 +126,56 @@ def get_template():
         return jsonify({'error': str(e)}), 500
 
 # Import API routes
-from api import face_routes, user_routes
+from api import face_routes, user_routes, stream_events
 
 # Register blueprints
 app.register_blueprint(face_routes.bp)
 app.register_blueprint(user_routes.bp)
 
-# Initialize modules in routes
-face_routes.init_modules(face_module, storage)
 user_routes.init_storage(storage)
 
+def init_worker():
+    """
+    Start what must not be shared with forked processes: the model warm-up,
+    the inference pool and the threads of the face routes
+    
+    Models are built and warmed up as configured in config.py. With an
+    inference pool the models live in the pool processes instead.
+    """
+    global inference_pool, startup_seconds
+    if config.PRELOAD_APP:
+        storage.after_fork()
+    if config.INFERENCE_WORKERS:
+        inference_pool = InferencePool()
+        inference_pool.warm_up()
+    elif config.PRELOAD_MODELS:
+        face_module.preload()
+    face_routes.init_modules(face_module, storage, inference_pool)
+    startup_seconds = round(time.perf_counter() - startup_began, 3)
+
 # WebSocket events
+stream_events.register_events(socketio)
+
 @socketio.on('connect')
 def handle_connect():
     """Handle client connection"""
-    print('Client connected')
+    logger.info("Client connected", extra={'sid': request.sid})
     emit('status', {'message': 'Connected to server'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
-    print('Client disconnected')
+    stream_events.end_session(request.sid)
+    logger.info("Client disconnected", extra={'sid': request.sid})
+
+# With PRELOAD_APP, gunicorn calls init_worker in every worker (gunicorn.conf.py)
+if not config.PRELOAD_APP or __name__ == '__main__':
+    init_worker()
 
 if __name__ == '__main__':
-    print("\nStarting Flask server...")
-    print("Access the web app at: http://localhost:5000")
-    print("Press Ctrl+C to stop\n")
-    
     # Get port from environment variable (for production) or use 5000
     port = int(os.environ.get('PORT', 5000))
+    logger.info("Starting Flask server", extra={'url': f"http://localhost:{port}"})
     
     # Run with SocketIO
     socketio.run(app, host='0.0.0.0', port=port, debug=True, allow_unsafe_werkzeug=True)
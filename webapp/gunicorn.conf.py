@@ -0,0 +1,37 @@
+"""
+Gunicorn settings, read from the webapp directory (see Procfile)
+
+    WEB_CONCURRENCY=4 PRELOAD_APP=true gunicorn -c gunicorn.conf.py app:app
+
+With PRELOAD_APP=true the master imports the app once, libraries and the
+loaded gallery included, and the forked workers share those pages
+copy-on-write. Each worker then builds its own models in init_worker():
+TensorFlow is not fork-safe once it has run anything. Set PRELOAD_APP
+rather than passing --preload, so app.py knows to leave that step to the workers.
+"""
+
+import importlib
+import os
+import sys
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root_dir, 'shared'))
+
+from config import PRELOAD_APP  # A module named config would be taken as gunicorn's --config setting
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'eventlet')  # Socket.IO needs an async worker
+preload_app = PRELOAD_APP
+
+if preload_app and worker_class == 'eventlet':
+    # Workers patch the standard library only after the app is imported;
+    # patch threading first so locks created at import time are green locks.
+    # The rest stays unpatched: the master's own signal handling needs blocking I/O.
+    import eventlet
+    eventlet.monkey_patch(all=False, thread=True)
+
+
+def post_worker_init(worker):
+    """Build the models and start the background threads in each worker of a preloaded app"""
+    if preload_app:
+        module_name = worker.app.app_uri.split(':')[0]
+        importlib.import_module(module_name).init_worker()
@@ -5,16 +5,19 @@
 // Initialize modules
 const camera = new Camera();
 const faceDetection = new FaceDetection();
+const frameStream = new FrameStream();
 const voiceInput = new VoiceInput();
 
 // State
 let currentFaces = [];
 let currentImageData = null;
 let dataTemplate = null;
+let liveMode = false;
 
 // DOM Elements
 const startCameraBtn = document.getElementById('start-camera');
 const captureBtn = document.getElementById('capture');
+const liveBtn = document.getElementById('live');
 const statusEl = document.getElementById('status');
 const userCountEl = document.getElementById('user-count');
 const modelInfoEl = document.getElementById('model-info');
@@ -37,6 +40,13 @@ async function init() {
         const response = await fetch('/api/status');
         const status = await response.json();
 
+        // Models are still loading on the server (HTTP 503)
+        if (status.ready === false) {
+            updateStatus('Warming up models...', false);
+            setTimeout(init, 2000);
+            return;
+        }
+
         updateStatus('Online', true);
         userCountEl.textContent = `Users: ${status.users_count}`;
         modelInfoEl.textContent = `Model: ${status.model}`;
@@ -64,6 +74,7 @@ startCameraBtn.addEventListener('click', async () => {
     if (started) {
         startCameraBtn.disabled = true;
         captureBtn.disabled = false;
+        liveBtn.disabled = !frameStream.isAvailable();
         updateStatus('Camera active', true);
     }
 });
@@ -107,6 +118,46 @@ captureBtn.addEventListener('click', async () => {
     }
 });
 
+// Live recognition over the WebSocket stream
+liveBtn.addEventListener('click', () => {
+    liveMode = !liveMode;
+    liveBtn.textContent = liveMode ? '⏸ Stop Live' : '▶ Live';
+    captureBtn.disabled = liveMode;
+
+    if (liveMode) {
+        frameStream.connect();
+        liveLoop();
+    } else {
+        // Release the socket; the next Live click reconnects
+        frameStream.disconnect();
+        faceDetection.clearOverlay();
+    }
+});
+
+async function liveLoop() {
+    while (liveMode) {
+        // Send the next frame only after the previous result arrived
+        const blob = await camera.captureBlob();
+        const result = await frameStream.sendFrame(blob, 'recognize');
+
+        if (!liveMode) {
+            break;
+        }
+        if (!result) {
+            await new Promise((resolve) => setTimeout(resolve, 100));
+            continue;
+        }
+
+        faceDetection.drawFaceBoxes(result.faces, camera.getVideoDimensions());
+        if (result.faces.length > 0) {
+            showDetectionResult(result.faces[0]);
+            if (result.faces[0].recognized) {
+                showRecognitionResult(result.faces[0].user, true);
+            }
+        }
+    }
+}
+
 // Show detection result
 function showDetectionResult(face) {
     detectionInfoEl.innerHTML = `
@@ -272,7 +323,7 @@ userFormEl.addEventListener('submit', async (e) => {
         const result = await faceDetection.registerUser(currentImageData, face, userData);
 
         if (result.success) {
-            alert(`User registered successfully! ID: ${result.user_id}`);
+            alert(`${result.message}! ID: ${result.user_id}`);
 
             // Update user count
             const statusResponse = await fetch('/api/status');
@@ -66,6 +66,21 @@ class Camera {
         return imageData;
     }
 
+    captureBlob(quality = 0.8) {
+        if (!this.isActive) {
+            console.error('Camera is not active');
+            return Promise.resolve(null);
+        }
+
+        // Draw current video frame to canvas
+        this.ctx.drawImage(this.video, 0, 0, this.canvas.width, this.canvas.height);
+
+        // Get image as binary JPEG (no base64 overhead)
+        return new Promise((resolve) => {
+            this.canvas.toBlob(resolve, 'image/jpeg', quality);
+        });
+    }
+
     getVideoDimensions() {
         return {
             width: this.video.videoWidth,
@@ -0,0 +1,81 @@
+/**
+ * Frame Stream Module
+ * Sends binary JPEG frames over Socket.IO and receives results on the same socket
+ */
+
+class FrameStream {
+    constructor() {
+        this.socket = null;
+        this.seq = 0;
+        this.pending = new Map();
+        this.stats = { frames: 0, dropped: 0, lastRttMs: 0, lastServerMs: 0, lastPayloadBytes: 0 };
+    }
+
+    isAvailable() {
+        return typeof io !== 'undefined';
+    }
+
+    connect() {
+        if (this.socket || !this.isAvailable()) {
+            return;
+        }
+
+        this.socket = io();
+
+        this.socket.on('frame_result', (result) => {
+            const request = this.pending.get(result.seq);
+            if (!request) {
+                return;
+            }
+            this.pending.delete(result.seq);
+
+            this.stats.frames += 1;
+            this.stats.lastRttMs = performance.now() - result.client_ts;
+            this.stats.lastServerMs = result.timings.server_ms;
+            this.stats.lastPayloadBytes = result.timings.payload_bytes;
+            request.resolve(result);
+        });
+
+        this.socket.on('frame_dropped', (info) => {
+            const request = this.pending.get(info.seq);
+            if (!request) {
+                return;
+            }
+            this.pending.delete(info.seq);
+
+            this.stats.dropped += 1;
+            request.resolve(null);
+        });
+    }
+
+    disconnect() {
+        if (this.socket) {
+            this.socket.disconnect();
+            this.socket = null;
+        }
+        this.pending.forEach((request) => request.resolve(null));
+        this.pending.clear();
+    }
+
+    async sendFrame(blob, mode = 'recognize') {
+        if (!this.socket || !blob) {
+            return null;
+        }
+
+        const image = await blob.arrayBuffer();
+        const seq = ++this.seq;
+
+        return new Promise((resolve) => {
+            this.pending.set(seq, { resolve });
+            this.socket.emit('frame', {
+                image: image,
+                mode: mode,
+                seq: seq,
+                client_ts: performance.now()
+            });
+        });
+    }
+}
+
+// Export for use in other modules
+window.FrameStream = FrameStream;